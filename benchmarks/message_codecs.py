@@ -0,0 +1,85 @@
+"""
+Compare payload size and encode/decode time of each installed :class:`MessageCodec`.
+
+The payload is a subtask definition with `--kwargs-items` items in its `method_kwargs` and a
+result with the same number of items in its return value.
+
+Run from the root of the repo-
+
+    PYTHONPATH=.:lib python benchmarks/message_codecs.py --kwargs-items 10000
+"""
+import argparse
+import json
+import timeit
+
+from ayeaye.runtime.task_message import TaskComplete
+
+from fossa.control.rabbit_mq.codec import (
+    compressors,
+    decode,
+    MessageCodec,
+    serialisers,
+)
+
+
+def make_payloads(items):
+    """
+    @return: (task definition dict, task message dict)
+    """
+    rows = [{"row_id": i, "name": f"name_{i}", "value": i * 1.5} for i in range(items)]
+    task_definition = {
+        "model_class": "BenchmarkModel",
+        "method": "process_partition",
+        "method_kwargs": {"rows": rows},
+        "resolver_context": {"env": "benchmark"},
+        "model_construction_kwargs": {},
+        "partition_initialise_kwargs": {"partition": 1},
+    }
+    task_complete = TaskComplete(method_name="go", method_kwargs={}, return_value=rows)
+    task_message = json.loads(task_complete.to_json())
+    return task_definition, task_message
+
+
+def measure(codec, payload, repeat):
+    """
+    @return: (bytes, encode ms, decode ms)
+    """
+    envelope = codec.dumps(payload)
+    encode_s = timeit.timeit(lambda: codec.dumps(payload), number=repeat) / repeat
+    decode_s = (
+        timeit.timeit(
+            lambda: decode(envelope.body, envelope.content_type, envelope.content_encoding),
+            number=repeat,
+        )
+        / repeat
+    )
+    return len(envelope.body), encode_s * 1000, decode_s * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--kwargs-items", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    task_definition, task_message = make_payloads(args.kwargs_items)
+
+    codecs = []
+    for serialiser in serialisers:
+        for compression in [None] + list(compressors):
+            codec = MessageCodec(serialiser=serialiser, compression=compression)
+            if codec.is_available:
+                codecs.append(codec)
+
+    for label, payload in [("subtask", task_definition), ("result", task_message)]:
+        print(f"{label} with {args.kwargs_items} items")
+        for codec in codecs:
+            size, encode_ms, decode_ms = measure(codec, payload, args.repeat)
+            print(
+                f"{codec.name:>14}: {size:>10} bytes, encode {encode_ms:7.2f}ms, "
+                f"decode {decode_ms:7.2f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Compare how long it takes to run small tasks with each multiprocessing start method.
+
+The governor's process can hold a lot of state so optional `--ballast-mb` is allocated in the
+parent before the governor is started. With "fork" this is inherited (copy-on-write) by every
+ETL process, with "spawn" and "forkserver" it isn't.
+
+Run from the root of the repo-
+
+    PYTHONPATH=.:lib python benchmarks/process_start_methods.py --tasks 50 --ballast-mb 500
+"""
+import argparse
+import time
+
+from examples.example_etl import NothingEtl
+from fossa.control.governor import Governor
+from fossa.control.message import TaskMessage, TerminateMessage
+
+
+def ignore_callback(final_task_message, task_spec):
+    pass
+
+
+def run_tasks(start_method, execution_mode, total_tasks, concurrent_tasks):
+    """
+    @return: (float) seconds to run all the tasks, not including starting the governor
+    """
+    governor = Governor(mp_start_method=start_method)
+    governor.log_to_stdout = False
+    governor.execution_mode = execution_mode
+    governor.runtime.max_concurrent_tasks = concurrent_tasks
+    governor.set_accepted_class(NothingEtl)
+    governor_proc = governor.start_internal_processes()
+
+    start_time = time.time()
+    for task_number in range(total_tasks):
+        task_spec = TaskMessage(
+            task_id=f"benchmark_{task_number}",
+            model_class="NothingEtl",
+            method="go",
+            method_kwargs={},
+            resolver_context={},
+            on_completion_callback=ignore_callback,
+        )
+        governor.submit_task(task_spec, blocking=True)
+
+    while len(governor.previous_tasks) < total_tasks:
+        time.sleep(0.01)
+
+    elapsed = time.time() - start_time
+
+    governor._task_queue_submit.put(TerminateMessage())
+    governor_proc.join()
+    governor.mp_manager.shutdown()
+
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--tasks", type=int, default=20)
+    parser.add_argument("--concurrent", type=int, default=2)
+    parser.add_argument("--ballast-mb", type=int, default=0, help="memory held by the parent")
+    parser.add_argument(
+        "--execution-mode", default="process_per_task", choices=["process_per_task", "worker_pool"]
+    )
+    args = parser.parse_args()
+
+    # Simulate a large parent process. Touch each page so the memory is really allocated.
+    ballast = bytearray(args.ballast_mb * 1024 * 1024)
+    for offset in range(0, len(ballast), 4096):
+        ballast[offset] = 1
+
+    print(f"{args.tasks} tasks, {args.concurrent} concurrent, {args.ballast_mb}MB ballast")
+    for start_method in ["fork", "spawn", "forkserver"]:
+        elapsed = run_tasks(start_method, args.execution_mode, args.tasks, args.concurrent)
+        per_task_ms = elapsed / args.tasks * 1000
+        print(f"{start_method:>10}: {elapsed:.2f}s total, {per_task_ms:.1f}ms per task")
+
+
+if __name__ == "__main__":
+    main()
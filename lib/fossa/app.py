@@ -59,8 +59,12 @@ def single_config_initialise(flask_config):
             are notes on common config values.
     @return: Flask app
     """
-    governor = Governor()
-    app = create_app(flask_config, governor)
+    app = create_app(flask_config, governor=None)
+
+    # The start method is needed when the governor is made as it's used to make the governor's
+    # queue and locks.
+    governor = Governor(mp_start_method=app.config.get("MULTIPROCESSING_START_METHOD"))
+    app.fossa_governor = governor
 
     governor.log_to_stdout = app.config["LOG_TO_STDOUT"]
 
@@ -77,6 +81,54 @@ def single_config_initialise(flask_config):
     for callable_manager in app.config.get("MESSAGE_BROKER_MANAGERS"):
         governor.attach_sidecar(callable_manager)
 
+    governor.execution_mode = app.config.get("EXECUTION_MODE", governor.execution_mode)
+    governor.worker_max_tasks_per_child = app.config.get(
+        "WORKER_MAX_TASKS_PER_CHILD", governor.worker_max_tasks_per_child
+    )
+    governor.preload_modules = app.config.get("PRELOAD_MODULES", governor.preload_modules)
+
+    if "TASK_HISTORY_MAX_ENTRIES" in app.config:
+        governor.set_task_history_retention(
+            max_entries=app.config["TASK_HISTORY_MAX_ENTRIES"],
+            spill_path=app.config.get("TASK_HISTORY_SPILL_PATH"),
+        )
+
+    governor.callback_threads = app.config.get("CALLBACK_THREADS", governor.callback_threads)
+    governor.callback_timeout = app.config.get("CALLBACK_TIMEOUT", governor.callback_timeout)
+    governor.result_channel.min_bytes = app.config.get(
+        "RESULT_SHARED_MEMORY_MIN_BYTES", governor.result_channel.min_bytes
+    )
+
+    governor.admission_queue.depth = app.config.get(
+        "ADMISSION_QUEUE_DEPTH", governor.admission_queue.depth
+    )
+    governor.max_concurrent_coordinators = app.config.get(
+        "MAX_CONCURRENT_COORDINATORS", governor.max_concurrent_coordinators
+    )
+    governor.node_resource_overrides = app.config.get(
+        "NODE_RESOURCES", governor.node_resource_overrides
+    )
+    governor.resource_backfill_limit = app.config.get(
+        "RESOURCE_BACKFILL_LIMIT", governor.resource_backfill_limit
+    )
+    governor.priority_aging_seconds = app.config.get(
+        "PRIORITY_AGING_SECONDS", governor.priority_aging_seconds
+    )
+
+    resource_monitor = governor.resource_monitor
+    resource_monitor.sample_interval = app.config.get(
+        "RESOURCE_SAMPLE_INTERVAL", resource_monitor.sample_interval
+    )
+    resource_monitor.memory_high_water_percent = app.config.get(
+        "MEMORY_HIGH_WATER_PERCENT", resource_monitor.memory_high_water_percent
+    )
+    resource_monitor.memory_low_water_percent = app.config.get(
+        "MEMORY_LOW_WATER_PERCENT", resource_monitor.memory_low_water_percent
+    )
+    resource_monitor.swap_rate_high_water = app.config.get(
+        "SWAP_RATE_HIGH_WATER", resource_monitor.swap_rate_high_water
+    )
+
     runtime_config = app.config.get("RUNTIME", {})
     if "CPU_TASK_RATIO" in runtime_config:
         # number of tasks to run in parallel on each CPU
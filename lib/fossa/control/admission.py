@@ -0,0 +1,117 @@
+"""
+Tasks submitted when there isn't a free processing slot wait in an admission queue instead of
+being rejected.
+"""
+from datetime import datetime
+import multiprocessing
+import queue
+import time
+
+from fossa.control.priority import priority_key
+
+
+class AdmissionQueueFull(Exception):
+    pass
+
+
+class AdmissionQueue:
+    """
+    :class:`TaskMessage`s waiting for a processing slot. The highest priority task, after
+    aging, gets the next slot. See :func:`priority_key`.
+
+    Any process (e.g. gunicorn workers) can :meth:`put` a task. A thread in the governor's
+    process (:meth:`run_forever`) records waiting tasks in the task table as 'queued' and passes
+    each to the governor's queue once a slot has been reserved for it.
+    """
+
+    # seconds between checks for new tasks whilst waiting for a slot
+    poll_interval = 0.1
+
+    def __init__(self, depth=100, mp_context=None):
+        """
+        @param depth: (int) maximum number of waiting tasks
+        @param mp_context: (multiprocessing context or None) see :class:`ProcessingSlots`
+        """
+        mp_context = mp_context or multiprocessing.get_context()
+        self.depth = depth
+
+        # seconds of waiting that add one to a task's priority. None for no aging.
+        self.priority_aging_seconds = 60.0
+        self._queue = mp_context.Queue()
+
+        # tasks that have been put but not yet passed to the governor
+        self._waiting = mp_context.Value("i", 0)
+
+    def __len__(self):
+        return self._waiting.value
+
+    def put(self, task_spec):
+        """
+        @param task_spec: (:class:`TaskMessage`)
+        @raise AdmissionQueueFull: if `depth` tasks are already waiting
+        """
+        self.put_many([task_spec])
+
+    def put_many(self, task_specs):
+        """
+        Add all of the tasks or, if there isn't room for all of them, none of them.
+
+        @param task_specs: (list of :class:`TaskMessage`)
+        @raise AdmissionQueueFull: if there isn't room for all the tasks
+        """
+        with self._waiting.get_lock():
+            if self._waiting.value + len(task_specs) > self.depth:
+                msg = (
+                    f"Admission queue can't take {len(task_specs)} more tasks, "
+                    f"{self._waiting.value} of {self.depth} places are in use"
+                )
+                raise AdmissionQueueFull(msg)
+            self._waiting.value += len(task_specs)
+
+        for task_spec in task_specs:
+            self._queue.put(task_spec)
+
+    def run_forever(self, work_queue_submit, available_processing_capacity, task_table, notify):
+        """
+        Runs in a thread in the governor's process.
+
+        @param work_queue_submit: (:class:`multiprocessing.Queue`) the governor's task queue
+        @param available_processing_capacity: (:class:`ProcessingSlots`)
+        @param task_table: (:class:`SharedTaskTable`) waiting tasks are added as 'queued'
+        @param notify: (callable) called when a task's state changes
+        """
+        waiting = []
+        while True:
+            # Take everything that has arrived so it can be seen as 'queued'. Block when there
+            # isn't anything to do.
+            arrived = False
+            try:
+                task_spec = self._queue.get(block=not waiting)
+                while True:
+                    if task_spec is None:
+                        return
+                    task_table.add(
+                        task_spec, pid=0, started=datetime.utcnow(), state=task_table.QUEUED
+                    )
+                    waiting.append(task_spec)
+                    arrived = True
+                    task_spec = self._queue.get_nowait()
+            except queue.Empty:
+                pass
+
+            if arrived:
+                notify()
+
+            while waiting and available_processing_capacity.acquire(
+                block=True, timeout=self.poll_interval
+            ):
+                now = time.time()
+                waiting.sort(key=lambda t: priority_key(t, now, self.priority_aging_seconds))
+                task_spec = waiting.pop(0)
+                with self._waiting.get_lock():
+                    self._waiting.value -= 1
+                work_queue_submit.put(task_spec)
+
+    def stop(self):
+        "End :meth:`run_forever`"
+        self._queue.put(None)
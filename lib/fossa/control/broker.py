@@ -1,7 +1,8 @@
-import random
 import time
 
+from fossa.control import metrics
 from fossa.control.message import TaskMessage
+from fossa.control.resources import ResourceRequirements
 from fossa.tools.logging import LoggingMixin
 
 
@@ -15,18 +16,24 @@ class AbstractMycorrhiza(LoggingMixin):
     and (iii) send results back to the originating task (iv) send log messages somewhere useful.
 
     The :meth:`run_forever` is executed in a separate process. It is provided with the governor's
-    task queue onto which it submits subtasks. It is also provided with a shared variable used to
-    indicate if the governor has capacity to accept additional work.
+    task queue onto which it submits subtasks. It is also provided with the governor's
+    :class:`ProcessingSlots`. A slot must be reserved before a task is put onto the task queue.
 
     Just before execution of the sidecar starts, the govenor will attach external logger modules
     if there are any. Log messages from sidecars are separate from the log messages generated
-    by models.
+    by models. It also attaches the node's :class:`NodeResources` as `node_resources` and its
+    :class:`ResourceMonitor` as `resource_monitor`.
     """
 
     def __init__(self):
         LoggingMixin.__init__(self)
         self.work_queue_submit = None
         self.available_processing_capacity = None
+        self.node_resources = None
+        self.resource_monitor = None
+
+        # Resources a task fetched by this sidecar is expected to need, see :meth:`task_window`
+        self.typical_task_resources = ResourceRequirements()
 
     def run_forever(self, work_queue_submit, available_processing_capacity):
         """
@@ -43,59 +50,75 @@ class AbstractMycorrhiza(LoggingMixin):
         so it can't be serialised.
 
         @param work_queue_submit: (Queue) end to send task into
-        @param available_processing_capacity: sharedctypes int
+        @param available_processing_capacity: (:class:`ProcessingSlots`)
         """
         raise NotImplementedError("Must be implemented by subclasses")
 
+    def task_window(self, available_processing_capacity):
+        """
+        Number of tasks this node could start now. That is the free processing slots limited by
+        the number of tasks needing `typical_task_resources` that fit in the node's free
+        resources. 0 whilst the node's memory use is too high.
+
+        @param available_processing_capacity: (:class:`ProcessingSlots`)
+        @return: (int)
+        """
+        if self.resource_monitor is not None and self.resource_monitor.throttled:
+            return 0
+
+        free_slots = available_processing_capacity.value
+        if self.node_resources is None:
+            return free_slots
+
+        return min(free_slots, self.node_resources.headroom(self.typical_task_resources))
+
     @classmethod
     def submit_task(cls, task_spec, work_queue_submit, available_processing_capacity, timeout):
         """
         Wait for processing capacity in the governor then submit task for processing.
 
         @param task_spec: (TaskMessage)
-        @param available_processing_capacity: (shared multiprocessing.Manager Value)
-        @param timeout: float - max time before returning, will return after this but not exactly this.
+        @param available_processing_capacity: (:class:`ProcessingSlots`)
+        @param timeout: float - max seconds to wait for a processing slot.
         @return: bool - task was successfully passed to the governor's queue. Users of this method
                 should re-try on False.
         """
         if not isinstance(task_spec, TaskMessage):
             raise ValueError("task_spec must be of type TaskMessage")
 
-        # TODO - proper sync primitive in the governor
-        # .qsize() isn't available on OSX, it's a proxy anyway so not worth pursuing
-        # the empty check is enough for now to reduce the chance of running more
-        # tasks then `available_processing_capacity`.
-
-        timed_out = cls.wait_for_capacity(work_queue_submit, available_processing_capacity, timeout)
-        if timed_out:
+        if not cls.reserve_capacity(available_processing_capacity, timeout):
             # task not submitted
             return False
 
-        work_queue_submit.put(task_spec)
-
-        # reduce chance of race condition that see node allocated beyond capacity
-        time.sleep(0.1)
-
+        cls.submit_reserved_task(task_spec, work_queue_submit)
         return True
 
     @classmethod
-    def wait_for_capacity(cls, work_queue_submit, available_processing_capacity, timeout):
+    def submit_reserved_task(cls, task_spec, work_queue_submit):
         """
-        Block until the governor has capacity to process a task.
+        Submit a task for processing when a slot has already been reserved with
+        :meth:`reserve_capacity`.
 
-        Warning - potential race condition.
-
-        @param available_processing_capacity: (shared multiprocessing.Manager Value)
-        @param timeout: float - max time before returning, will return after this but not exactly this.
-        @return: bool if timed out
+        @param task_spec: (TaskMessage)
+        @param work_queue_submit: (Queue) end to send task into
         """
-        # TODO - proper sync primitive in the governor
-        start_time = time.time()
-        while available_processing_capacity.value < 1 or not work_queue_submit.empty():
-            collision_reduction = random.random()
-            time.sleep(3.0 * collision_reduction)
+        if not isinstance(task_spec, TaskMessage):
+            raise ValueError("task_spec must be of type TaskMessage")
 
-            if (time.time() - start_time) > timeout:
-                return True
+        work_queue_submit.put(task_spec)
 
-        return False
+    @classmethod
+    def reserve_capacity(cls, available_processing_capacity, timeout):
+        """
+        Reserve a processing slot in the governor. This is for sidecars that need to know there is
+        capacity before fetching a task. The slot is used by :meth:`submit_reserved_task` or must
+        be handed back with `available_processing_capacity.release()`.
+
+        @param available_processing_capacity: (:class:`ProcessingSlots`)
+        @param timeout: float - max seconds to wait for a processing slot.
+        @return: bool - a slot was reserved
+        """
+        wait_started = time.perf_counter()
+        slot_reserved = available_processing_capacity.acquire(timeout=timeout)
+        metrics.observe("fossa_capacity_wait_seconds", time.perf_counter() - wait_started)
+        return slot_reserved
@@ -0,0 +1,171 @@
+"""
+Run tasks' completion callbacks away from the governor's main loop.
+"""
+import queue
+import threading
+import time
+import traceback
+
+from fossa.control import metrics
+
+
+class CallbackRunner:
+    """
+    A bounded pool of threads in the governor's process that run `on_completion_callback`s.
+
+    A callback that raises is logged and doesn't affect other callbacks or the governor.
+
+    A callback that runs for longer than `timeout` seconds is logged and its thread is replaced
+    so it stops holding one of the pool's threads. Python can't stop a thread so the callback
+    carries on in the background. At most `max_abandoned` threads are left running timed out
+    callbacks, beyond that a timed out thread isn't replaced. When a timed out callback does end
+    its thread goes back to the pool if the pool is short of threads.
+
+    The number of timeouts and of callbacks waiting are in :mod:`fossa.control.metrics`.
+    """
+
+    def __init__(
+        self,
+        logger,
+        max_workers=4,
+        timeout=60.0,
+        max_waiting=1000,
+        waiting_count=None,
+        max_abandoned=None,
+    ):
+        """
+        @param logger: (subclass of :class:`LoggingMixin`)
+        @param max_workers: (int) number of threads
+        @param timeout: (float) seconds. None for no limit.
+        @param max_waiting: (int) :meth:`submit` blocks when this many callbacks are waiting
+        @param waiting_count: (:class:`multiprocessing.Value`) optional, kept up to date with the
+            number of callbacks waiting to be run so other processes can read it.
+        @param max_abandoned: (int) most threads that are replaced after their callback timed out.
+            Defaults to `max_workers` so there are never more than twice `max_workers` threads.
+        """
+        self.logger = logger
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.waiting_count = waiting_count
+        self.max_abandoned = max_workers if max_abandoned is None else max_abandoned
+
+        # (callback, args, description) or None to end a thread
+        self._waiting = queue.Queue(maxsize=max_waiting)
+
+        # thread -> (start time, description) of the callback it's running
+        self._running = {}
+
+        # threads that have been replaced after a timeout, they end when their callback does
+        self._abandoned = set()
+
+        self._lock = threading.Lock()
+        self._threads = []
+        for _ in range(max_workers):
+            self._start_thread()
+
+    def _start_thread(self):
+        thread = threading.Thread(target=self._run_forever, daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def _update_waiting_count(self):
+        waiting = self._waiting.qsize()
+        if self.waiting_count is not None:
+            self.waiting_count.value = waiting
+        metrics.set_gauge("fossa_callbacks_waiting", waiting)
+
+    @property
+    def waiting(self):
+        "@return: (int) callbacks that haven't started"
+        return self._waiting.qsize()
+
+    def submit(self, callback, *args, description=None):
+        """
+        Queue a callback to run in one of the pool's threads.
+
+        @param callback: (callable)
+        @param args: passed to `callback`
+        @param description: (str) used in log messages
+        """
+        self._waiting.put((callback, args, description or repr(callback)))
+        self._update_waiting_count()
+
+    def _run_forever(self):
+        "Each of the pool's threads"
+        thread = threading.current_thread()
+        while True:
+            item = self._waiting.get()
+            self._update_waiting_count()
+            if item is None:
+                return
+
+            callback, args, description = item
+            with self._lock:
+                self._running[thread] = (time.monotonic(), description)
+
+            try:
+                callback(*args)
+            except Exception:
+                msg = f"Completion callback {description} failed: {traceback.format_exc()}"
+                self.logger.log(msg, level="ERROR")
+
+            with self._lock:
+                del self._running[thread]
+                if thread in self._abandoned:
+                    self._abandoned.discard(thread)
+                    if len(self._threads) - len(self._abandoned) > self.max_workers:
+                        # already replaced
+                        self._threads.remove(thread)
+                        return
+                    # wasn't replaced so carries on as one of the pool's threads
+
+    def check_timeouts(self):
+        """
+        Log callbacks that have run for longer than `timeout` and replace their threads unless
+        `max_abandoned` threads are already running timed out callbacks. Called periodically by
+        the governor's loop.
+
+        @return: (int) number of callbacks that have just timed out
+        """
+        if self.timeout is None:
+            return 0
+
+        now = time.monotonic()
+        timed_out = 0
+        with self._lock:
+            for thread, (started, description) in self._running.items():
+                if thread in self._abandoned or now - started < self.timeout:
+                    continue
+
+                msg = f"Completion callback {description} has run for over {self.timeout} seconds"
+                self.logger.log(msg, level="ERROR")
+                self._abandoned.add(thread)
+                metrics.inc("fossa_callback_timeouts_total")
+                timed_out += 1
+
+                if len(self._abandoned) <= self.max_abandoned:
+                    self._start_thread()
+                else:
+                    msg = (
+                        f"{len(self._abandoned)} completion callbacks have timed out, not "
+                        "replacing the thread until one ends"
+                    )
+                    self.logger.log(msg, level="WARNING")
+
+        return timed_out
+
+    def shutdown(self, timeout=10.0):
+        """
+        Run the callbacks that are waiting and end the threads.
+
+        @param timeout: (float) seconds to wait for the callbacks
+        """
+        with self._lock:
+            threads = [t for t in self._threads if t not in self._abandoned]
+
+        for _ in threads:
+            self._waiting.put(None)
+
+        deadline = time.monotonic() + timeout
+        for thread in threads:
+            thread.join(timeout=max(0, deadline - time.monotonic()))
@@ -0,0 +1,141 @@
+import multiprocessing
+
+from fossa.control.message import CoordinatorMessage
+
+
+class ProcessingSlots:
+    """
+    Processing capacity for the governor expressed as a number of slots.
+
+    A slot must be reserved (with :meth:`acquire`) before a :class:`TaskMessage` is put onto the
+    governor's task queue. The governor releases the slot (with :meth:`release`) when the
+    :class:`ResultsMessage` for the task arrives. Reserving the slot before the task is in transit
+    means the node can't be over committed by many submitters racing for the last slot.
+
+    All the state is in shared memory so an instance can be passed to the governor's process,
+    sidecars and will be inherited by gunicorn's workers.
+
+    The `value` attribute is the number of free slots. It can be read like the
+    :class:`multiprocessing.sharedctypes.Value` that this class replaced.
+    """
+
+    def __init__(self, mp_context=None):
+        """
+        @param mp_context: (multiprocessing context or None) the locks must be made in the same
+            context as the processes using them. None for the default context.
+        """
+        mp_context = mp_context or multiprocessing.get_context()
+
+        # Before the governor's process is running the capacity is unknown, so zero slots.
+        self._free = mp_context.Value("i", 0)
+        self._capacity = mp_context.Value("i", 0, lock=False)
+
+        # :meth:`acquire` waits on this for a slot to be released
+        self._slot_change = mp_context.Condition(self._free.get_lock())
+
+    @property
+    def value(self):
+        "Number of free slots"
+        return self._free.value
+
+    @property
+    def capacity(self):
+        "Total number of slots, both free and in use."
+        return self._capacity.value
+
+    def set_capacity(self, capacity):
+        """
+        Change the total number of slots. Slots already reserved are unaffected so the number of
+        free slots is adjusted by the difference.
+
+        @param capacity: (int)
+        """
+        with self._slot_change:
+            self._free.value += capacity - self._capacity.value
+            self._capacity.value = capacity
+            self._slot_change.notify_all()
+
+    def acquire(self, block=True, timeout=None, slots=1):
+        """
+        Reserve a slot.
+
+        @param block: (bool) - when False return immediately if there aren't any free slots.
+        @param timeout: (float or None) seconds to wait for a slot when blocking. None is to wait
+                forever.
+        @param slots: (int) number of slots to reserve. Either all of them are reserved or none.
+        @return: bool - the slots were reserved. The caller is responsible for them being
+                released.
+        """
+        with self._slot_change:
+            if block:
+                free_slot = self._slot_change.wait_for(lambda: self._free.value >= slots, timeout)
+            else:
+                free_slot = self._free.value >= slots
+
+            if not free_slot:
+                return False
+
+            self._free.value -= slots
+            return True
+
+    def release(self, slots=1):
+        """
+        Return reserved slots.
+
+        The number of free slots won't exceed the capacity. This protects against tasks that
+        were put onto the task queue without reserving a slot.
+
+        @param slots: (int)
+        """
+        with self._slot_change:
+            self._free.value = min(self._free.value + slots, self._capacity.value)
+            self._slot_change.notify(slots)
+
+
+class CoordinatorSlot:
+    """
+    Used in a task's ETL process to swap its processing slot for a coordinator slot whilst it
+    waits for subtasks it has sent elsewhere, e.g. through RabbitMQ. Without this a node full of
+    waiting parent tasks couldn't run any subtasks.
+
+    The ETL process reserves the slot it moves to and sends a :class:`CoordinatorMessage`. The
+    governor's process releases the slot the task moved from.
+    """
+
+    def __init__(self, task_id, work_queue, available_processing_capacity, coordinator_capacity):
+        """
+        @param task_id: (str) of the task being run in this process
+        @param work_queue: (:class:`multiprocessing.Queue`) the governor's task queue
+        @param available_processing_capacity: (:class:`ProcessingSlots`)
+        @param coordinator_capacity: (:class:`ProcessingSlots`)
+        """
+        self.task_id = task_id
+        self.work_queue = work_queue
+        self.available_processing_capacity = available_processing_capacity
+        self.coordinator_capacity = coordinator_capacity
+        self.coordinating = False
+
+    def begin(self):
+        """
+        Become a coordinator if there is a free coordinator slot. Otherwise the task keeps its
+        processing slot.
+
+        @return: (bool) this task is now a coordinator
+        """
+        if self.coordinating or not self.coordinator_capacity.acquire(block=False):
+            return self.coordinating
+
+        self.work_queue.put(CoordinatorMessage(task_id=self.task_id, coordinating=True))
+        self.coordinating = True
+        return True
+
+    def end(self):
+        """
+        Wait for a processing slot and give up the coordinator slot.
+        """
+        if not self.coordinating:
+            return
+
+        self.available_processing_capacity.acquire()
+        self.work_queue.put(CoordinatorMessage(task_id=self.task_id, coordinating=False))
+        self.coordinating = False
@@ -0,0 +1,159 @@
+"""
+Claim-check for large subtask arguments and return values.
+
+A value that is too big to pass through RabbitMQ and the governor's queues is written to a
+blob store and replaced by a small reference (the 'claim check'). The reference is a URL so the
+receiving end can fetch the value without knowing how the sender was configured.
+"""
+import json
+import os
+import tempfile
+from urllib.parse import urlparse
+import uuid
+
+# key in a dictionary that marks the dictionary as a claim check
+CLAIM_CHECK_KEY = "__fossa_claim_check__"
+
+# URL scheme -> subclass of :class:`AbstractBlobStore`
+blob_store_schemes = {}
+
+
+class AbstractBlobStore:
+    """
+    Somewhere to put large payloads that can be reached by every node.
+
+    Subclasses set `url_scheme` and are registered with :func:`register_blob_store`.
+    """
+
+    url_scheme = None
+
+    def put(self, data):
+        """
+        @param data: (bytes)
+        @return: (str) URL of the stored data
+        """
+        raise NotImplementedError("Must be implemented by subclasses")
+
+    @classmethod
+    def get(cls, url):
+        """
+        @param url: (str) from :meth:`put`
+        @return: (bytes)
+        """
+        raise NotImplementedError("Must be implemented by subclasses")
+
+    @classmethod
+    def delete(cls, url):
+        """
+        Remove the stored data. Does nothing if it has already been removed.
+
+        @param url: (str) from :meth:`put`
+        """
+        raise NotImplementedError("Must be implemented by subclasses")
+
+
+def register_blob_store(store_cls):
+    """
+    Make a blob store's references resolvable. Can be used as a class decorator.
+
+    @param store_cls: subclass of :class:`AbstractBlobStore`
+    @return: store_cls
+    """
+    blob_store_schemes[store_cls.url_scheme] = store_cls
+    return store_cls
+
+
+@register_blob_store
+class FilesystemBlobStore(AbstractBlobStore):
+    """
+    Payloads are files in a directory. For more than one node this must be a shared volume
+    mounted at the same path on each node.
+    """
+
+    url_scheme = "file"
+
+    def __init__(self, path):
+        """
+        @param path: (str) directory, it's made if it doesn't exist
+        """
+        self.path = os.path.abspath(path)
+        os.makedirs(self.path, exist_ok=True)
+
+    def put(self, data):
+        file_path = os.path.join(self.path, uuid.uuid4().hex)
+
+        # written in full before the reference can be used
+        fd, temp_path = tempfile.mkstemp(dir=self.path, prefix=".incomplete_")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, file_path)
+
+        return f"file://{file_path}"
+
+    @classmethod
+    def get(cls, url):
+        with open(urlparse(url).path, "rb") as f:
+            return f.read()
+
+    @classmethod
+    def delete(cls, url):
+        try:
+            os.remove(urlparse(url).path)
+        except FileNotFoundError:
+            pass
+
+
+def _store_for(url):
+    scheme = urlparse(url).scheme
+    store_cls = blob_store_schemes.get(scheme)
+    if store_cls is None:
+        raise ValueError(f"No blob store registered for '{scheme}' URLs")
+    return store_cls
+
+
+def is_claim_check(value):
+    "@return: (bool) `value` is a reference made by :func:`check_in`"
+    return isinstance(value, dict) and CLAIM_CHECK_KEY in value
+
+
+def check_in(blob_store, value):
+    """
+    Put `value` in the blob store.
+
+    @param blob_store: (:class:`AbstractBlobStore`)
+    @param value: anything that can be JSON encoded
+    @return: (dict) the claim check, it's small and can be JSON encoded
+    """
+    url = blob_store.put(json.dumps(value).encode("utf-8"))
+    return {CLAIM_CHECK_KEY: url}
+
+
+def claim(value, delete=False):
+    """
+    Fetch the value referenced by a claim check.
+
+    @param value: a claim check from :func:`check_in` or any other value which is returned
+        unchanged
+    @param delete: (bool) remove the stored value once it's been fetched
+    @return: the original value
+    """
+    if not is_claim_check(value):
+        return value
+
+    url = value[CLAIM_CHECK_KEY]
+    store_cls = _store_for(url)
+    claimed = json.loads(store_cls.get(url))
+    if delete:
+        store_cls.delete(url)
+    return claimed
+
+
+def discard(value):
+    """
+    Remove the stored value for a claim check that won't be claimed.
+
+    @param value: a claim check or any other value which is ignored
+    """
+    if is_claim_check(value):
+        url = value[CLAIM_CHECK_KEY]
+        _store_for(url).delete(url)
@@ -0,0 +1,407 @@
+"""
+Ways for the :class:`Governor` to run tasks in isolated processes.
+"""
+import multiprocessing
+import time
+
+from fossa.control.metrics import run_with_registry
+
+
+class AbstractTaskExecutor:
+    """
+    Run an :class:`AbstractIsolatedProcessor` for each task in a separate
+    :class:`multiprocessing.Process`.
+
+    Executors are created and used within the governor's own process. They keep track of which
+    processes are running which tasks so processes that die without sending their results can be
+    found.
+    """
+
+    # Seconds to wait for results from a process that has exited cleanly before the task is
+    # considered lost. Results are sent just before the process ends so could still be in transit.
+    lost_task_grace_period = 5.0
+
+    def __init__(
+        self,
+        isolated_processor,
+        etl_process_label,
+        start_method=None,
+        preload_modules=None,
+        metrics_registry=None,
+    ):
+        """
+        @param isolated_processor: (subclass of :class:`AbstractIsolatedProcessor`) this callable
+            is run for each task.
+        @param etl_process_label: (str) name given to each :class:`Process`
+        @param start_method: (str or None) multiprocessing start method - "fork", "spawn" or
+            "forkserver". None for the platform's default. This must be the same start method
+            used to make the governor's queue and other synchronisation primitives.
+            With "spawn" and "forkserver" the model classes must be importable, i.e. not defined
+            in `__main__`.
+        @param preload_modules: (list of str) module names imported by the fork server. Only
+            used by the "forkserver" start method.
+        @param metrics_registry: (:class:`SharedMetrics`) optional, installed in each process
+            so processes that aren't forked from the governor's process add to the same metrics.
+        """
+        self.isolated_processor = isolated_processor
+        self.etl_process_label = etl_process_label
+        self.start_method = start_method
+        self.preload_modules = preload_modules or []
+        self.metrics_registry = metrics_registry
+
+        # task_id -> time.time() when the process running the task was first seen to have ended
+        # without results.
+        self._ended_without_results = {}
+
+    @property
+    def mp_context(self):
+        "multiprocessing context for the start method"
+        return multiprocessing.get_context(self.start_method)
+
+    def new_process(self, target, kwargs):
+        """
+        @param target: (callable) run in the new process
+        @param kwargs: (dict) for `target`
+        @return: :class:`multiprocessing.Process` that hasn't been started
+        """
+        if self.metrics_registry is not None:
+            return self.mp_context.Process(
+                target=run_with_registry,
+                args=(self.metrics_registry, target),
+                kwargs=kwargs,
+                name=self.etl_process_label,
+            )
+
+        return self.mp_context.Process(target=target, kwargs=kwargs, name=self.etl_process_label)
+
+    def start(self, max_concurrent_tasks):
+        """
+        Prepare before the first task. Subclasses should call this.
+
+        @param max_concurrent_tasks: (int) expected number of tasks running at the same time
+        """
+        if self.mp_context.get_start_method() == "forkserver":
+            # The fork server is started when the first process is started so this is early
+            # enough. Each ETL process is forked from this small pre-warmed server instead of
+            # the governor's process.
+            self.mp_context.set_forkserver_preload(self.preload_modules)
+
+    def run_task(self, task_id, iso_proc_kwargs):
+        """
+        Start running a task.
+
+        @param task_id: (str)
+        @param iso_proc_kwargs: (dict) arguments for the isolated processor's :meth:`__call__`
+        @return: (int) process id of the process running the task
+        """
+        raise NotImplementedError("Must be implemented by subclasses")
+
+    def task_finished(self, task_id):
+        """
+        The results for the task have been received.
+
+        @param task_id: (str)
+        """
+        raise NotImplementedError("Must be implemented by subclasses")
+
+    def lost_tasks(self):
+        """
+        Find tasks that will never send results because the process running them has died.
+
+        Also a chance for subclasses to tidy up processes that have finished.
+
+        @return: list of (task_id, exitcode) tuples. Each task is only reported once.
+        """
+        raise NotImplementedError("Must be implemented by subclasses")
+
+    def is_lost(self, task_id, exitcode):
+        """
+        Decide if a task, who's process has ended and hasn't sent results yet, is lost.
+
+        A process killed by a signal or exiting with an error is lost straight away. Results from a
+        process that exited cleanly might still be in transit so these are lost after
+        `lost_task_grace_period` seconds.
+
+        @param task_id: (str)
+        @param exitcode: (int) from the ended process
+        @return: bool
+        """
+        if exitcode != 0:
+            self._ended_without_results.pop(task_id, None)
+            return True
+
+        ended_at = self._ended_without_results.setdefault(task_id, time.time())
+        if time.time() - ended_at > self.lost_task_grace_period:
+            del self._ended_without_results[task_id]
+            return True
+
+        return False
+
+    def shutdown(self):
+        """
+        Optionally implemented by subclasses to stop processes that aren't running tasks.
+        """
+        return None
+
+    def terminate(self):
+        """
+        Immediately end all processes started by this executor, including those running tasks.
+        """
+        raise NotImplementedError("Must be implemented by subclasses")
+
+
+class ProcessPerTaskExecutor(AbstractTaskExecutor):
+    """
+    A new :class:`multiprocessing.Process` for each task. This is the most isolated way to run
+    tasks as nothing persists between tasks.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # task_id -> Process, for tasks that haven't sent results
+        self.processes = {}
+
+        # Processes that have sent results but haven't yet ended
+        self.finished_processes = []
+
+    def run_task(self, task_id, iso_proc_kwargs):
+        """
+        @see :meth:`AbstractTaskExecutor.run_task`
+        """
+        ayeaye_proc = self.new_process(target=self.isolated_processor, kwargs=iso_proc_kwargs)
+        ayeaye_proc.start()
+        self.processes[task_id] = ayeaye_proc
+        return ayeaye_proc.pid
+
+    def task_finished(self, task_id):
+        """
+        @see :meth:`AbstractTaskExecutor.task_finished`
+        """
+        ayeaye_proc = self.processes.pop(task_id, None)
+        self._ended_without_results.pop(task_id, None)
+        if ayeaye_proc is not None:
+            # Results are sent just before the process ends but don't wait for it to end here as
+            # this is the governor's main loop. It's joined by :meth:`lost_tasks`.
+            ayeaye_proc.join(timeout=0)
+            if ayeaye_proc.exitcode is None:
+                self.finished_processes.append(ayeaye_proc)
+
+    def lost_tasks(self):
+        """
+        @see :meth:`AbstractTaskExecutor.lost_tasks`
+        """
+        # join (reap) processes who's tasks have finished
+        for ayeaye_proc in list(self.finished_processes):
+            ayeaye_proc.join(timeout=0)
+            if ayeaye_proc.exitcode is not None:
+                self.finished_processes.remove(ayeaye_proc)
+
+        lost = []
+        for task_id, ayeaye_proc in list(self.processes.items()):
+            exitcode = ayeaye_proc.exitcode
+            if exitcode is not None and self.is_lost(task_id, exitcode):
+                lost.append((task_id, exitcode))
+                del self.processes[task_id]
+        return lost
+
+    def terminate(self):
+        """
+        @see :meth:`AbstractTaskExecutor.terminate`
+        """
+        for ayeaye_proc in list(self.processes.values()) + self.finished_processes:
+            if ayeaye_proc.is_alive():
+                ayeaye_proc.terminate()
+
+
+class _PoolWorker:
+    "A long lived process in the :class:`WorkerPoolExecutor` and the task it's running"
+
+    def __init__(self, process, connection):
+        self.process = process
+        self.connection = connection
+        self.task_id = None
+        self.tasks_run = 0
+
+        # will end itself after the current task
+        self.retiring = False
+
+
+class WorkerPoolExecutor(AbstractTaskExecutor):
+    """
+    Long lived worker processes that each run many tasks, one after another. This saves the cost
+    of creating a process and importing modules for each task.
+
+    Workers are recycled after `max_tasks_per_child` tasks so memory leaked by models doesn't
+    accumulate. Workers that die are replaced.
+
+    Models that must not share a process with previous tasks should use
+    :class:`ProcessPerTaskExecutor`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """
+        @param max_tasks_per_child: (int or None) number of tasks run by a worker before it is
+            replaced. None for workers to run forever.
+        """
+        self.max_tasks_per_child = kwargs.pop("max_tasks_per_child", None)
+        super().__init__(*args, **kwargs)
+        self.workers = []
+
+        # Workers that have been replaced but might not have ended yet
+        self.retired_workers = []
+
+    def start(self, max_concurrent_tasks):
+        """
+        @see :meth:`AbstractTaskExecutor.start`
+        """
+        super().start(max_concurrent_tasks)
+        for _ in range(max_concurrent_tasks):
+            self.workers.append(self._start_worker())
+
+    def _start_worker(self):
+        "@return: :class:`_PoolWorker`"
+        if self.mp_context.get_start_method() == "fork":
+            sibling_connections = [w.connection for w in self.workers]
+        else:
+            # nothing is inherited by spawned processes
+            sibling_connections = []
+
+        parent_conn, child_conn = self.mp_context.Pipe()
+        worker_proc = self.new_process(
+            target=WorkerPoolExecutor.worker_run_forever,
+            kwargs={
+                "isolated_processor": self.isolated_processor,
+                "connection": child_conn,
+                "max_tasks": self.max_tasks_per_child,
+                "sibling_connections": sibling_connections,
+            },
+        )
+        worker_proc.start()
+        child_conn.close()
+        return _PoolWorker(process=worker_proc, connection=parent_conn)
+
+    @staticmethod
+    def worker_run_forever(isolated_processor, connection, max_tasks, sibling_connections):
+        """
+        Run tasks sent by the governor's process until told to stop or `max_tasks` have been run.
+
+        @param isolated_processor: (subclass of :class:`AbstractIsolatedProcessor`)
+        @param connection: (:class:`multiprocessing.connection.Connection`) receives the kwargs
+            for each task. None instructs the worker to end.
+        @param max_tasks: (int or None)
+        @param sibling_connections: (list of :class:`Connection`) the governor's ends of the other
+            workers' pipes. These are inherited when forking and must be closed, otherwise the
+            other workers won't see EOF when the governor's process ends.
+        """
+        for sibling_connection in sibling_connections:
+            sibling_connection.close()
+
+        tasks_run = 0
+        while max_tasks is None or tasks_run < max_tasks:
+            try:
+                iso_proc_kwargs = connection.recv()
+            except EOFError:
+                # governor has gone away
+                return
+
+            if iso_proc_kwargs is None:
+                return
+
+            # results are sent to the governor by the isolated processor
+            isolated_processor(**iso_proc_kwargs)
+            tasks_run += 1
+
+    def _replace_worker(self, worker):
+        """
+        Start a new worker in place of one that has ended or is ending itself. The old worker is
+        joined by :meth:`lost_tasks`.
+        """
+        worker.connection.close()
+        self.retired_workers.append(worker)
+        self.workers[self.workers.index(worker)] = self._start_worker()
+
+    def run_task(self, task_id, iso_proc_kwargs):
+        """
+        @see :meth:`AbstractTaskExecutor.run_task`
+        """
+        for worker in self.workers:
+            if worker.task_id is None and not worker.retiring and worker.process.is_alive():
+                break
+        else:
+            # More tasks than expected, grow the pool
+            worker = self._start_worker()
+            self.workers.append(worker)
+
+        worker.task_id = task_id
+        worker.tasks_run += 1
+        if self.max_tasks_per_child and worker.tasks_run >= self.max_tasks_per_child:
+            # The worker ends itself after this task. It's replaced when the task finishes.
+            worker.retiring = True
+
+        worker.connection.send(iso_proc_kwargs)
+        return worker.process.pid
+
+    def task_finished(self, task_id):
+        """
+        @see :meth:`AbstractTaskExecutor.task_finished`
+        """
+        self._ended_without_results.pop(task_id, None)
+        for worker in self.workers:
+            if worker.task_id == task_id:
+                worker.task_id = None
+                if worker.retiring:
+                    self._replace_worker(worker)
+                return
+
+    def lost_tasks(self):
+        """
+        @see :meth:`AbstractTaskExecutor.lost_tasks`
+        """
+        for worker in list(self.retired_workers):
+            worker.process.join(timeout=0)
+            if worker.process.exitcode is not None:
+                self.retired_workers.remove(worker)
+
+        lost = []
+        for worker in list(self.workers):
+            if worker.process.is_alive():
+                continue
+
+            exitcode = worker.process.exitcode
+            if worker.task_id is not None and self.is_lost(worker.task_id, exitcode):
+                lost.append((worker.task_id, exitcode))
+                worker.task_id = None
+
+            if worker.task_id is None:
+                # a worker with a task that ended could still be sending results so is replaced
+                # when they arrive or the task is lost.
+                self._replace_worker(worker)
+
+        return lost
+
+    def shutdown(self):
+        """
+        @see :meth:`AbstractTaskExecutor.shutdown`
+        """
+        for worker in self.workers:
+            if worker.process.is_alive() and worker.task_id is None:
+                worker.connection.send(None)
+
+        for worker in self.workers:
+            if worker.task_id is None:
+                worker.process.join(timeout=self.lost_task_grace_period)
+
+    def terminate(self):
+        """
+        @see :meth:`AbstractTaskExecutor.terminate`
+        """
+        for worker in self.workers + self.retired_workers:
+            if worker.process.is_alive():
+                worker.process.terminate()
+
+
+# Names used by config. i.e. `EXECUTION_MODE` in :class:`BaseConfig`
+execution_modes = {
+    "process_per_task": ProcessPerTaskExecutor,
+    "worker_pool": WorkerPoolExecutor,
+}
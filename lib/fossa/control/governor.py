@@ -1,19 +1,43 @@
 import copy
+from dataclasses import replace
 from datetime import datetime
 from inspect import isclass
 import multiprocessing
-from multiprocessing.sharedctypes import Value
 import os
+import queue
 import random
 import signal
 import string
+import threading
 import time
 
 from ayeaye.runtime.knowledge import RuntimeKnowledge
+from ayeaye.runtime.task_message import TaskFailed
 
+from fossa.control import metrics
+from fossa.control.admission import AdmissionQueue
 from fossa.control.broker import AbstractMycorrhiza
-from fossa.control.message import TaskMessage, ResultsMessage, TerminateMessage
+from fossa.control.callbacks import CallbackRunner
+from fossa.control.capacity import ProcessingSlots
+from fossa.control.execution import execution_modes, WorkerPoolExecutor
+from fossa.control.message import (
+    CoordinatorMessage,
+    ResultsMessage,
+    TaskMessage,
+    TerminateMessage,
+)
+from fossa.control.priority import priority_key
 from fossa.control.process import AbstractIsolatedProcessor, LocalAyeAyeProcessor
+from fossa.control.resource_monitor import ResourceMonitor
+from fossa.control.resources import (
+    measure_node_resources,
+    NodeResources,
+    requirements_for,
+    ResourceRequirements,
+)
+from fossa.control.result_channel import ResultLost, SharedMemoryResultChannel
+from fossa.control.task_history import GovernorManager, running_task_summary
+from fossa.control.task_table import SharedTaskTable
 from fossa.tools.logging import LoggingMixin, MiniLogger
 
 
@@ -26,7 +50,14 @@ class Governor(LoggingMixin):
     Connect the web frontend; message brokers and task execution.
     """
 
-    def __init__(self, isolated_processor=None):
+    # seconds between checks for ETL processes that have died without sending results
+    housekeeping_interval = 1.0
+
+    # size of the shared memory table of running tasks. Must be at least the number of
+    # concurrent tasks.
+    task_table_slots = 256
+
+    def __init__(self, isolated_processor=None, mp_start_method=None):
         """
         @param isolated_process (subclass of :class:`AbstractIsolatedProcessor`): instance/object
                 This class has a method (`__call__`) which is run in a separate
@@ -37,12 +68,19 @@ class Governor(LoggingMixin):
                 into the processing done by the governor.
                 If not explicitly set through this constructor or through :attr:`isolated_processor`
                 the :class:`LocalAyeAyeProcess` processor will be used.
+        @param mp_start_method: (str or None) multiprocessing start method for the governor's
+                processes and ETL processes - "fork", "spawn" or "forkserver". None is the
+                platform's default. It's set here as the governor's queue and locks must be made
+                with the same start method as the processes using them.
         """
         LoggingMixin.__init__(self)
 
+        self._mp_start_method = mp_start_method
+        self.mp_context = multiprocessing.get_context(mp_start_method)
+
         # Tasks submitted and internal tasks (e.g. process results at end of task) are put on this
         # queue.
-        self._task_queue_submit = multiprocessing.Queue()
+        self._task_queue_submit = self.mp_context.Queue()
         # self._task_queue_receive = multiprocessing.Queue()
 
         # Each instance of Fossa must have a single governor. Some usages (for example
@@ -57,10 +95,70 @@ class Governor(LoggingMixin):
         self.etl_process_label = "ayeaye_etl_process"
 
         # managed shared memory has more convenient typing than multiprocessing.shared_memory
-        self.mp_manager = multiprocessing.Manager()
-        self.process_table = self.mp_manager.dict()  # currently running processes
-        self.previous_tasks = self.mp_manager.list()
-        self.available_processing_capacity = Value("i", 0)
+        self.mp_manager = GovernorManager(ctx=self.mp_context)
+        self.mp_manager.start()
+
+        # currently running tasks. Written by the governor's process, read by anything.
+        self.task_table = SharedTaskTable(slots=self.task_table_slots)
+
+        # finished tasks, bounded and indexed by task_id. See :meth:`set_task_history_retention`
+        self.previous_tasks = self.mp_manager.TaskHistory()
+
+        # A slot is reserved before a task is put on `_task_queue_submit` and released by the
+        # governor's process when the task has finished.
+        self.available_processing_capacity = ProcessingSlots(mp_context=self.mp_context)
+
+        # Tasks waiting for subtasks that are run elsewhere (e.g. through RabbitMQ) swap their
+        # processing slot for one of these, see :class:`CoordinatorSlot`. They aren't counted
+        # against `max_concurrent_tasks`. 0 for waiting tasks to keep their processing slot.
+        self.coordinator_capacity = ProcessingSlots(mp_context=self.mp_context)
+        self.max_concurrent_coordinators = 4
+
+        # CPU, memory and IO declared by tasks are packed into the node's resources, see
+        # :mod:`fossa.control.resources`. `node_resource_overrides` replaces measured amounts,
+        # e.g. {"memory_mb": 16000}.
+        self.node_resources = NodeResources(mp_context=self.mp_context)
+        self.node_resource_overrides = {}
+
+        # A task that has waited this many seconds for resources stops smaller tasks after it
+        # from starting first. None to always let smaller tasks start.
+        self.resource_backfill_limit = 60.0
+
+        # Samples the node's memory and the ETL processes' RSS, new tasks wait whilst memory use
+        # is above a high-water mark. See :class:`ResourceMonitor` for the settings.
+        self.resource_monitor = ResourceMonitor(
+            mp_context=self.mp_context, max_processes=self.task_table_slots
+        )
+
+        # Waiting tasks, for a slot or for resources, start highest `TaskMessage.priority` first.
+        # A task's priority goes up by one for each `priority_aging_seconds` it has waited so low
+        # priority tasks aren't starved. None for no aging.
+        self.priority_aging_seconds = 60.0
+
+        # Tasks waiting for a processing slot, see :meth:`admit_task`. Set `depth` to 0 to
+        # reject tasks when there isn't a free slot.
+        self.admission_queue = AdmissionQueue(mp_context=self.mp_context)
+
+        # notified by the governor's process when a task is queued, starts or finishes. See
+        # :meth:`wait_for_task_change`.
+        self.task_state_changed = self.mp_context.Condition()
+
+        # Counters and histograms shared by all of this node's processes, see
+        # :mod:`fossa.control.metrics`. Installed here so processes forked from this one use it.
+        self.metrics = metrics.SharedMetrics(mp_context=self.mp_context)
+        metrics.install(self.metrics)
+
+        # Large results come from the ETL processes in shared memory. Must be set before the
+        # isolated processor as it's passed to it.
+        self.result_channel = SharedMemoryResultChannel()
+
+        # Completion callbacks are run by a pool of threads in the governor's process so they
+        # don't hold up new tasks. See :class:`CallbackRunner`.
+        self.callback_threads = 4
+        self.callback_timeout = 60.0
+
+        # number of callbacks waiting for a thread. Written by the governor's process.
+        self.callbacks_waiting = self.mp_context.Value("i", 0)
 
         # the link between the execution environment and the process
         self.runtime = RuntimeKnowledge()
@@ -81,6 +179,19 @@ class Governor(LoggingMixin):
         # keep track of internal processes
         self._internal_process_table = []
 
+        # How each task is run. See `execution_modes` in :mod:`fossa.control.execution`
+        # "process_per_task" - a new Process for every task
+        # "worker_pool" - long lived worker processes each run many tasks
+        self.execution_mode = "process_per_task"
+
+        # In "worker_pool" mode, a worker is replaced after running this many tasks. None to
+        # never replace.
+        self.worker_max_tasks_per_child = 100
+
+        # Names of modules imported by the fork server when `mp_start_method` is "forkserver".
+        # The modules of accepted classes are always preloaded.
+        self.preload_modules = []
+
     @property
     def isolated_processor(self):
         """
@@ -97,7 +208,12 @@ class Governor(LoggingMixin):
             self._isolated_processor = LocalAyeAyeProcessor()
 
             # connect the governor with isolated processes with a Pipe
-            self._isolated_processor.set_work_queue(self._task_queue_submit)
+            self._isolated_processor.set_work_queue(
+                self._task_queue_submit,
+                self.result_channel,
+                self.available_processing_capacity,
+                self.coordinator_capacity,
+            )
 
             # copy logging setup across
             assert isinstance(self._isolated_processor, LoggingMixin)
@@ -114,12 +230,26 @@ class Governor(LoggingMixin):
             raise ValueError(msg)
 
         self._isolated_processor = processor
-        self._isolated_processor.set_work_queue(self._task_queue_submit)
+        self._isolated_processor.set_work_queue(
+            self._task_queue_submit,
+            self.result_channel,
+            self.available_processing_capacity,
+            self.coordinator_capacity,
+        )
 
         # copy logging setup across if supported by processor
         if isinstance(self._isolated_processor, LoggingMixin):
             self._isolated_processor.copy_logging_setup(self)
 
+    @property
+    def mp_start_method(self):
+        """
+        multiprocessing start method. Set with the constructor.
+
+        @return: (str or None) None is the platform's default
+        """
+        return self._mp_start_method
+
     @property
     def has_processing_capacity(self):
         """
@@ -160,22 +290,80 @@ class Governor(LoggingMixin):
             msg = "This should only be called once; There are already running processes"
             raise ValueError(msg)
 
+        if self.execution_mode not in execution_modes:
+            msg = f"Unknown execution mode '{self.execution_mode}', must be one of: " + ", ".join(
+                execution_modes.keys()
+            )
+            raise ValueError(msg)
+
+        max_running = self.runtime.max_concurrent_tasks + self.max_concurrent_coordinators
+        if max_running > self.task_table.slots:
+            msg = (
+                f"max_concurrent_tasks ({self.runtime.max_concurrent_tasks}) plus "
+                f"max_concurrent_coordinators ({self.max_concurrent_coordinators}) is more than "
+                f"the task table can hold ({self.task_table.slots})"
+            )
+            raise ValueError(msg)
+
+        # queued tasks are in the task table too
+        spare_entries = self.task_table.slots - max_running
+        if self.admission_queue.depth > spare_entries:
+            msg = (
+                f"Admission queue depth reduced from {self.admission_queue.depth} to "
+                f"{spare_entries} to fit in the task table"
+            )
+            self.log(msg, level="WARNING")
+            self.admission_queue.depth = spare_entries
+
+        self.admission_queue.priority_aging_seconds = self.priority_aging_seconds
+        self.node_resources.set_totals(**measure_node_resources())
+        self.node_resources.set_totals(**self.node_resource_overrides)
+
+        # e.g. for processors that submit subtasks to this governor
+        self.isolated_processor.accepted_class_names = set(self.accepted_classes)
+
+        executor_kwargs = {
+            "isolated_processor": self.isolated_processor,
+            "etl_process_label": self.etl_process_label,
+            "start_method": self.mp_start_method,
+            "preload_modules": self.preload_module_names(),
+            "metrics_registry": self.metrics,
+        }
+        executor_cls = execution_modes[self.execution_mode]
+        if issubclass(executor_cls, WorkerPoolExecutor):
+            executor_kwargs["max_tasks_per_child"] = self.worker_max_tasks_per_child
+        task_executor = executor_cls(**executor_kwargs)
+
         pkwargs = {
             "governor_id": self.governor_id,
             "work_queue_receive": self._task_queue_submit,
-            "process_table": self.process_table,
+            "task_table": self.task_table,
             "previous_tasks": self.previous_tasks,
             "runtime": self.runtime,
             "available_processing_capacity": self.available_processing_capacity,
+            "coordinator_capacity": self.coordinator_capacity,
+            "max_concurrent_coordinators": self.max_concurrent_coordinators,
+            "node_resources": self.node_resources,
+            "resource_backfill_limit": self.resource_backfill_limit,
+            "resource_monitor": self.resource_monitor,
+            "priority_aging_seconds": self.priority_aging_seconds,
             "available_classes": self.accepted_classes,
-            "isolated_processor": self.isolated_processor,
+            "task_executor": task_executor,
+            "result_channel": self.result_channel,
+            "admission_queue": self.admission_queue,
+            "task_state_changed": self.task_state_changed,
+            "callback_runner_kwargs": {
+                "max_workers": self.callback_threads,
+                "timeout": self.callback_timeout,
+                "waiting_count": self.callbacks_waiting,
+            },
             "external_loggers": [copy.copy(logger) for logger in self.external_loggers],
             "log_to_stdout": self.log_to_stdout,
-            "etl_process_label": self.etl_process_label,
         }
 
-        governor_proc = multiprocessing.Process(
-            target=Governor.run_forever,
+        governor_proc = self.mp_context.Process(
+            target=metrics.run_with_registry,
+            args=(self.metrics, Governor.run_forever),
             kwargs=pkwargs,
             name="governor_main",
         )
@@ -187,11 +375,19 @@ class Governor(LoggingMixin):
             if isinstance(c, LoggingMixin):
                 c.copy_logging_setup(self)
 
+            # the node's free resources and memory pressure, not just free slots
+            c.node_resources = self.node_resources
+            c.resource_monitor = self.resource_monitor
+
             rf_kwargs = dict(
                 work_queue_submit=self._task_queue_submit,
                 available_processing_capacity=self.available_processing_capacity,
             )
-            proc = multiprocessing.Process(target=c.run_forever, kwargs=rf_kwargs)
+            proc = self.mp_context.Process(
+                target=metrics.run_with_registry,
+                args=(self.metrics, c.run_forever),
+                kwargs=rf_kwargs,
+            )
             proc.start()
             self._internal_process_table.append(proc)
 
@@ -202,42 +398,194 @@ class Governor(LoggingMixin):
         cls,
         governor_id,
         work_queue_receive,
-        process_table,
+        task_table,
         previous_tasks,
         runtime,
         available_processing_capacity,
+        coordinator_capacity,
+        max_concurrent_coordinators,
+        node_resources,
+        resource_backfill_limit,
+        resource_monitor,
+        priority_aging_seconds,
         available_classes,
-        isolated_processor,
+        task_executor,
+        result_channel,
+        admission_queue,
+        task_state_changed,
+        callback_runner_kwargs,
         external_loggers,
         log_to_stdout,
-        etl_process_label,
     ):
         """
         The governor's own worker process. It manages running tasks and the communication with task
         queues.
+
+        @param task_table: (:class:`SharedTaskTable`) this process is the only writer. It's
+            a copy, for other processes, of `running_tasks`.
+        @param coordinator_capacity: (:class:`ProcessingSlots`) for tasks waiting for their
+            subtasks, see :class:`CoordinatorMessage`
+        @param max_concurrent_coordinators: (int)
+        @param node_resources: (:class:`NodeResources`) a task's declared resources are
+            reserved before it starts. Tasks that don't fit wait, with their slot, until they do.
+        @param resource_backfill_limit: (float or None) seconds, see `Governor`
+        @param resource_monitor: (:class:`ResourceMonitor`) a thread in this process samples
+            memory use. Tasks waiting to start are held back whilst it's throttled.
+        @param priority_aging_seconds: (float or None) see `Governor`
+        @param task_executor: (subclass of :class:`AbstractTaskExecutor`) runs the
+            isolated_processor for each task.
+        @param result_channel: (:class:`SharedMemoryResultChannel`) removes the shared memory of
+            large results.
+        @param admission_queue: (:class:`AdmissionQueue`) a thread in this process passes its
+            tasks to `work_queue_receive` as slots become free.
+        @param task_state_changed: (:class:`multiprocessing.Condition`) notified when a task is
+            queued, starts or finishes
+        @param callback_runner_kwargs: (dict) for :class:`CallbackRunner`
         """
         logger = MiniLogger()
         logger.log_to_stdout = log_to_stdout
         for ext_log in external_loggers:
             logger.attach_external_logger(ext_log)
 
+        callback_runner = CallbackRunner(logger=logger, **callback_runner_kwargs)
+
+        # The slots are reserved by submitters before a task is put onto the queue. Now the
+        # governor is running the capacity is known.
+        available_processing_capacity.set_capacity(runtime.max_concurrent_tasks)
+        coordinator_capacity.set_capacity(max_concurrent_coordinators)
+
+        task_executor.start(runtime.max_concurrent_tasks)
+
+        def notify_state_change():
+            with task_state_changed:
+                task_state_changed.notify_all()
+
+        admission_thread = threading.Thread(
+            target=admission_queue.run_forever,
+            kwargs={
+                "work_queue_submit": work_queue_receive,
+                "available_processing_capacity": available_processing_capacity,
+                "task_table": task_table,
+                "notify": notify_state_change,
+            },
+            daemon=True,
+        )
+        admission_thread.start()
+
+        monitor_thread = threading.Thread(
+            target=resource_monitor.run_forever,
+            kwargs={"task_table": task_table, "logger": logger},
+            daemon=True,
+        )
+        monitor_thread.start()
+
+        # task_id -> dict with 'task_spec', 'started', 'proc_id' and 'coordinating'. The
+        # `task_spec` has the completion callback so this is only in this process.
+        running_tasks = {}
+
+        # (task_spec, requirements, time it arrived) for tasks that have a processing slot but
+        # are waiting for the node's resources
+        waiting_for_resources = []
+
+        def start_task(task_spec, requirements):
+            "Run the task in a new process, it's resources have been reserved"
+            iso_proc_kwargs = {
+                "task_id": task_spec.task_id,
+                "model_cls": available_classes[task_spec.model_class],
+                "model_construction_kwargs": task_spec.model_construction_kwargs,
+                "method": task_spec.method,
+                "method_kwargs": task_spec.method_kwargs,
+                "resolver_context": task_spec.resolver_context,
+                "partition_initialise_kwargs": task_spec.partition_initialise_kwargs,
+                "priority": task_spec.priority,
+            }
+
+            # run the process. It communicates back to this governor process by putting it's
+            # results, exceptions etc. onto the work_queue.
+            # The executor keeps it's own table of Processes.
+            metrics.observe("fossa_task_queue_wait_seconds", time.time() - task_spec.created_at)
+            with metrics.timer("fossa_process_start_seconds"):
+                proc_id = task_executor.run_task(task_spec.task_id, iso_proc_kwargs)
+            metrics.inc("fossa_tasks_started_total")
+            started = datetime.utcnow()
+            running_tasks[task_spec.task_id] = {
+                "task_spec": task_spec,
+                "started": started,
+                "proc_id": proc_id,
+                "coordinating": False,
+                "resources": requirements,
+            }
+            if not task_table.add(task_spec, pid=proc_id, started=started):
+                logger.log(f"Task table full, {task_spec.task_id} not shown", level="ERROR")
+            notify_state_change()
+
+        def start_waiting_tasks():
+            """
+            First fit, highest priority first, of the waiting tasks into the node's free
+            resources. Smaller tasks can start before a task that doesn't fit yet, unless it has
+            waited for longer than `resource_backfill_limit`.
+
+            Nothing starts whilst memory use is too high.
+            """
+            if resource_monitor.throttled:
+                return
+
+            wall_clock = time.time()
+            waiting_for_resources.sort(
+                key=lambda w: priority_key(w[0], wall_clock, priority_aging_seconds)
+            )
+            now = time.monotonic()
+            for waiting in list(waiting_for_resources):
+                task_spec, requirements, arrived = waiting
+                if node_resources.reserve(requirements):
+                    waiting_for_resources.remove(waiting)
+                    start_task(task_spec, requirements)
+
+                elif (
+                    resource_backfill_limit is not None and now - arrived > resource_backfill_limit
+                ):
+                    break
+
+        def terminate_executor(_signum, _frame):
+            """
+            :meth:`shutdown` terminates this process. The executor's processes, which include
+            idle pool workers, are ended first so they aren't orphaned.
+            """
+            task_executor.terminate()
+            for task_id in running_tasks:
+                result_channel.discard(task_id)
+            raise SystemExit(0)
+
+        signal.signal(signal.SIGTERM, terminate_executor)
+
         while True:
-            # Slight race condition - the window between 'Read incoming tasks' and calculating the
-            # `processing_capacity` is an opportunity for many tasks to be added to the pipe. A
-            # semaphore could be used alongside any operation on the process_table.
-            empty_queue = work_queue_receive.empty()
-            processing_capacity = runtime.max_concurrent_tasks - len(process_table)
-
-            # maintain the capacity score-board
-            if empty_queue and processing_capacity > 0:
-                available_processing_capacity.value = processing_capacity
-            else:
-                # there are items in the queue, no idea how many, they might be tasks
-                available_processing_capacity.value = 0
+            callback_runner.check_timeouts()
+
+            # ETL processes that died (e.g. OOM killer) will never send results. Make the results
+            # so the slot is released and the task is reported as failed.
+            for task_id, exitcode in task_executor.lost_tasks():
+                process_details = running_tasks.get(task_id)
+                if process_details is None:
+                    continue
+
+                msg = f"Process for task {task_id} ended without results, exitcode: {exitcode}"
+                logger.log(msg, level="ERROR")
+                result_channel.discard(task_id)
+                metrics.inc("fossa_tasks_lost_total")
+                lost_task_results = cls._lost_task_results(
+                    task_spec=process_details["task_spec"],
+                    exitcode=exitcode,
+                )
+                work_queue_receive.put(lost_task_results)
 
             # Read incoming tasks
             # This process should spend a lot of time here waiting for the next instruction
-            work_spec = work_queue_receive.get()
+            try:
+                work_spec = work_queue_receive.get(timeout=cls.housekeeping_interval)
+            except queue.Empty:
+                # e.g. memory use has dropped
+                start_waiting_tasks()
+                continue
 
             if isinstance(work_spec, TaskMessage):
                 # this message is the specification for the execution of a task
@@ -253,49 +601,90 @@ class Governor(LoggingMixin):
                     msg = f"Model class '{task_spec.model_class}' is not an accepted class"
                     raise InvalidTaskSpec(msg)
 
-                TaskCls = available_classes[task_spec.model_class]
-
-                iso_proc_kwargs = {
-                    "task_id": task_spec.task_id,
-                    "model_cls": TaskCls,
-                    "model_construction_kwargs": task_spec.model_construction_kwargs,
-                    "method": task_spec.method,
-                    "method_kwargs": task_spec.method_kwargs,
-                    "resolver_context": task_spec.resolver_context,
-                    "partition_initialise_kwargs": task_spec.partition_initialise_kwargs,
-                }
-
-                # run the process. It communicates back to this governor process by putting it's
-                # results, exceptions etc. onto the work_queue.
-                # Note - isolated_processor is a callable
-                # These processes aren't put into the `process_table` as Processes aren't
-                # serialisable. Maintaining a separate local table is an option but would need
-                # a little work to keep it insync with `process_table`. Instead, label them
-                # just in case they need to be checked.
-                ayeaye_proc = multiprocessing.Process(
-                    target=isolated_processor,
-                    kwargs=iso_proc_kwargs,
-                    name=etl_process_label,
+                if task_spec.task_id in running_tasks or any(
+                    w[0].task_id == task_spec.task_id for w in waiting_for_resources
+                ):
+                    # It would replace the other task's process, results and slot
+                    msg = f"Task id [{task_spec.task_id}] is already running or waiting"
+                    logger.log(msg, level="ERROR")
+                    available_processing_capacity.release()
+                    duplicate_results = cls._failed_task_results(
+                        task_spec, "DuplicateTaskId", [msg]
+                    )
+                    callback_runner.submit(
+                        task_spec.on_completion_callback,
+                        duplicate_results.task_message,
+                        task_spec,
+                        description=f"for duplicate task {task_spec.task_id}",
+                    )
+                    continue
+
+                requirements = requirements_for(
+                    available_classes[task_spec.model_class], task_spec.method
                 )
-                ayeaye_proc.start()
-                process_table[task_spec.task_id] = {
-                    "task_spec": task_spec,
-                    "started": datetime.utcnow(),
-                    "proc_id": ayeaye_proc.pid,
-                }
+                if not node_resources.could_fit(requirements):
+                    # It would wait forever
+                    msg = (
+                        f"Task {task_spec.task_id} needs {requirements.as_dict()}, more than this "
+                        f"node has {node_resources.totals()}"
+                    )
+                    logger.log(msg, level="ERROR")
+                    running_tasks[task_spec.task_id] = {
+                        "task_spec": task_spec,
+                        "started": datetime.utcnow(),
+                        "proc_id": 0,
+                        "coordinating": False,
+                        "resources": ResourceRequirements(),
+                    }
+                    work_queue_receive.put(
+                        cls._failed_task_results(task_spec, "InsufficientResources", [msg])
+                    )
+                    continue
+
+                waiting_for_resources.append((task_spec, requirements, time.monotonic()))
+                start_waiting_tasks()
+
+                # Waiting tasks are in priority order so it isn't necessarily last
+                if any(w[0] is task_spec for w in waiting_for_resources):
+                    # Shown as queued until it starts
+                    task_table.add(
+                        task_spec, pid=0, started=datetime.utcnow(), state=task_table.QUEUED
+                    )
+                    notify_state_change()
 
             elif isinstance(work_spec, ResultsMessage):
-                # this is the result of running a task
-                result_spec = work_spec
-                task_id = result_spec.task_id
+                # this is the result of running a task. Large results are read from shared memory.
+                task_id = work_spec.task_id
+                process_details = running_tasks.get(task_id)
+                try:
+                    result_spec = result_channel.receive(work_spec)
+                except ResultLost as e:
+                    logger.log(f"Results of task {task_id} are lost: {e}", level="ERROR")
+                    if process_details is not None:
+                        result_spec = cls._failed_task_results(
+                            process_details["task_spec"], "ResultLost", [str(e)]
+                        )
 
-                process_details = process_table.get(task_id)
                 if process_details is None:
-                    logger.log(f"Unknown task id [{task_id}], skipping callback", level="ERROR")
+                    # The results are from a process so a processing slot was reserved for it
+                    msg = f"Unknown task id [{task_id}], skipping callback and releasing its slot"
+                    logger.log(msg, level="ERROR")
+                    available_processing_capacity.release()
                     continue
 
+                # The task's process has finished so it's slot can be used by the next task
+                task_executor.task_finished(task_id)
+                if process_details.pop("coordinating"):
+                    coordinator_capacity.release()
+                else:
+                    available_processing_capacity.release()
+                node_resources.release(process_details.pop("resources"))
+
                 process_details["finished"] = datetime.utcnow()
                 process_details["result_spec"] = result_spec
+                run_time = process_details["finished"] - process_details["started"]
+                metrics.observe("fossa_task_run_seconds", run_time.total_seconds())
+                metrics.inc("fossa_tasks_finished_total")
 
                 # These are the details of the task from before processing
                 task_spec = process_details["task_spec"]
@@ -305,21 +694,95 @@ class Governor(LoggingMixin):
                 # either a fail or complete message
                 final_task_message = result_spec.task_message
 
-                # TODO - external code - wrap in try except
-                task_spec.on_completion_callback(final_task_message, task_spec)
+                # External code so it's run in another thread with errors and time limits
+                callback_runner.submit(
+                    task_spec.on_completion_callback,
+                    final_task_message,
+                    task_spec,
+                    description=f"for task {task_id}",
+                )
 
-                # Remove from processing table but keep a log of finished tasks
-                # Not pickle-able
-                process_details["task_spec"].on_completion_callback = None
+                # Remove from processing table but keep a log of finished tasks. The callback
+                # isn't pickle-able and the callback's own `task_spec` mustn't be changed.
+                process_details["task_spec"] = replace(task_spec, on_completion_callback=None)
                 previous_tasks.append(process_details)
-                del process_table[task_id]
+                del running_tasks[task_id]
+                task_table.remove(task_id)
+                notify_state_change()
+
+                # there might be room for tasks waiting for resources
+                start_waiting_tasks()
+
+            elif isinstance(work_spec, CoordinatorMessage):
+                # The task's process has reserved the slot it's moving to, release the other one.
+                coordinating = work_spec.coordinating
+                moved_from, moved_to = available_processing_capacity, coordinator_capacity
+                if not coordinating:
+                    moved_from, moved_to = moved_to, moved_from
+
+                process_details = running_tasks.get(work_spec.task_id)
+                if process_details is None:
+                    msg = f"Unknown task id [{work_spec.task_id}], releasing its coordinator change"
+                    logger.log(msg, level="ERROR")
+                    moved_to.release()
+                    continue
+
+                moved_from.release()
+                process_details["coordinating"] = coordinating
+                state = task_table.COORDINATING if coordinating else task_table.RUNNING
+                task_table.add(
+                    process_details["task_spec"],
+                    pid=process_details["proc_id"],
+                    started=process_details["started"],
+                    state=state,
+                )
+                notify_state_change()
 
             elif isinstance(work_spec, TerminateMessage):
                 logger.log("Received termination message, ending now")
+                task_executor.shutdown()
+                callback_runner.shutdown()
+                admission_queue.stop()
+                resource_monitor.stop()
                 return
             else:
                 logger.log("Unknown message type received and ignored", level="ERROR")
 
+    @classmethod
+    def _lost_task_results(cls, task_spec, exitcode):
+        """
+        Results for a task who's process ended without sending any results.
+
+        @param task_spec: (TaskMessage)
+        @param exitcode: (int) from the process. Negative values are the signal that killed it.
+        @return: :class:`ResultsMessage`
+        """
+        reason = f"ETL process ended without results. exitcode: {exitcode}"
+        return cls._failed_task_results(task_spec, "ProcessLost", [reason])
+
+    @classmethod
+    def _failed_task_results(cls, task_spec, exception_class_name, traceback):
+        """
+        Results for a task that failed outside of it's ETL process.
+
+        @param task_spec: (TaskMessage)
+        @param exception_class_name: (str)
+        @param traceback: (list of str)
+        @return: :class:`ResultsMessage`
+        """
+        task_failed = TaskFailed(
+            model_class_name=task_spec.model_class,
+            method_name=task_spec.method,
+            method_kwargs=task_spec.method_kwargs,
+            resolver_context=task_spec.resolver_context,
+            exception_class_name=exception_class_name,
+            traceback=traceback,
+            model_construction_kwargs=task_spec.model_construction_kwargs,
+            partition_initialise_kwargs=task_spec.partition_initialise_kwargs,
+            task_id=task_spec.task_id,
+        )
+        return ResultsMessage(task_id=task_spec.task_id, task_message=task_failed.to_json())
+
     def set_accepted_class(self, model_cls):
         """
         For security reasons a Fossa compute node must be configured in advance with the models
@@ -346,58 +809,166 @@ class Governor(LoggingMixin):
 
         self.accepted_classes[model_name] = model_cls
 
-    def submit_task(self, task_spec, blocking=False):
+    def task_info(self, task_id):
         """
-        Pass a task across to the governor.
+        Details of a single task, running or finished. Just the one task is read from the shared
+        memory `task_table` or the task history.
 
-        The task is passed via a queue but the queue isn't intended as a store of tasks, it's
-        just for the transit between processes. This makes a race condition possible and there
-        are scenarios when this method will return None (i.e. no available capacity) when there
-        is capacity and vice versa.
+        @param task_id: (str)
+        @return: (dict) or None if task_id not known. For keys see
+            :func:`fossa.control.task_history.running_task_summary` and
+            :func:`fossa.control.task_history.completed_task_summary`
+        """
+        task_record = self.task_table.get(task_id)
+        if task_record is not None:
+            return running_task_summary(task_record)
 
+        # A finished task is added to the history before it's removed from the `task_table`
+        # so it can't be missed between these two look ups.
+        return self.previous_tasks.get(task_id)
 
-        The 'blocking=False' argument will reduce the chance of a race condition whilst also
-        returning within a reasonable time (currently 1000 msec).
+    def set_task_history_retention(self, max_entries, spill_path=None):
+        """
+        Limit the number of finished tasks kept in memory.
 
-        @param task_spec: (TaskMessage)
-        @param blocking: (boolean) - when True, wait for capacity. When False, return None
-                if the task couldn't be accepted because the governor is at full processing
-                capacity.
-        @return: (str) identifier for the governor process that accepted the task
+        @param max_entries: (int)
+        @param spill_path: (str or None) older tasks are moved to this SQLite file instead of
+            being discarded.
         """
-        if not isinstance(task_spec, TaskMessage):
-            raise ValueError("task_spec must be of type TaskMessage")
+        self.previous_tasks.set_retention(max_entries, spill_path)
 
-        if task_spec.model_class not in self.accepted_classes:
-            msg = f"Model class '{task_spec.model_class}' is not in the list of accepted classes."
-            raise InvalidTaskSpec(msg)
+    def preload_module_names(self):
+        """
+        Modules to import in the fork server so ETL processes start from a pre-warmed image.
+
+        @return: list of str - module names
+        """
+        module_names = ["fossa.control.process", self.isolated_processor.__class__.__module__]
+        module_names += [model_cls.__module__ for model_cls in self.accepted_classes.values()]
+        module_names += self.preload_modules
 
-        if not blocking:
-            max_timeout = 1.0  # sec
+        # de-duplicate, keeping the order
+        return list(dict.fromkeys(module_names))
 
-            if self.available_processing_capacity.value < 1:
-                # No spare capacity
+    def wait_for_task_change(self, task_id, status=None, timeout=30.0):
+        """
+        Wait for a task's status to be something other than `status`.
+
+        @param task_id: (str)
+        @param status: (str) the status the caller already knows about, e.g. "queued". None
+            to return straight away.
+        @param timeout: (float) seconds
+        @return: (dict) see :meth:`task_info` - it's status will be `status` if there wasn't a
+            change within `timeout`. None if the task isn't known. A task that has only just
+            been given to :meth:`admit_task` isn't known until the governor's process has
+            received it so when `status` is given an unknown task is waited for.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            task_info = self.task_info(task_id)
+            if task_info is None and status is None:
                 return None
 
-            start_time = time.time()
+            if task_info is not None and task_info["status"] != status:
+                return task_info
 
-            while time.time() - start_time < max_timeout:
-                if (
-                    self.available_processing_capacity.value >= 1
-                    and self._task_queue_submit.empty()
-                ):
-                    self._task_queue_submit.put(task_spec)
-                    return self.governor_id
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return task_info
+
+            # A change between `task_info` and `wait` would be missed so wait in short steps
+            with self.task_state_changed:
+                self.task_state_changed.wait(timeout=min(remaining, 1.0))
+
+    def _check_task_specs(self, task_specs):
+        """
+        Check all the tasks in one pass.
+
+        @param task_specs: (list of :class:`TaskMessage`)
+        @raise InvalidTaskSpec: or ValueError if any of the tasks can't be run by this governor
+        """
+        unaccepted = []
+        for task_spec in task_specs:
+            if not isinstance(task_spec, TaskMessage):
+                raise ValueError("task_spec must be of type TaskMessage")
+
+            if task_spec.model_class not in self.accepted_classes:
+                unaccepted.append(task_spec.model_class)
+
+        if len(unaccepted) == 1:
+            msg = f"Model class '{unaccepted[0]}' is not in the list of accepted classes."
+            raise InvalidTaskSpec(msg)
+
+        if unaccepted:
+            model_classes = ", ".join(f"'{c}'" for c in dict.fromkeys(unaccepted))
+            msg = f"Model classes {model_classes} are not in the list of accepted classes."
+            raise InvalidTaskSpec(msg)
+
+    def admit_task(self, task_spec):
+        """
+        Pass a task to the governor without waiting for a processing slot. The task waits in the
+        admission queue, with the status "queued", until a slot is free.
+
+        @param task_spec: (TaskMessage)
+        @return: (str) identifier for the governor process that accepted the task
+        @raise AdmissionQueueFull: when `admission_queue.depth` tasks are already waiting
+        """
+        return self.admit_tasks([task_spec])
+
+    def admit_tasks(self, task_specs):
+        """
+        Like :meth:`admit_task` for a batch of tasks. Either all the tasks are admitted or none
+        of them are.
+
+        @param task_specs: (list of TaskMessage)
+        @return: (str) identifier for the governor process that accepted the tasks
+        @raise AdmissionQueueFull: when there isn't room for all the tasks
+        """
+        self._check_task_specs(task_specs)
+        self.admission_queue.put_many(task_specs)
+        return self.governor_id
+
+    def submit_tasks(self, task_specs):
+        """
+        Like :meth:`submit_task` for a batch of tasks. A processing slot is reserved for each task
+        before any of them are submitted.
 
-                collision_reduction = random.random()
-                time.sleep(0.2 * collision_reduction)
+        @param task_specs: (list of TaskMessage)
+        @return: (str) identifier for the governor process that accepted the tasks or None if
+            there aren't enough free slots for all the tasks, in which case none are submitted.
+        """
+        self._check_task_specs(task_specs)
 
+        if not self.available_processing_capacity.acquire(block=False, slots=len(task_specs)):
             return None
 
-        # Blocking mode
-        while self.available_processing_capacity.value < 1 or not self._task_queue_submit.empty():
-            collision_reduction = random.random()
-            time.sleep(0.2 * collision_reduction)
+        for task_spec in task_specs:
+            self._task_queue_submit.put(task_spec)
+        return self.governor_id
+
+    def submit_task(self, task_spec, blocking=False):
+        """
+        Pass a task across to the governor.
+
+        A processing slot is reserved before the task is passed via the queue. The slot is
+        released by the governor's process when the task finishes.
+
+        @param task_spec: (TaskMessage)
+        @param blocking: (boolean) - when True, wait for capacity. When False, return None
+                if the task couldn't be accepted because the governor is at full processing
+                capacity.
+        @return: (str) identifier for the governor process that accepted the task
+        """
+        self._check_task_specs([task_spec])
+
+        wait_started = time.perf_counter()
+        slot_reserved = self.available_processing_capacity.acquire(block=blocking)
+        if blocking:
+            metrics.observe("fossa_capacity_wait_seconds", time.perf_counter() - wait_started)
+
+        if not slot_reserved:
+            # No spare capacity
+            return None
 
         self._task_queue_submit.put(task_spec)
         return self.governor_id
@@ -418,13 +989,49 @@ class Governor(LoggingMixin):
         # TODO check for collisions
         return self._generate_identifier()
 
+    def new_batch_id(self, size):
+        """
+        @param size: (int) number of tasks in the batch
+        @return: (str) identifier for a batch of tasks, see :meth:`batch_task_ids`
+        """
+        return f"{self._generate_identifier()}-{size}"
+
+    @property
+    def max_batch_size(self):
+        """
+        @return: (int) most tasks in a batch. It has to fit in the admission queue or, without
+            one, in the processing slots.
+        """
+        return max(self.admission_queue.depth, self.available_processing_capacity.capacity)
+
+    def batch_task_ids(self, batch_id):
+        """
+        The task_ids are made from the batch's identifier so a batch can be tracked without
+        storing its members.
+
+        @param batch_id: (str) from :meth:`new_batch_id`
+        @return: list of str - task_ids of the tasks in the batch
+        @raise ValueError: if `batch_id` wasn't made by :meth:`new_batch_id`. This includes
+            sizes larger than :attr:`max_batch_size`, which can't have been submitted.
+        """
+        _, _, size = batch_id.rpartition("-")
+        if not (size.isascii() and size.isdigit()) or not 0 < int(size) <= self.max_batch_size:
+            raise ValueError(f"'{batch_id}' isn't a batch identifier")
+        return [f"{batch_id}-{task_number}" for task_number in range(int(size))]
+
     def _terminate_etl_processes(self):
         """
         Signal based kill of any ETL processes still running at shutdown. This is to stop
         orphaned but still running processes as they aren't daemons.
+
+        Processes that aren't running tasks, e.g. idle "worker_pool" workers, are terminated by the
+        governor's process when it receives SIGTERM from :meth:`shutdown`.
         """
-        for proc_details in self.process_table.values():
-            os.kill(proc_details["proc_id"], signal.SIGTERM)
+        for task_record in self.task_table.records():
+            if task_record["state"] == "queued":
+                # waiting in the admission queue, there isn't a process
+                continue
+            os.kill(task_record["proc_id"], signal.SIGTERM)
 
     def shutdown(self, _server):
         """
@@ -445,7 +1052,6 @@ class Governor(LoggingMixin):
         for proc in self._internal_process_table:
             proc.join()
 
-        # Note that ETL processes aren't explicitly killed. They
-
         self.mp_manager.shutdown()
+        self.task_table.close()
         self.log("finished stopping governor processes")
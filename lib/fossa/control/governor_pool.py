@@ -0,0 +1,212 @@
+"""
+Run the subtasks of an :class:`ayeaye.PartitionedModel` as tasks of the local governor. This gives
+parallel subtasks on a single node without a message broker.
+"""
+from collections import deque
+from functools import partial
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+import queue
+import secrets
+import threading
+
+from ayeaye.runtime.multiprocess import AbstractProcessPool
+from ayeaye.runtime.task_message import task_message_factory, TaskFailed
+
+from fossa.control.message import TaskMessage
+from fossa.tools.logging import LoggingMixin
+
+
+def send_subtask_result(address, authkey, final_task_message, task_spec):
+    """
+    Completion callback for subtasks. Runs in the governor's process and sends the results to the
+    :class:`GovernorProcessPool` waiting for them.
+
+    @param address: (str) of the pool's :class:`multiprocessing.connection.Listener`
+    @param authkey: (bytes)
+    @param final_task_message: (str) JSON
+    @param task_spec: (:class:`TaskMessage`) the subtask
+    """
+    with Client(address, family="AF_UNIX", authkey=authkey) as connection:
+        connection.send((task_spec.task_id, final_task_message))
+
+
+class GovernorProcessPool(AbstractProcessPool, LoggingMixin):
+    """
+    Submit subtasks to the governor's own task queue. Each subtask reserves a processing slot
+    so subtasks run in parallel across the node's slots without over committing it.
+
+    The parent task swaps its processing slot for a coordinator slot (:class:`CoordinatorSlot`)
+    whilst it waits for its subtasks and takes a processing slot again before carrying on. When
+    all the coordinator slots are in use it keeps its processing slot until one is free.
+
+    Subtasks with a model class the governor doesn't accept aren't submitted, they fail.
+
+    Results come back from the governor's completion callback (:func:`send_subtask_result`)
+    through a unix socket that is only open whilst :meth:`run_subtasks` is running.
+
+    Doesn't re-try failed subtasks, a :class:`TaskFailed` is passed to the model.
+    """
+
+    # seconds between attempts to reserve slots for subtasks that are waiting to be sent
+    poll_interval = 0.1
+
+    def __init__(
+        self,
+        work_queue_submit,
+        available_processing_capacity,
+        priority=0,
+        coordinator=None,
+        accepted_class_names=None,
+    ):
+        """
+        @param work_queue_submit: (:class:`multiprocessing.Queue`) the governor's task queue
+        @param available_processing_capacity: (:class:`ProcessingSlots`)
+        @param priority: (int) of the subtasks, see :attr:`TaskMessage.priority`
+        @param coordinator: (:class:`CoordinatorSlot`) for the parent task. None to keep the
+            parent's processing slot whilst it waits.
+        @param accepted_class_names: (set of str) model classes the governor accepts. None to
+            not check.
+        """
+        LoggingMixin.__init__(self)
+        self.work_queue_submit = work_queue_submit
+        self.available_processing_capacity = available_processing_capacity
+        self.priority = priority
+        self.coordinator = coordinator
+        self.accepted_class_names = accepted_class_names
+        self.pool_id = secrets.token_hex(4)
+
+    @staticmethod
+    def _receive_results(listener, results, stopping):
+        "Background thread, puts (subtask_id, final_task_message) onto `results`"
+        while True:
+            try:
+                connection = listener.accept()
+            except AuthenticationError:
+                continue
+            except OSError:
+                return
+
+            if stopping.is_set():
+                connection.close()
+                return
+
+            with connection:
+                try:
+                    results.put(connection.recv())
+                except (EOFError, OSError):
+                    pass
+
+    def run_subtasks(self, sub_tasks, context_kwargs=None, processes=None):
+        """
+        Generator yielding instances that are a subclass of :class:`AbstractTaskMessage`. These
+        are from subtasks.
+
+        Subtasks with a model class the governor doesn't accept fail without being submitted.
+
+        @see doc. string in :meth:`AbstractProcessPool.run_subtasks`
+        """
+        max_in_flight = processes if processes is not None else len(sub_tasks)
+
+        authkey = secrets.token_bytes(16)
+        listener = Listener(family="AF_UNIX", authkey=authkey)
+        results = queue.Queue()
+        stopping = threading.Event()
+        receiver = threading.Thread(
+            target=self._receive_results, args=(listener, results, stopping), daemon=True
+        )
+        receiver.start()
+
+        on_completion_callback = partial(send_subtask_result, listener.address, authkey)
+
+        pending_tasks = deque()
+        unaccepted_tasks = []
+        for subtask_number, sub_task in enumerate(sub_tasks):
+            # See Aye-aye's `ayeaye.runtime.task_message.TaskPartition`
+            task_spec = TaskMessage(
+                task_id=f"subtask-{self.pool_id}-{subtask_number}",
+                model_class=sub_task.model_cls.__name__,
+                method=sub_task.method_name,
+                method_kwargs=sub_task.method_kwargs,
+                resolver_context=context_kwargs or {},
+                on_completion_callback=on_completion_callback,
+                model_construction_kwargs=sub_task.model_construction_kwargs,
+                partition_initialise_kwargs=sub_task.partition_initialise_kwargs,
+                priority=self.priority,
+            )
+            if (
+                self.accepted_class_names is not None
+                and task_spec.model_class not in self.accepted_class_names
+            ):
+                unaccepted_tasks.append(task_spec)
+            else:
+                pending_tasks.append(task_spec)
+
+        in_flight = set()
+        try:
+            # The governor would refuse them
+            for task_spec in unaccepted_tasks:
+                msg = f"Model class '{task_spec.model_class}' is not an accepted class"
+                self.log(f"Subtask {task_spec.task_id} failed: {msg}", "ERROR")
+                yield self._failed_subtask(task_spec, "InvalidTaskSpec", [msg])
+
+            while pending_tasks or in_flight:
+                # Whilst waiting, this task's slot can be used by its subtasks. When there isn't
+                # a free coordinator slot it's tried again next time round.
+                if self.coordinator is not None:
+                    self.coordinator.begin()
+
+                while (
+                    pending_tasks
+                    and len(in_flight) < max_in_flight
+                    and self.available_processing_capacity.acquire(block=False)
+                ):
+                    task_spec = pending_tasks.popleft()
+                    self.work_queue_submit.put(task_spec)
+                    in_flight.add(task_spec.task_id)
+
+                try:
+                    subtask_id, final_task_message = results.get(timeout=self.poll_interval)
+                except queue.Empty:
+                    continue
+
+                if subtask_id not in in_flight:
+                    self.log(f"Unknown subtask {subtask_id}, ignoring results", "WARNING")
+                    continue
+
+                in_flight.remove(subtask_id)
+                yield task_message_factory(final_task_message)
+
+        finally:
+            # wake the receiver so it sees `stopping`
+            stopping.set()
+            try:
+                Client(listener.address, family="AF_UNIX", authkey=authkey).close()
+            except OSError:
+                pass
+            listener.close()
+            receiver.join(timeout=5)
+
+            # the governor releases this task's slot when it finishes
+            if self.coordinator is not None:
+                self.coordinator.end()
+
+    @staticmethod
+    def _failed_subtask(task_spec, exception_class_name, traceback):
+        """
+        @param task_spec: (:class:`TaskMessage`) the subtask that wasn't run
+        @param exception_class_name: (str)
+        @param traceback: (list of str)
+        @return: :class:`TaskFailed`
+        """
+        return TaskFailed(
+            model_class_name=task_spec.model_class,
+            method_name=task_spec.method,
+            method_kwargs=task_spec.method_kwargs,
+            resolver_context=task_spec.resolver_context,
+            exception_class_name=exception_class_name,
+            traceback=traceback,
+            model_construction_kwargs=task_spec.model_construction_kwargs,
+            partition_initialise_kwargs=task_spec.partition_initialise_kwargs,
+            task_id=task_spec.task_id,
+        )
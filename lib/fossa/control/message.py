@@ -1,4 +1,5 @@
 from dataclasses import dataclass, field
+import time
 from typing import Any, Callable, Optional
 
 
@@ -17,6 +18,8 @@ class TaskMessage(AbstractMessage):
     task_id: Optional[str] = None
     model_construction_kwargs: dict = field(default_factory=dict)
     partition_initialise_kwargs: dict = field(default_factory=dict)
+    created_at: float = field(default_factory=time.time)  # to measure time waiting to start
+    priority: int = 0  # higher starts first, see :mod:`fossa.control.priority`
 
 
 @dataclass
@@ -29,6 +32,17 @@ class ResultsMessage(AbstractMessage):
     task_message: Any  # subclass obj. of :class:`ayeaye.runtime.task_message.AbstractTaskMessage`
 
 
+@dataclass
+class CoordinatorMessage(AbstractMessage):
+    """
+    Sent by a task's ETL process when it starts, or stops, waiting for subtasks it sent
+    elsewhere. See :class:`CoordinatorSlot`.
+    """
+
+    task_id: str
+    coordinating: bool
+
+
 @dataclass
 class TerminateMessage(AbstractMessage):
     """
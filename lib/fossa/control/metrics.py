@@ -0,0 +1,400 @@
+"""
+Counters and histograms of Fossa's own overheads, shared by all of a node's processes and shown
+in the Prometheus text format by `/metrics`.
+
+Values are kept in a :class:`multiprocessing.sharedctypes.RawArray` made 'pre-fork' by the
+:class:`Governor`. Gunicorn workers, the governor's process, sidecars and ETL processes all add
+to the same array so `/metrics` can be served by any web worker without collecting values from
+other processes.
+
+An ETL process can be killed, e.g. by a task timeout or the OOM killer, whilst it holds the lock
+guarding the array. The lock is only waited on for a short time and, if the process holding it
+has gone, it's released on that process's behalf. Values that can't be recorded because the lock
+is held by a live process for too long are dropped rather than blocking the governor.
+
+Code records values with the module level functions, e.g. `metrics.observe(name, seconds)`.
+These use the registry installed in the process with :func:`install`. Forked processes inherit
+it, processes made with the "spawn" or "forkserver" start methods have it installed by
+:func:`run_with_registry`.
+"""
+from contextlib import contextmanager
+from dataclasses import dataclass
+import math
+import multiprocessing
+import os
+import time
+
+# Prometheus text format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+SECONDS_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    300.0,
+    1800.0,
+)
+BYTES_BUCKETS = tuple(float(4**power) for power in range(5, 16))  # 1KiB to 1GiB
+
+# seconds to wait for the lock before checking if the process holding it is still alive
+LOCK_TIMEOUT = 0.25
+
+
+@dataclass(frozen=True)
+class MetricSpec:
+    name: str
+    kind: str  # "counter", "gauge" or "histogram"
+    help: str
+    buckets: tuple = ()  # upper bounds, just for histograms
+
+
+metric_specs = [
+    MetricSpec("fossa_tasks_started_total", "counter", "Tasks started by the governor"),
+    MetricSpec("fossa_tasks_finished_total", "counter", "Tasks with results, including failures"),
+    MetricSpec(
+        "fossa_tasks_lost_total", "counter", "Tasks who's process ended without sending results"
+    ),
+    MetricSpec(
+        "fossa_task_queue_wait_seconds",
+        "histogram",
+        "Time from a task being made to its process being started",
+        SECONDS_BUCKETS,
+    ),
+    MetricSpec(
+        "fossa_process_start_seconds",
+        "histogram",
+        "Time taken by the task executor to start a task's process",
+        SECONDS_BUCKETS,
+    ),
+    MetricSpec(
+        "fossa_task_run_seconds",
+        "histogram",
+        "Time from a task starting to its results arriving at the governor",
+        SECONDS_BUCKETS,
+    ),
+    MetricSpec(
+        "fossa_capacity_wait_seconds",
+        "histogram",
+        "Time spent waiting to reserve a processing slot",
+        SECONDS_BUCKETS,
+    ),
+    MetricSpec(
+        "fossa_result_serialise_seconds",
+        "histogram",
+        "Time taken by the ETL process to serialise a task's results",
+        SECONDS_BUCKETS,
+    ),
+    MetricSpec(
+        "fossa_result_bytes", "histogram", "Size of a task's serialised results", BYTES_BUCKETS
+    ),
+    MetricSpec(
+        "fossa_broker_publish_seconds",
+        "histogram",
+        "Time taken to publish a batch of subtasks or results to the message broker",
+        SECONDS_BUCKETS,
+    ),
+    MetricSpec(
+        "fossa_broker_get_seconds",
+        "histogram",
+        "Time taken to fetch a subtask from the message broker when polling",
+        SECONDS_BUCKETS,
+    ),
+    MetricSpec(
+        "fossa_broker_messages_received_total", "counter", "Subtasks received from the broker"
+    ),
+    MetricSpec("fossa_subtasks_sent_total", "counter", "Subtasks sent to the message broker"),
+    MetricSpec("fossa_subtask_retries_total", "counter", "Failed subtasks that were sent again"),
+    MetricSpec(
+        "fossa_subtask_speculative_total",
+        "counter",
+        "Slow or lost subtasks that were sent again",
+    ),
+    MetricSpec(
+        "fossa_callback_timeouts_total",
+        "counter",
+        "Completion callbacks that ran for longer than the callback timeout",
+    ),
+    MetricSpec(
+        "fossa_callbacks_waiting", "gauge", "Completion callbacks waiting for a thread to run them"
+    ),
+]
+
+
+class SharedMetrics:
+    """
+    Fixed set of metrics in shared memory.
+
+    A counter or gauge takes one value in the array. A histogram takes a count for each bucket, one for
+    values above the largest bucket and its sum. Bucket counts aren't cumulative, they're added
+    up when the metrics are read.
+    """
+
+    def __init__(self, mp_context=None, specs=None, lock_timeout=LOCK_TIMEOUT):
+        """
+        @param mp_context: (multiprocessing context or None) the lock must be made in the same
+            context as the processes using it. None for the default context.
+        @param specs: (list of :class:`MetricSpec`) defaults to `metric_specs`
+        @param lock_timeout: (float) seconds to wait for the lock before checking whether the
+            process holding it has died
+        """
+        mp_context = mp_context or multiprocessing.get_context()
+        self.specs = specs or metric_specs
+        self.lock_timeout = lock_timeout
+
+        # name -> (spec, offset in `_values`)
+        self._layout = {}
+        size = 0
+        for spec in self.specs:
+            self._layout[spec.name] = (spec, size)
+            size += len(spec.buckets) + 2 if spec.kind == "histogram" else 1
+
+        self._values = mp_context.RawArray("d", size)
+        self._lock = mp_context.Lock()
+        # pid of the process holding `_lock`, 0 when it's free
+        self._lock_holder = mp_context.RawValue("i", 0)
+        # stops two processes both releasing the lock of the same dead process
+        self._recovery_lock = mp_context.Lock()
+
+        # values this process couldn't record because the lock was held by a live process
+        self.dropped = 0
+
+    def _acquire(self):
+        """
+        Take `_lock`, releasing it first if the process holding it has died.
+
+        @return: (bool) the lock was taken and must be released with :meth:`_release`
+        """
+        if self._lock.acquire(timeout=self.lock_timeout):
+            self._lock_holder.value = os.getpid()
+            return True
+
+        holder = self._lock_holder.value
+        if holder and not _process_alive(holder):
+            if self._recovery_lock.acquire(timeout=self.lock_timeout):
+                try:
+                    # another process might have already recovered the lock
+                    if self._lock_holder.value == holder:
+                        self._lock_holder.value = 0
+                        self._lock.release()
+                finally:
+                    self._recovery_lock.release()
+
+            if self._lock.acquire(timeout=self.lock_timeout):
+                self._lock_holder.value = os.getpid()
+                return True
+
+        self.dropped += 1
+        return False
+
+    def _release(self):
+        self._lock_holder.value = 0
+        self._lock.release()
+
+    def _offset(self, name, kind):
+        spec, offset = self._layout[name]
+        if spec.kind != kind:
+            raise ValueError(f"{name} is a {spec.kind}")
+        return spec, offset
+
+    def inc(self, name, amount=1.0):
+        """
+        @param name: (str) of a counter
+        @param amount: (float)
+        """
+        _, offset = self._offset(name, "counter")
+        if not self._acquire():
+            return
+        try:
+            self._values[offset] += amount
+        finally:
+            self._release()
+
+    def set_gauge(self, name, value):
+        """
+        @param name: (str) of a gauge
+        @param value: (float)
+        """
+        _, offset = self._offset(name, "gauge")
+        if not self._acquire():
+            return
+        try:
+            self._values[offset] = value
+        finally:
+            self._release()
+
+    def observe(self, name, value):
+        """
+        @param name: (str) of a histogram
+        @param value: (float)
+        """
+        spec, offset = self._offset(name, "histogram")
+        bucket = len(spec.buckets)
+        for position, upper_bound in enumerate(spec.buckets):
+            if value <= upper_bound:
+                bucket = position
+                break
+
+        if not self._acquire():
+            return
+        try:
+            self._values[offset + bucket] += 1
+            self._values[offset + len(spec.buckets) + 1] += value
+        finally:
+            self._release()
+
+    @contextmanager
+    def timer(self, name):
+        """
+        Observe the seconds taken by the `with` block.
+
+        @param name: (str) of a histogram
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def values(self):
+        """
+        @return: (dict) name -> float for counters and gauges, name -> dict with 'buckets' (list of
+            (upper bound, cumulative count)), 'sum' and 'count' for histograms
+        """
+        if self._acquire():
+            try:
+                raw = self._values[:]
+            finally:
+                self._release()
+        else:
+            # a live process is holding the lock, the values might be part way through an update
+            raw = self._values[:]
+
+        values = {}
+        for name, (spec, offset) in self._layout.items():
+            if spec.kind != "histogram":
+                values[name] = raw[offset]
+                continue
+
+            buckets = []
+            cumulative = 0.0
+            for position, upper_bound in enumerate(spec.buckets + (math.inf,)):
+                cumulative += raw[offset + position]
+                buckets.append((upper_bound, cumulative))
+            values[name] = {
+                "buckets": buckets,
+                "sum": raw[offset + len(spec.buckets) + 1],
+                "count": cumulative,
+            }
+        return values
+
+    def exposition(self):
+        """
+        @return: (str) all the metrics in the Prometheus text format
+        """
+        values = self.values()
+        lines = []
+        for spec in self.specs:
+            lines.append(f"# HELP {spec.name} {spec.help}")
+            lines.append(f"# TYPE {spec.name} {spec.kind}")
+            value = values[spec.name]
+            if spec.kind != "histogram":
+                lines.append(f"{spec.name} {value}")
+                continue
+
+            for upper_bound, count in value["buckets"]:
+                le = "+Inf" if upper_bound == math.inf else repr(upper_bound)
+                lines.append(f'{spec.name}_bucket{{le="{le}"}} {count}')
+            lines.append(f"{spec.name}_sum {value['sum']}")
+            lines.append(f"{spec.name}_count {value['count']}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _process_alive(pid):
+    """
+    @param pid: (int)
+    @return: (bool) False if the process has ended, including if it's a zombie waiting to be
+        reaped by its parent
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            # the state follows the command, which is in brackets and might contain spaces
+            return stat.read().rpartition(")")[2].split()[0] not in ("Z", "X")
+    except (OSError, IndexError):
+        return True
+
+
+# registry for this process, see :func:`install`
+_registry = None
+
+
+def install(registry):
+    """
+    Make `registry` the one used by this process and any processes it forks.
+
+    @param registry: (:class:`SharedMetrics`)
+    """
+    global _registry
+    _registry = registry
+
+
+def get_registry():
+    """
+    @return: (:class:`SharedMetrics`) installed in this process. One just for this process is
+        made if none has been installed.
+    """
+    global _registry
+    if _registry is None:
+        _registry = SharedMetrics()
+    return _registry
+
+
+def run_with_registry(registry, target, *args, **kwargs):
+    """
+    Target for a :class:`multiprocessing.Process` that installs `registry` in the new process
+    before running `target`. Needed with the "spawn" and "forkserver" start methods as nothing
+    is inherited.
+
+    @param registry: (:class:`SharedMetrics`)
+    @param target: (callable)
+    """
+    install(registry)
+    return target(*args, **kwargs)
+
+
+def inc(name, amount=1.0):
+    "@see :meth:`SharedMetrics.inc`"
+    get_registry().inc(name, amount)
+
+
+def set_gauge(name, value):
+    "@see :meth:`SharedMetrics.set_gauge`"
+    get_registry().set_gauge(name, value)
+
+
+def observe(name, value):
+    "@see :meth:`SharedMetrics.observe`"
+    get_registry().observe(name, value)
+
+
+def timer(name):
+    "@see :meth:`SharedMetrics.timer`"
+    return get_registry().timer(name)
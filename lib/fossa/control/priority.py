@@ -0,0 +1,40 @@
+"""
+Tasks with a higher `priority` are started first. Waiting tasks age so low priority tasks
+aren't starved by a steady stream of higher priority tasks.
+"""
+
+# Priorities are 0 (default) to this. RabbitMQ recommends no more than 10 levels.
+MAX_PRIORITY = 9
+
+
+def check_priority(priority):
+    """
+    @param priority: (int)
+    @return: (int) `priority`
+    @raise ValueError: if it isn't a whole number from 0 to `MAX_PRIORITY`
+    """
+    if isinstance(priority, bool) or not isinstance(priority, int):
+        raise ValueError(f"priority must be a whole number, not {priority!r}")
+
+    if not 0 <= priority <= MAX_PRIORITY:
+        raise ValueError(f"priority must be from 0 to {MAX_PRIORITY}, not {priority}")
+
+    return priority
+
+
+def priority_key(task_spec, now, aging_seconds):
+    """
+    Sort key putting the most urgent task first. A task's priority goes up by one for each
+    `aging_seconds` it has waited since it was made. Equal priorities are first come, first
+    served.
+
+    @param task_spec: (:class:`TaskMessage`)
+    @param now: (float) seconds since the epoch, as `TaskMessage.created_at`
+    @param aging_seconds: (float or None) None for priorities to stay as they are
+    @return: (tuple)
+    """
+    effective_priority = task_spec.priority
+    if aging_seconds:
+        effective_priority += max(0.0, now - task_spec.created_at) / aging_seconds
+
+    return -effective_priority, task_spec.created_at
@@ -1,3 +1,4 @@
+import time
 import traceback
 import sys
 
@@ -5,6 +6,10 @@ import ayeaye
 from ayeaye.exception import SubTaskFailed
 from ayeaye.runtime.task_message import TaskComplete, TaskFailed
 
+from fossa.control import metrics
+from fossa.control.capacity import CoordinatorSlot
+from fossa.control.claim_check import check_in, claim
+from fossa.control.governor_pool import GovernorProcessPool
 from fossa.control.message import ResultsMessage
 from fossa.tools.logging import LoggingMixin
 
@@ -25,22 +30,72 @@ class AbstractIsolatedProcessor(LoggingMixin):
     :class:`ayeaye.PartitionedModel` can be distributed to other workers.
     """
 
-    def __init__(self):
+    def __init__(self, blob_store=None, claim_check_min_bytes=1024 * 1024):
         """
         This construction happens 'pre-fork' so should only contain strong types that can
         survive being serialised (pickled) and passed to a new `Process`.
 
         Subclasses are expected to have their own constructors which pass any left over
         arguments to this superclass.
+
+        @param blob_store: (:class:`AbstractBlobStore`) optional. Return values that are larger
+            than `claim_check_min_bytes` when JSON encoded are put here and only a claim check
+            is sent back. See :mod:`fossa.control.claim_check`.
+        @param claim_check_min_bytes: (int)
         """
         LoggingMixin.__init__(self)
         self.work_queue = None
+        self.result_channel = None
+        self.available_processing_capacity = None
+        self.coordinator_capacity = None
+        self.blob_store = blob_store
+
+        # names of the model classes the governor accepts, set by the governor when it starts
+        self.accepted_class_names = None
 
-    def set_work_queue(self, work_queue):
+        # task being run, set in the task's process by :meth:`__call__`
+        self.task_id = None
+        self.task_priority = 0
+        self.claim_check_min_bytes = claim_check_min_bytes
+
+    def set_work_queue(
+        self,
+        work_queue,
+        result_channel=None,
+        available_processing_capacity=None,
+        coordinator_capacity=None,
+    ):
         """
         @param work_queue (one end of :class:`multiprocessing.Queue`) - to post results to
+        @param result_channel (:class:`SharedMemoryResultChannel`) - optional, large results are
+            passed through shared memory
+        @param available_processing_capacity (:class:`ProcessingSlots`) - optional, the
+            governor's slots for processors that submit subtasks to the governor
+        @param coordinator_capacity (:class:`ProcessingSlots`) - optional, slots for tasks that
+            are waiting for their subtasks. See :meth:`coordinator_slot`.
         """
         self.work_queue = work_queue
+        self.result_channel = result_channel
+        self.available_processing_capacity = available_processing_capacity
+        self.coordinator_capacity = coordinator_capacity
+
+    def coordinator_slot(self):
+        """
+        Called in the task's process, e.g. by :meth:`on_model_start`, for process pools that
+        wait for subtasks run elsewhere.
+
+        @return: (:class:`CoordinatorSlot`) for the task being run or None if the governor
+            doesn't have coordinator slots
+        """
+        if self.coordinator_capacity is None or self.available_processing_capacity is None:
+            return None
+
+        return CoordinatorSlot(
+            task_id=self.task_id,
+            work_queue=self.work_queue,
+            available_processing_capacity=self.available_processing_capacity,
+            coordinator_capacity=self.coordinator_capacity,
+        )
 
     def on_model_start(self, model):
         """
@@ -63,6 +118,7 @@ class AbstractIsolatedProcessor(LoggingMixin):
         method_kwargs,
         resolver_context,
         partition_initialise_kwargs,
+        priority=0,
     ):
         """
         Run/execute the model.
@@ -79,11 +135,15 @@ class AbstractIsolatedProcessor(LoggingMixin):
         @param model_cls: (Class, not instance)
         @param model_construction_kwargs: (dict)
         @param method: (str)
-        @param method_kwargs: (dict)
+        @param method_kwargs: (dict) or a claim check for the dict, it's fetched just before the
+            method is run
         @param resolver_context: (dict)
         @param partition_initialise_kwargs: (dict)
+        @param priority: (int) of the task, see :attr:`TaskMessage.priority`
         @return: None
         """
+        self.task_id = task_id
+        self.task_priority = priority
         try:
             with ayeaye.connector_resolver.context(**resolver_context):
                 model = model_cls(**model_construction_kwargs)
@@ -97,17 +157,29 @@ class AbstractIsolatedProcessor(LoggingMixin):
                 # TODO - attach logging - hint - send TaskLogMessage down self.work_queue
 
                 sub_task_method = getattr(model, method)
-                subtask_return_value = sub_task_method(**method_kwargs)
+                subtask_return_value = sub_task_method(**claim(method_kwargs))
 
+            # The originator already has the method_kwargs so a claim check is sent back as is
             task_complete = TaskComplete(
                 method_name=method,
                 method_kwargs=method_kwargs,
                 return_value=subtask_return_value,
             )
+            serialise_started = time.perf_counter()
+            task_complete_json = task_complete.to_json()
+
+            if self.blob_store is not None and len(task_complete_json) > self.claim_check_min_bytes:
+                task_complete.return_value = check_in(self.blob_store, subtask_return_value)
+                task_complete_json = task_complete.to_json()
+
+            metrics.observe(
+                "fossa_result_serialise_seconds", time.perf_counter() - serialise_started
+            )
+            metrics.observe("fossa_result_bytes", len(task_complete_json))
 
             result_spec = ResultsMessage(
                 task_id=task_id,
-                task_message=task_complete.to_json(),
+                task_message=task_complete_json,
             )
 
         except SubTaskFailed as e:
@@ -165,6 +237,9 @@ class AbstractIsolatedProcessor(LoggingMixin):
                 task_message=task_failed.to_json(),
             )
 
+        if self.result_channel is not None:
+            result_spec = self.result_channel.send(result_spec)
+
         self.work_queue.put(result_spec)
 
 
@@ -193,3 +268,40 @@ class LocalAyeAyeProcessor(AbstractIsolatedProcessor):
         if self.enforce_single_partition and issubclass(model_cls, ayeaye.PartitionedModel):
             # Force a maximum of one process when running a parallel model
             model.runtime.max_concurrent_tasks = 1
+
+
+class LocalGovernorProcessor(AbstractIsolatedProcessor):
+    """
+    Run the subtasks of an :class:`ayeaye.PartitionedModel` as tasks of the local governor so they
+    run in parallel across the node's processing slots. No message broker is needed. See
+    :class:`GovernorProcessPool`.
+
+    The subtasks' model classes must be accepted by the governor. Whilst waiting for its subtasks
+    the parent task uses a coordinator slot so the governor must have at least one, see
+    `Governor.max_concurrent_coordinators`.
+    """
+
+    def on_model_start(self, model):
+        """
+        @see :meth:`AbstractIsolatedProcessor.on_model_start` for doc. string.
+        """
+        if isinstance(model, ayeaye.PartitionedModel):
+            coordinator = self.coordinator_slot()
+            if coordinator is None:
+                raise ValueError("LocalGovernorProcessor hasn't been attached to a governor")
+
+            if self.coordinator_capacity.capacity < 1:
+                # The subtasks could wait forever for the parent's processing slot
+                raise ValueError("LocalGovernorProcessor needs at least one coordinator slot")
+
+            model.process_pool = GovernorProcessPool(
+                work_queue_submit=self.work_queue,
+                available_processing_capacity=self.available_processing_capacity,
+                priority=self.task_priority,
+                coordinator=coordinator,
+                accepted_class_names=self.accepted_class_names,
+            )
+            model.process_pool.copy_logging_setup(self)
+
+            # subtasks can use every slot on the node
+            model.runtime.max_concurrent_tasks = self.available_processing_capacity.capacity
@@ -0,0 +1,148 @@
+import asyncio
+
+from fossa.control.rabbit_mq.async_pika_client import AsyncPikaClient
+from fossa.control.rabbit_mq.message_exchange import RabbitMx
+
+
+class AsyncRabbitMx(RabbitMx):
+    """
+    :class:`RabbitMx` using :class:`AsyncPikaClient`. Waiting for processing slots, receiving
+    tasks and heartbeats run concurrently in one event loop so a slow step doesn't stop the
+    connection being serviced.
+
+    Results are sent by the :class:`ResultsPublisher` in the governor's process, as with
+    :class:`RabbitMx`, as that is where the completion callback runs.
+    """
+
+    pika_client_cls = AsyncPikaClient
+
+    def run_forever(self, work_queue_submit, available_processing_capacity):
+        """
+        Take a task received from RabbitMq exchange and pass it to the local governor.
+
+        Runs in a separate Process
+        """
+        self.log("Asyncio RabbitMx exchange is starting")
+        asyncio.run(self.run_async(work_queue_submit, available_processing_capacity))
+
+    async def run_async(self, work_queue_submit, available_processing_capacity):
+        "@see :meth:`run_forever`"
+        while True:
+            rabbit_mq = self.pika_client_cls(url=self.broker_url, max_priority=self.max_priority)
+            try:
+                async for _not_connected in rabbit_mq.connect():
+                    self.log("Waiting to connect to RabbitMQ....", "WARNING")
+                self.log("Connected to RabbitMQ")
+
+                consumer = AsyncSlotWindowConsumer(
+                    rabbit_mq=rabbit_mq,
+                    exchange=self,
+                    work_queue_submit=work_queue_submit,
+                    available_processing_capacity=available_processing_capacity,
+                )
+                while True:
+                    await consumer.step()
+
+            except Exception as e:
+                self.log(f"Restarting after exception in RabbitMQ exchange: {e}", "ERROR")
+                try:
+                    await rabbit_mq.close_connection()
+                except:
+                    pass
+
+                await asyncio.sleep(5)
+
+
+class AsyncSlotWindowConsumer:
+    """
+    The asyncio version of :class:`SlotWindowConsumer`. The prefetch window is the number of
+    free processing slots, messages are acked once they are on the governor's queue.
+    """
+
+    def __init__(
+        self, rabbit_mq, exchange, work_queue_submit, available_processing_capacity, wait=10.0
+    ):
+        """
+        @param rabbit_mq: (:class:`AsyncPikaClient`) connected
+        @param exchange: (:class:`RabbitMx`) builds and submits tasks
+        @param work_queue_submit: (:class:`multiprocessing.Queue`) the governor's task queue
+        @param available_processing_capacity: (:class:`ProcessingSlots`)
+        @param wait: (float) seconds each :meth:`step` waits for a message or a free slot
+        """
+        self.rabbit_mq = rabbit_mq
+        self.exchange = exchange
+        self.work_queue_submit = work_queue_submit
+        self.available_processing_capacity = available_processing_capacity
+        self.wait = wait
+
+        self.consumer_tag = None
+        self.prefetch_count = None
+
+        # (channel, method, properties, body) received but not yet passed to the governor
+        self.pending = asyncio.Queue()
+
+    def on_message(self, channel, method, properties, body):
+        "Called by pika"
+        self.pending.put_nowait((channel, method, properties, body))
+
+    async def _start_consuming(self, free_slots):
+        if self.prefetch_count != free_slots:
+            await self.rabbit_mq.set_prefetch(free_slots)
+            self.prefetch_count = free_slots
+
+        if self.consumer_tag is None:
+            self.consumer_tag = await self.rabbit_mq.consume(
+                self.rabbit_mq.task_queue_name, self.on_message
+            )
+
+    async def _stop_consuming(self):
+        "Stop deliveries and return anything already delivered to the queue"
+        if self.consumer_tag is not None:
+            await self.rabbit_mq.cancel(self.consumer_tag)
+            self.consumer_tag = None
+
+        while not self.pending.empty():
+            _channel, method, _properties, _body = self.pending.get_nowait()
+            self.rabbit_mq.nack(method.delivery_tag, requeue=True)
+
+    async def step(self):
+        """
+        Wait for one message, or a free slot when there aren't any, and pass it to the governor.
+        """
+        if not self.rabbit_mq.is_open:
+            raise ConnectionError("RabbitMQ connection lost")
+
+        free_slots = self.exchange.task_window(self.available_processing_capacity)
+        if free_slots == 0:
+            await self._stop_consuming()
+
+            # The slot's lock is a multiprocessing lock so wait in a thread. Wakes as soon as a
+            # slot is released.
+            loop = asyncio.get_running_loop()
+            acquire = self.available_processing_capacity.acquire
+            if await loop.run_in_executor(None, acquire, True, self.wait):
+                self.available_processing_capacity.release()
+            return
+
+        await self._start_consuming(free_slots)
+
+        try:
+            channel, method, properties, body = await asyncio.wait_for(
+                self.pending.get(), self.wait
+            )
+        except asyncio.TimeoutError:
+            return
+
+        if not self.available_processing_capacity.acquire(block=False):
+            # slots were taken by another submitter
+            self.rabbit_mq.nack(method.delivery_tag, requeue=True)
+            await self._stop_consuming()
+            return
+
+        # The slot is already reserved so the governor will accept this task. Acking doesn't
+        # wait for the broker so it's safe within the event loop.
+        try:
+            self.exchange.submit_delivery(channel, method, properties, body, self.work_queue_submit)
+        except:
+            self.available_processing_capacity.release()
+            raise
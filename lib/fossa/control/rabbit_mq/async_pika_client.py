@@ -0,0 +1,214 @@
+import asyncio
+
+import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
+
+from fossa.control.rabbit_mq.pika_client import connection_parameters, task_queue_arguments
+
+
+def _resolve(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _fail(future, exception):
+    if not future.done():
+        future.set_exception(exception)
+
+
+class AsyncPikaClient:
+    """
+    The asyncio equivalent of :class:`BasicPikaClient`. It uses pika's asyncio adapter so
+    heartbeats, consuming and publishing all run concurrently within one event loop without
+    calls to `process_data_events`.
+
+    Must be used from within a running event loop.
+    """
+
+    def __init__(self, url, max_priority=None):
+        """
+        @param url: (str) see :class:`BasicPikaClient`
+        @param max_priority: (int or None) see :class:`BasicPikaClient`
+        """
+        self.parameters = connection_parameters(url)
+
+        # see :meth:`connect`
+        self.connection = None
+        self.channel = None
+
+        # This is the pool of tasks. Any worker could send a task here for any other worker
+        # to pickup
+        self.task_queue_name = "fossa_task_queue"
+        self.max_priority = max_priority
+
+        # single reply channel
+        self._call_back_queue = None
+
+        # publisher confirms. delivery_tag -> future
+        self._delivery_tag = 0
+        self._unconfirmed = {}
+
+        # futures waiting on RabbitMQ, they fail if the connection is lost
+        self._waiting = set()
+
+    @property
+    def is_open(self):
+        return self.channel is not None and self.channel.is_open
+
+    async def connect(self):
+        """
+        Async generator yielding False until a successful connection is made to RabbitMq
+
+        Use it like this-
+
+        >>> rabbit_mq = AsyncPikaClient(url=self.broker_url)
+        >>> async for _not_connected in rabbit_mq.connect():
+        >>>   self.log("Waiting to connect to RabbitMQ....", "WARNING")
+        """
+        if self.is_open:
+            return
+
+        loop = asyncio.get_running_loop()
+        while self.connection is None:
+            opened = loop.create_future()
+            connection = AsyncioConnection(
+                self.parameters,
+                on_open_callback=lambda c: _resolve(opened, c),
+                on_open_error_callback=lambda c, e: _fail(opened, e),
+                on_close_callback=self._on_connection_closed,
+                custom_ioloop=loop,
+            )
+            try:
+                await opened
+            except pika.exceptions.AMQPConnectionError:
+                yield False
+                await asyncio.sleep(5)
+                continue
+            self.connection = connection
+
+        self.channel = await self._call(self.connection.channel, callback_kwarg="on_open_callback")
+        self.channel.add_on_close_callback(self._on_channel_closed)
+        self.channel.confirm_delivery(ack_nack_callback=self._on_delivery_confirmation)
+
+        await self._call(self.channel.basic_qos, prefetch_count=1)
+        await self._call(
+            self.channel.queue_declare,
+            queue=self.task_queue_name,
+            durable=True,
+            arguments=task_queue_arguments(self.max_priority),
+        )
+
+        results_queue = await self._call(self.channel.queue_declare, queue="", exclusive=True)
+        self._call_back_queue = results_queue.method.queue
+
+    @property
+    def reply_queue(self):
+        """
+        Queue for results from workers to come back to this executing process. It's declared by
+        :meth:`connect`.
+        """
+        return self._call_back_queue
+
+    async def _call(self, method, *args, callback_kwarg="callback", **kwargs):
+        """
+        Call a pika method that reports completion through a callback.
+
+        @return: the argument passed to the callback, usually a method frame
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.add(future)
+        kwargs[callback_kwarg] = lambda result: _resolve(future, result)
+        try:
+            method(*args, **kwargs)
+            return await future
+        finally:
+            self._waiting.discard(future)
+
+    def _fail_waiting(self, reason):
+        exception = reason if isinstance(reason, BaseException) else ConnectionError(reason)
+        for future in list(self._waiting):
+            _fail(future, exception)
+        self._unconfirmed = {}
+
+    def _on_connection_closed(self, _connection, reason):
+        self.connection = None
+        self.channel = None
+        self._fail_waiting(reason)
+
+    def _on_channel_closed(self, _channel, reason):
+        self.channel = None
+        self._fail_waiting(reason)
+
+    def _on_delivery_confirmation(self, frame):
+        "Called by pika when the broker acks or nacks published messages"
+        delivery_tag = frame.method.delivery_tag
+        if frame.method.multiple:
+            delivery_tags = [t for t in self._unconfirmed if t <= delivery_tag]
+        else:
+            delivery_tags = [delivery_tag]
+
+        for tag in delivery_tags:
+            future = self._unconfirmed.pop(tag, None)
+            if future is None:
+                continue
+            if isinstance(frame.method, pika.spec.Basic.Ack):
+                _resolve(future, True)
+            else:
+                _fail(future, pika.exceptions.NackError([]))
+
+    async def publish(self, routing_key, body, properties=None, exchange=""):
+        """
+        Publish and wait for the broker to confirm it has the message.
+
+        @param routing_key: (str) queue name when using the default exchange
+        @param body: (str or bytes)
+        @param properties: (pika.BasicProperties)
+        @param exchange: (str)
+        """
+        self.channel.basic_publish(
+            exchange=exchange, routing_key=routing_key, body=body, properties=properties
+        )
+        self._delivery_tag += 1
+        future = asyncio.get_running_loop().create_future()
+        self._unconfirmed[self._delivery_tag] = future
+        self._waiting.add(future)
+        try:
+            await future
+        finally:
+            self._waiting.discard(future)
+
+    async def set_prefetch(self, prefetch_count):
+        "Channel wide prefetch window"
+        await self._call(self.channel.basic_qos, prefetch_count=prefetch_count, global_qos=True)
+
+    async def consume(self, queue, on_message_callback):
+        """
+        @param on_message_callback: called by pika with (channel, method, properties, body)
+        @return: (str) consumer tag
+        """
+        consumer_tag = self.channel.basic_consume(
+            queue=queue, on_message_callback=on_message_callback
+        )
+        return consumer_tag
+
+    async def cancel(self, consumer_tag):
+        await self._call(self.channel.basic_cancel, consumer_tag)
+
+    def ack(self, delivery_tag):
+        self.channel.basic_ack(delivery_tag=delivery_tag)
+
+    def nack(self, delivery_tag, requeue=True):
+        self.channel.basic_nack(delivery_tag=delivery_tag, requeue=requeue)
+
+    async def close_connection(self):
+        """
+        Disconnect from RabbitMQ.
+        """
+        if self.connection is not None and not self.connection.is_closed:
+            closed = asyncio.get_running_loop().create_future()
+            self.connection.add_on_close_callback(lambda c, reason: _resolve(closed, reason))
+            self.connection.close()
+            await closed
+
+        self.channel = None
+        self.connection = None
@@ -0,0 +1,217 @@
+"""
+Serialisation of task and result messages sent through RabbitMQ.
+
+The format of a message body is given by the AMQP `content_type` and `content_encoding`
+properties so the receiver doesn't need to know how the sender was configured. JSON is always
+available. msgpack, zstd and lz4 are used when the optional packages are installed-
+
+    pip install msgpack zstandard lz4
+"""
+from collections import namedtuple
+import gzip
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+from ayeaye.runtime.task_message import task_message_types
+
+JSON_CONTENT_TYPE = "application/json"
+
+# Versioned so the envelope can change without older nodes misreading it
+MSGPACK_CONTENT_TYPE = "application/vnd.fossa.v1+msgpack"
+
+# AMQP header on a subtask with the name of the :class:`MessageCodec` its results should use
+REPLY_CODEC_HEADER = "x-fossa-reply-codec"
+
+# encoded message with the values for the AMQP properties of the same name
+Envelope = namedtuple("Envelope", ["body", "content_type", "content_encoding"])
+
+
+def _msgpack_dumps(obj):
+    return msgpack.packb(obj, use_bin_type=True)
+
+
+def _msgpack_loads(body):
+    return msgpack.unpackb(body, raw=False, strict_map_key=False)
+
+
+# codec name -> (content_type, encode, decode, is available)
+serialisers = {
+    "json": (JSON_CONTENT_TYPE, json.dumps, json.loads, True),
+    "msgpack": (MSGPACK_CONTENT_TYPE, _msgpack_dumps, _msgpack_loads, msgpack is not None),
+}
+
+# content_encoding -> (compress, decompress, is available)
+compressors = {
+    "gzip": (gzip.compress, gzip.decompress, True),
+    "zstd": (
+        lambda b: zstandard.ZstdCompressor().compress(b),
+        lambda b: zstandard.ZstdDecompressor().decompress(b),
+        zstandard is not None,
+    ),
+    "lz4": (
+        lambda b: lz4.frame.compress(b),
+        lambda b: lz4.frame.decompress(b),
+        lz4 is not None,
+    ),
+}
+
+
+class MessageCodec:
+    """
+    Encodes messages with one serialiser and, for larger messages, one compressor. Any message
+    with a known content type and encoding can be decoded, see :func:`decode`.
+
+    Codecs are named "<serialiser>" or "<serialiser>+<compressor>", e.g. "msgpack+zstd". The name
+    is sent with subtasks so results can be sent back in a format the originator can read.
+    """
+
+    def __init__(self, serialiser="json", compression=None, compress_min_bytes=1024):
+        """
+        @param serialiser: (str) key from :data:`serialisers`
+        @param compression: (str) key from :data:`compressors` or None
+        @param compress_min_bytes: (int) smaller messages aren't compressed
+        """
+        if serialiser not in serialisers:
+            raise ValueError(f"Unknown serialiser: {serialiser}")
+        if compression is not None and compression not in compressors:
+            raise ValueError(f"Unknown compression: {compression}")
+
+        self.serialiser = serialiser
+        self.compression = compression
+        self.compress_min_bytes = compress_min_bytes
+
+    @property
+    def name(self):
+        if self.compression is None:
+            return self.serialiser
+        return f"{self.serialiser}+{self.compression}"
+
+    @property
+    def content_type(self):
+        return serialisers[self.serialiser][0]
+
+    @property
+    def is_available(self):
+        "The optional packages needed by this codec are installed"
+        if not serialisers[self.serialiser][3]:
+            return False
+        return self.compression is None or compressors[self.compression][2]
+
+    @classmethod
+    def from_name(cls, name):
+        """
+        @param name: (str) see :attr:`name`
+        @return: :class:`MessageCodec`
+        @raise ValueError: for an unknown name
+        """
+        serialiser, _, compression = name.partition("+")
+        return cls(serialiser=serialiser, compression=compression or None)
+
+    @classmethod
+    def best_available(cls):
+        """
+        @return: :class:`MessageCodec` - msgpack and the fastest compressor that are installed.
+            JSON without compression when they aren't.
+        """
+        serialiser = "msgpack" if serialisers["msgpack"][3] else "json"
+        compression = None
+        for candidate in ("zstd", "lz4"):
+            if compressors[candidate][2]:
+                compression = candidate
+                break
+        return cls(serialiser=serialiser, compression=compression)
+
+    @classmethod
+    def negotiate(cls, name):
+        """
+        The codec to reply with when the other side asked for `name`.
+
+        @param name: (str) or None when the other side didn't say
+        @return: :class:`MessageCodec` - `name` if it's available here otherwise JSON
+        """
+        if name is not None:
+            try:
+                codec = cls.from_name(name)
+            except ValueError:
+                codec = None
+            if codec is not None and codec.is_available:
+                return codec
+
+        return cls()
+
+    def dumps(self, obj):
+        """
+        @param obj: (dict, list etc.) that can be serialised by JSON and msgpack
+        @return: :class:`Envelope`
+        """
+        body = serialisers[self.serialiser][1](obj)
+        return self.compress(body)
+
+    def compress(self, body):
+        """
+        @param body: (str or bytes) already serialised with :attr:`serialiser`
+        @return: :class:`Envelope`
+        """
+        content_encoding = None
+        if self.compression is not None and len(body) >= self.compress_min_bytes:
+            if isinstance(body, str):
+                body = body.encode("utf-8")
+            body = compressors[self.compression][0](body)
+            content_encoding = self.compression
+
+        return Envelope(
+            body=body, content_type=self.content_type, content_encoding=content_encoding
+        )
+
+
+def decode(body, content_type=None, content_encoding=None):
+    """
+    @param body: (str or bytes)
+    @param content_type: (str) AMQP property. JSON if not set.
+    @param content_encoding: (str) AMQP property. Not compressed if not set.
+    @return: the decoded object
+    @raise ValueError: if the content type or encoding isn't known or available
+    """
+    if content_encoding:
+        compressor = compressors.get(content_encoding)
+        if compressor is None or not compressor[2]:
+            raise ValueError(f"Unsupported content encoding: {content_encoding}")
+        body = compressor[1](body)
+
+    for serialiser_content_type, _encode, decode_fn, is_available in serialisers.values():
+        if serialiser_content_type == (content_type or JSON_CONTENT_TYPE):
+            if not is_available:
+                break
+            return decode_fn(body)
+
+    raise ValueError(f"Unsupported content type: {content_type}")
+
+
+def task_message_from_dict(message):
+    """
+    The equivalent of ayeaye's `task_message_factory` for a message that has already been
+    decoded.
+
+    @param message: (dict) with 'type' and 'payload' keys
+    @return: subclass of :class:`AbstractTaskMessage`
+    @raise ValueError: for an unknown message type
+    """
+    message_cls = task_message_types.get(message["type"])
+    if message_cls is None:
+        raise ValueError(f'Unknown message type \'{message["type"]}\'')
+
+    return message_cls(**message["payload"])
@@ -1,11 +1,14 @@
-import json
+from collections import deque
+from functools import partial
 import time
 
-import pika
-
+from fossa.control import metrics
 from fossa.control.broker import AbstractMycorrhiza
 from fossa.control.message import TaskMessage
+from fossa.control.priority import MAX_PRIORITY
+from fossa.control.rabbit_mq.codec import decode, REPLY_CODEC_HEADER
 from fossa.control.rabbit_mq.pika_client import BasicPikaClient
+from fossa.control.rabbit_mq.results_publisher import get_results_publisher
 
 
 class RabbitMx(AbstractMycorrhiza):
@@ -19,7 +22,7 @@ class RabbitMx(AbstractMycorrhiza):
     from the task back to the originator.
     """
 
-    def __init__(self, broker_url, *args, **kwargs):
+    def __init__(self, broker_url, *args, push_consumer=True, max_priority=None, **kwargs):
         """
         @param broker_url: (str) to connect to Rabbit MQ
         e.g.
@@ -27,10 +30,17 @@ class RabbitMx(AbstractMycorrhiza):
 
         # for AWS-
         f"amqps://{rabbitmq_user}:{rabbitmq_password}@{rabbitmq_broker_id}.mq.{region}.amazonaws.com:5671"
+
+        @param push_consumer: (bool) RabbitMQ pushes tasks to this node with a prefetch window the
+            size of the governor's free processing slots. See :class:`SlotWindowConsumer`.
+            False to poll for one message at a time with `basic_get`.
+        @param max_priority: (int or None) the task queue is a RabbitMQ priority queue, messages
+            with a higher `priority` property are delivered first. See :class:`BasicPikaClient`.
         """
         self.broker_url = broker_url
+        self.push_consumer = push_consumer
+        self.max_priority = max_priority
         super().__init__(*args, **kwargs)
-        self.rabbit_mq = None
 
     def run_forever(self, work_queue_submit, available_processing_capacity):
         """
@@ -48,37 +58,39 @@ class RabbitMx(AbstractMycorrhiza):
         self.log("RabbitMx exchange is starting")
         while True:
             try:
-                rabbit_mq = BasicPikaClient(url=self.broker_url)
+                rabbit_mq = BasicPikaClient(url=self.broker_url, max_priority=self.max_priority)
                 for _not_connected in rabbit_mq.connect():
                     self.log("Waiting to connect to RabbitMQ....", "WARNING")
                 self.log("Connected to RabbitMQ")
 
                 self.log("RabbitMx starting .. waiting for messages ...")
 
-                # `basic_get` fetches a single message.
+                if self.push_consumer:
+                    consumer = SlotWindowConsumer(
+                        rabbit_mq=rabbit_mq,
+                        exchange=self,
+                        work_queue_submit=work_queue_submit,
+                        available_processing_capacity=available_processing_capacity,
+                    )
+                    while True:
+                        consumer.step(wait=broker_timeout)
+
+                # Polling mode. `basic_get` fetches a single message.
                 # Previously, `rabbit_mq.channel.consume` was used but would result in a blocking
                 # condition if tasks took too long to be accepted by `RabbitMx.submit_task`. This
                 # resulted in the `consume` method not being visited enough.
-                # last_events = time.time()
                 while True:
-                    # This is a race condition. For simplicity, the governor uses a queue. If a
-                    # concurrency primative like a semaphore was used a slot could be booked
-                    # here and only then fetch a message from RabbitMQ.
-                    timed_out = RabbitMx.wait_for_capacity(
-                        work_queue_submit,
+                    # A processing slot is booked before a message is fetched from RabbitMQ so the
+                    # message can go straight to the governor.
+                    slot_reserved = RabbitMx.reserve_capacity(
                         available_processing_capacity,
                         timeout=broker_timeout,
                     )
 
-                    # time_now = time.time()
-                    # elapsed = time_now - last_events
-                    # last_events = time_now
-                    # self.log(f"Last message exchange events {elapsed} seconds", level="DEBUG")
-
                     # heartbeats when using a blocking connection need to be explicitly handled
                     rabbit_mq.connection.process_data_events()
 
-                    if timed_out:
+                    if not slot_reserved:
                         if "processing_capacity" not in log_throttle:
                             self.log("Waiting on processing capacity", level="DEBUG")
                             log_throttle.add("processing_capacity")
@@ -87,11 +99,19 @@ class RabbitMx(AbstractMycorrhiza):
                         log_throttle.remove("processing_capacity")
                         self.log("Processing capacity found", level="DEBUG")
 
-                    method, properties, body = rabbit_mq.channel.basic_get(
-                        queue=rabbit_mq.task_queue_name
-                    )
+                    try:
+                        with metrics.timer("fossa_broker_get_seconds"):
+                            method, properties, body = rabbit_mq.channel.basic_get(
+                                queue=rabbit_mq.task_queue_name
+                            )
+                    except:
+                        available_processing_capacity.release()
+                        raise
+
+                    if method is None:
+                        # let other submitters use the slot whilst this sidecar is sleeping
+                        available_processing_capacity.release()
 
-                    if method is None and properties is None and body is None:
                         if "channel_empty" not in log_throttle:
                             self.log(
                                 "No messages available from channel .. sleeping", level="DEBUG"
@@ -103,42 +123,14 @@ class RabbitMx(AbstractMycorrhiza):
                         log_throttle.remove("channel_empty")
                         self.log("Messages available on channel again", level="DEBUG")
 
-                    subtask_id = properties.correlation_id
-                    msg = f"Exchange received subtask_id: {subtask_id} from {properties.reply_to}"
-                    self.log(msg)
-
-                    # TODO use proper types
-                    rabbit_decoded_task = json.loads(body)
-
-                    # keep track of where the sub-task's work should be sent.
-                    composite_task_id = f"{subtask_id}::{properties.reply_to}"
-                    task_spec = TaskMessage(
-                        task_id=composite_task_id,
-                        **rabbit_decoded_task,
-                        on_completion_callback=self.callback_on_processing_complete,
-                    )
-
-                    # avoidance of blocking condition - the message is being acked before the
-                    # governor has accepted the task.
-                    rabbit_mq.channel.basic_ack(delivery_tag=method.delivery_tag)
-
-                    # This message must wait until RabbitMx.submit_task has found capacity.
-                    # 'wait_for_capacity' above is to stop messages being taken from RabbitMq
-                    # but still leaves the following potential race condition.
-                    while not RabbitMx.submit_task(
-                        task_spec,
-                        work_queue_submit,
-                        available_processing_capacity,
-                        timeout=broker_timeout,
-                    ):
-                        # Block on race condition encountered. A message will be in limbo. i.e.
-                        # not in RabbitMq or in the governor's queue.
-                        self.log(f"Waiting on processing capacity for subtask_id: {subtask_id}")
-                        # heartbeats when using a blocking connection need to be explicitly handled
-                        rabbit_mq.connection.process_data_events()
-                        # last_events = time.time()
-
-                    self.log(f"Submitted subtask_id: {subtask_id} to the work queue")
+                    # The slot is already reserved so the governor will accept this task.
+                    try:
+                        self.submit_delivery(
+                            rabbit_mq.channel, method, properties, body, work_queue_submit
+                        )
+                    except:
+                        available_processing_capacity.release()
+                        raise
 
             except Exception as e:
                 self.log(f"Restarting after exception in RabbitMQ exchange: {e}", "ERROR")
@@ -151,34 +143,172 @@ class RabbitMx(AbstractMycorrhiza):
 
                 time.sleep(5)
 
-    def callback_on_processing_complete(self, final_task_message, task_spec):
+    def build_task_message(self, properties, body):
         """
-        This callback is executed by the govenor with results from the task.
+        Make the task that will be run by the governor from a message received from RabbitMQ.
+
+        @param properties: (pika.BasicProperties)
+        @param body: (bytes) task definition encoded as given by the `content_type` and
+            `content_encoding` properties. See :class:`MessageCodec`.
+        @return: :class:`TaskMessage`
+        """
+        # TODO use proper types
+        rabbit_decoded_task = decode(body, properties.content_type, properties.content_encoding)
+
+        # results are sent back in the format the originator asked for
+        reply_codec = (properties.headers or {}).get(REPLY_CODEC_HEADER)
+
+        # keep track of where the sub-task's work should be sent.
+        composite_task_id = f"{properties.correlation_id}::{properties.reply_to}"
+        task_spec = TaskMessage(
+            task_id=composite_task_id,
+            priority=min(properties.priority or 0, MAX_PRIORITY),
+            **rabbit_decoded_task,
+            on_completion_callback=partial(
+                self.callback_on_processing_complete, reply_codec=reply_codec
+            ),
+        )
+        return task_spec
 
-        Send these results to the originating task.
+    def submit_delivery(self, channel, method, properties, body, work_queue_submit):
+        """
+        Pass a message from RabbitMQ to the governor. A processing slot must already be reserved.
+        The message is only acked once it's on the governor's queue.
+
+        @param channel: (pika channel) the message was received on
+        @param method: (pika.spec.Basic.Deliver or Basic.GetOk)
+        @param properties: (pika.BasicProperties)
+        @param body: (bytes)
+        @param work_queue_submit: (:class:`multiprocessing.Queue`) the governor's task queue
         """
+        task_spec = self.build_task_message(properties, body)
+        metrics.inc("fossa_broker_messages_received_total")
 
-        if self.rabbit_mq is None:
-            self.log("Init RabbitMQ for callbacks")
-            self.rabbit_mq = BasicPikaClient(url=self.broker_url)
-        else:
-            self.log("No Init RabbitMQ for callbacks")
+        subtask_id = properties.correlation_id
+        self.log(f"Exchange received subtask_id: {subtask_id} from {properties.reply_to}")
+
+        RabbitMx.submit_reserved_task(task_spec, work_queue_submit)
+        channel.basic_ack(delivery_tag=method.delivery_tag)
 
-        for _not_connected in self.rabbit_mq.connect():
-            self.log("Waiting to connect to RabbitMQ....", "WARNING")
-        self.log("Connected to RabbitMQ")
+        self.log(f"Submitted subtask_id: {subtask_id} to the work queue")
 
+    def callback_on_processing_complete(self, final_task_message, task_spec, reply_codec=None):
+        """
+        This callback is executed by the govenor with results from the task.
+
+        Send these results to the originating task. The results are queued and sent by the
+        governor process's :class:`ResultsPublisher` so this doesn't block the governor.
+
+        @param reply_codec: (str) name of the :class:`MessageCodec` the originator asked for
+        """
         composite_task_id = task_spec.task_id
         subtask_id, reply_to = composite_task_id.split("::", maxsplit=1)
 
         msg = f"Processing of subtask_id:{subtask_id} is complete, sending result to {reply_to}"
         self.log(msg)
 
-        self.rabbit_mq.channel.basic_publish(
-            exchange="",
-            routing_key=reply_to,
-            properties=pika.BasicProperties(correlation_id=subtask_id),
+        publisher = get_results_publisher(
+            self.broker_url, logging_setup=self, max_priority=self.max_priority
+        )
+        publisher.publish(
+            reply_to=reply_to,
+            correlation_id=subtask_id,
             body=final_task_message,
+            reply_codec=reply_codec,
         )
-        self.log(f"reply complete for {subtask_id}")
-        self.rabbit_mq.connection.process_data_events()
+
+
+class SlotWindowConsumer:
+    """
+    Tasks are pushed by RabbitMQ (`basic_consume`) instead of being polled for.
+
+    The prefetch window (channel wide `prefetch_count`) is the number of the governor's free
+    processing slots, limited by the node's free resources (see :meth:`RabbitMx.task_window`), so
+    a node with N free slots holds at most N unacked messages. When there
+    aren't any free slots the consumer is cancelled, unacked messages go back to the queue for
+    other nodes.
+
+    Each delivery is acked only after a slot has been reserved and the task is on the governor's
+    queue so a message is never acked and then lost.
+    """
+
+    def __init__(self, rabbit_mq, exchange, work_queue_submit, available_processing_capacity):
+        """
+        @param rabbit_mq: (:class:`BasicPikaClient`) connected
+        @param exchange: (:class:`RabbitMx`) builds and submits tasks
+        @param work_queue_submit: (:class:`multiprocessing.Queue`) the governor's task queue
+        @param available_processing_capacity: (:class:`ProcessingSlots`)
+        """
+        self.rabbit_mq = rabbit_mq
+        self.exchange = exchange
+        self.work_queue_submit = work_queue_submit
+        self.available_processing_capacity = available_processing_capacity
+
+        self.consumer_tag = None
+        self.prefetch_count = None
+
+        # (method, properties, body) received but not yet passed to the governor
+        self.pending = deque()
+
+    def on_message(self, _channel, method, properties, body):
+        "Called by pika from within `process_data_events`"
+        self.pending.append((method, properties, body))
+
+    def _start_consuming(self, free_slots):
+        if self.prefetch_count != free_slots:
+            self.rabbit_mq.channel.basic_qos(prefetch_count=free_slots, global_qos=True)
+            self.prefetch_count = free_slots
+
+        if self.consumer_tag is None:
+            self.consumer_tag = self.rabbit_mq.channel.basic_consume(
+                queue=self.rabbit_mq.task_queue_name,
+                on_message_callback=self.on_message,
+            )
+
+    def _stop_consuming(self):
+        "Stop deliveries and return anything already delivered to the queue"
+        if self.consumer_tag is not None:
+            # pika nacks messages that have arrived but haven't been dispatched to `on_message`
+            self.rabbit_mq.channel.basic_cancel(self.consumer_tag)
+            self.consumer_tag = None
+
+        while self.pending:
+            method, _properties, _body = self.pending.popleft()
+            self.rabbit_mq.channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+
+    def step(self, wait):
+        """
+        Run one iteration: match the prefetch window to the free slots, wait for deliveries and
+        pass them to the governor.
+
+        @param wait: (float) seconds to wait for messages or a free slot. This must be shorter
+            than the RabbitMQ heartbeat interval.
+        """
+        free_slots = self.exchange.task_window(self.available_processing_capacity)
+        if free_slots > 0:
+            self._start_consuming(free_slots)
+        else:
+            self._stop_consuming()
+
+            # wake as soon as a slot is released
+            if self.available_processing_capacity.acquire(timeout=wait):
+                self.available_processing_capacity.release()
+
+        # deliveries are dispatched to :meth:`on_message`, also services heartbeats. Returns as
+        # soon as there are deliveries.
+        self.rabbit_mq.connection.process_data_events(time_limit=0 if free_slots == 0 else wait)
+
+        while self.pending:
+            if not self.available_processing_capacity.acquire(block=False):
+                # slots were taken by another submitter
+                self._stop_consuming()
+                return
+
+            method, properties, body = self.pending.popleft()
+            try:
+                self.exchange.submit_delivery(
+                    self.rabbit_mq.channel, method, properties, body, self.work_queue_submit
+                )
+            except:
+                self.available_processing_capacity.release()
+                raise
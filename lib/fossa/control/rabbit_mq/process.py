@@ -21,8 +21,18 @@ class RabbitMqProcessor(AbstractIsolatedProcessor):
         # for AWS-
         f"amqps://{rabbitmq_user}:{rabbitmq_password}@{rabbitmq_broker_id}.mq.{region}.amazonaws.com:5671"
 
+        @param message_codec: (str) optional, see :class:`RabbitMqProcessPool`
+
+        @param max_priority: (int) optional, see :class:`RabbitMx`. Subtasks are sent with the
+            parent task's priority.
+
+        @param blob_store: (:class:`AbstractBlobStore`) optional. Subtask arguments and return
+            values over `claim_check_min_bytes` are sent through this instead of RabbitMQ. See
+            :class:`AbstractIsolatedProcessor`.
         """
         self.broker_url = kwargs.pop("broker_url")
+        self.message_codec = kwargs.pop("message_codec", None)
+        self.max_priority = kwargs.pop("max_priority", None)
         super().__init__(*args, **kwargs)
 
     def on_model_start(self, model):
@@ -33,7 +43,15 @@ class RabbitMqProcessor(AbstractIsolatedProcessor):
         if issubclass(model_cls, ayeaye.PartitionedModel):
             # Only :meth:`_build` in a `PartitionedModel` can yield tasks but the message
             # passing is rightly or wrongly being setup for all methods.
-            model.process_pool = RabbitMqProcessPool(broker_url=self.broker_url)
+            model.process_pool = RabbitMqProcessPool(
+                broker_url=self.broker_url,
+                message_codec=self.message_codec,
+                blob_store=self.blob_store,
+                claim_check_min_bytes=self.claim_check_min_bytes,
+                coordinator=self.coordinator_slot(),
+                max_priority=self.max_priority,
+                priority=self.task_priority,
+            )
 
             # Both RabbitMqProcessor and RabbitMqProcessPool use the LoggingMixin so share the
             # logging setup
@@ -1,37 +1,179 @@
-import copy
-from datetime import datetime
-import json
+from collections import deque
+from datetime import datetime, timedelta
+import math
 import random
 import string
 import time
 
 from ayeaye.runtime.multiprocess import AbstractProcessPool
-from ayeaye.runtime.task_message import task_message_factory, TaskComplete, TaskFailed
+from ayeaye.runtime.task_message import TaskComplete, TaskFailed
 
 import pika
 
+from fossa.control import metrics
+from fossa.control.claim_check import check_in, claim, discard
+from fossa.control.rabbit_mq.codec import MessageCodec, REPLY_CODEC_HEADER
 from fossa.control.rabbit_mq.pika_client import BasicPikaClient
+from fossa.control.rabbit_mq.results_publisher import unpack_results
+from fossa.control.rabbit_mq.retry import declare_delay_queue, RetryPolicy
 from fossa.tools.logging import LoggingMixin
 
+# Each dispatch of a subtask (first, retried or speculative) is sent with a correlation_id of
+# subtask_id + ATTEMPT_SEPARATOR + attempt number. Copies running at the same time are then
+# different tasks, with different task_ids, on the workers' governors.
+ATTEMPT_SEPARATOR = "#"
+
+
+def attempt_correlation_id(subtask_id, attempt):
+    """
+    @param subtask_id: (str)
+    @param attempt: (int) 1 for the first dispatch
+    @return: (str) correlation_id for this dispatch of the subtask
+    """
+    return f"{subtask_id}{ATTEMPT_SEPARATOR}{attempt}"
+
+
+def subtask_id_from_correlation_id(correlation_id):
+    """
+    @param correlation_id: (str) from :func:`attempt_correlation_id`
+    @return: (str) subtask_id
+    """
+    return correlation_id.partition(ATTEMPT_SEPARATOR)[0]
+
+
+class SubtaskRuntimeStats:
+    """
+    Recent run times of completed subtasks for each (model class name, method name).
+    """
+
+    def __init__(self, max_samples=1000):
+        """
+        @param max_samples: (int) most recent durations kept for each model class and method
+        """
+        self.max_samples = max_samples
+        self._durations = {}
+
+    def record(self, key, seconds):
+        """
+        @param key: (model_class_name, method_name)
+        @param seconds: (float) how long the subtask took
+        """
+        if key not in self._durations:
+            self._durations[key] = deque(maxlen=self.max_samples)
+        self._durations[key].append(seconds)
+
+    def percentile(self, key, percentile, min_samples=1):
+        """
+        @param key: (model_class_name, method_name)
+        @param percentile: (float) between 0 and 1
+        @param min_samples: (int) fewer durations than this aren't enough to be useful
+        @return: (float) seconds or None if there aren't enough samples
+        """
+        durations = self._durations.get(key)
+        if durations is None or len(durations) < min_samples:
+            return None
+
+        ordered = sorted(durations)
+        return ordered[min(len(ordered) - 1, int(round(percentile * (len(ordered) - 1))))]
+
 
 class RabbitMqProcessPool(AbstractProcessPool, LoggingMixin):
     """
     Send sub-tasks to workers listening on a Rabbit MQ queue.
     """
 
-    def __init__(self, broker_url):
+    def __init__(
+        self,
+        broker_url,
+        message_codec=None,
+        blob_store=None,
+        claim_check_min_bytes=1024 * 1024,
+        coordinator=None,
+        max_priority=None,
+        priority=0,
+    ):
+        """
+        @param broker_url: (str) see :class:`BasicPikaClient`
+        @param message_codec: (str) name of the :class:`MessageCodec` used for subtasks and their
+            results, e.g. "json" or "msgpack+zstd". Defaults to the best one installed. Workers
+            that can't reply in this format reply with JSON.
+        @param blob_store: (:class:`AbstractBlobStore`) optional. The `method_kwargs` of subtasks
+            that are larger than `claim_check_min_bytes` once encoded are put here and only a
+            claim check is sent to the worker.
+        @param claim_check_min_bytes: (int)
+        @param coordinator: (:class:`CoordinatorSlot`) optional. The parent task gives its
+            processing slot to other tasks whilst it waits for subtasks.
+        @param max_priority: (int or None) see :class:`BasicPikaClient`
+        @param priority: (int) of the subtasks when the task queue is a priority queue
+        """
         LoggingMixin.__init__(self)
-        self.rabbit_mq = BasicPikaClient(url=broker_url)
+        self.coordinator = coordinator
+        self.rabbit_mq = BasicPikaClient(url=broker_url, max_priority=max_priority)
+        self.priority = min(priority, max_priority) if max_priority else None
+
+        if message_codec is None:
+            self.codec = MessageCodec.best_available()
+        else:
+            self.codec = MessageCodec.from_name(message_codec)
+
+        # subtask_id -> dict with keys-
+        # "task_definition" - dict sent to the worker
+        # "task_payload" - :class:`Envelope` with the encoded "task_definition"
+        # "start_time" - datetime of first dispatch
+        # "last_dispatch" - datetime of most recent dispatch (retry or speculative)
+        # "speculative_dispatches" - int
         self.tasks_in_flight = {}
         self.pool_id = "".join([random.choice(string.ascii_lowercase) for _ in range(5)])
-        self.task_retries = 1  # a retry is after the original subtask has failed
-        self.failed_tasks_scoreboard = []  # task_ids
+
+        self.blob_store = blob_store
+        self.claim_check_min_bytes = claim_check_min_bytes
+
+        # claim checks for method_kwargs, removed from the blob store when the subtasks are done
+        self.claim_checks = []
+
+        # How many times and how soon failed subtasks are sent again
+        self.retry_policy = RetryPolicy()
+
+        # subtask_id -> number of failures, for subtasks in flight
+        self.failed_attempts = {}
 
         # When all tasks are complete OR when a subtask or it's results are lost this timeout
         # allows the main wait loop to run.
-        # TODO retry if a task takes x percent longer than the slowest known task
         self.inactivity_timeout = 3.0
 
+        # Speculative re-execution. A subtask running for longer than `speculative_multiple`
+        # times the `speculative_percentile` of completed subtasks for the same model class and
+        # method is sent again. The first result is used, duplicates are discarded.
+        self.runtime_stats = SubtaskRuntimeStats()
+        self.speculative_percentile = 0.95
+        self.speculative_multiple = 3.0
+        self.speculative_min_samples = 5
+        self.max_speculative_dispatches = 2
+
+        # Seconds without a result before a subtask is considered lost (e.g. worker died) and
+        # sent again. Applies before there are enough samples for the percentile. None to wait
+        # forever.
+        self.lost_subtask_timeout = 3600.0
+
+        # seconds between looking for slow subtasks
+        self.speculative_check_interval = 1.0
+
+        # subtask_ids that have yielded a result. Later results for these are duplicates.
+        self.finished_subtasks = set()
+
+        # subtask_id -> number of times it has been sent, see :func:`attempt_correlation_id`
+        self.dispatch_attempts = {}
+
+        # Subtasks are published in batches. Each batch is a transaction so there is one round
+        # trip to the broker per batch, see :meth:`publish_channel` for why not publisher confirms.
+        self.publish_batch_size = 500
+
+        # see :meth:`publish_channel`
+        self._publish_channel = None
+
+        # delay in whole seconds -> delay queue name declared on the publish channel
+        self._delay_queues = {}
+
     def run_subtasks(self, sub_tasks, context_kwargs=None, processes=None):
         """
         Generator yielding instances that are a subclass of :class:`AbstractTaskMessage`. These
@@ -41,7 +183,8 @@ class RabbitMqProcessPool(AbstractProcessPool, LoggingMixin):
         """
         max_in_flight = processes if processes is not None else len(sub_tasks)
 
-        pending_tasks = []
+        # (subtask_id, task_definition, task_payload)
+        pending_tasks = deque()
         for subtask_number, sub_task in enumerate(sub_tasks):
             # sub_task is a :class:`TaskPartition` object
             # See Aye-aye's `ayeaye.runtime.task_message.TaskPartition`
@@ -54,146 +197,322 @@ class RabbitMqProcessPool(AbstractProcessPool, LoggingMixin):
                 "model_construction_kwargs": sub_task.model_construction_kwargs,
                 "partition_initialise_kwargs": sub_task.partition_initialise_kwargs,
             }
-            pending_tasks.append((subtask_id, task_definition))
+            # This encoded payload will be received in :meth:`RabbitMx.run_forever` where
+            # all of it will be used alongside some additional args to build :class:`TaskMessage`
+            # TODO - Better typing should be used
+            task_payload = self.codec.dumps(task_definition)
+            if self.blob_store is not None and len(task_payload.body) > self.claim_check_min_bytes:
+                claim_check = check_in(self.blob_store, task_definition["method_kwargs"])
+                self.claim_checks.append(claim_check)
+                task_payload = self.codec.dumps(dict(task_definition, method_kwargs=claim_check))
+
+            pending_tasks.append((subtask_id, task_definition, task_payload))
 
         def send_pending_subtasks():
             """
             If there is processing capacity, send out sub-tasks.
             @return: int - number of pending sub-tasks awaiting send out to workers
             """
-            while len(self.tasks_in_flight) < max_in_flight:
-                if len(pending_tasks) == 0:
-                    return 0
-
-                subtask_id, task_definition = pending_tasks.pop(0)
-                task_definition_json = json.dumps(task_definition)
-                self.tasks_in_flight[subtask_id] = task_definition
-                self.tasks_in_flight[subtask_id]["start_time"] = datetime.utcnow()
-
-                # This JSON encoded payload will be received in :meth:`RabbitMx.run_forever` where
-                # all of it will be used alongside some additional args to build :class:`TaskMessage`
-                # TODO - Better typing should be used
-                self.send_task(subtask_id=subtask_id, task_payload=task_definition_json)
+            to_send = []
+            start_time = datetime.utcnow()
+            while pending_tasks and len(self.tasks_in_flight) < max_in_flight:
+                subtask_id, task_definition, task_payload = pending_tasks.popleft()
+                self.tasks_in_flight[subtask_id] = {
+                    "task_definition": task_definition,
+                    "task_payload": task_payload,
+                    "start_time": start_time,
+                    "last_dispatch": start_time,
+                    "speculative_dispatches": 0,
+                }
+                to_send.append((subtask_id, task_payload))
+
+            if to_send:
+                self.send_tasks(to_send)
 
             return len(pending_tasks)
 
+        for _not_connected in self.rabbit_mq.connect():
+            self.log("Waiting to connect to RabbitMQ....", "WARNING")
+
         # send inital batch of sub-tasks
         pending_tasks_count = send_pending_subtasks()
 
-        for _not_connected in self.rabbit_mq.connect():
-            self.log("Waiting to connect to RabbitMQ....", "WARNING")
+        # Waiting doesn't need a processing slot, this node's slots can run subtasks
+        if self.coordinator is not None and not self.coordinator.begin():
+            self.log("No free coordinator slots, keeping processing slot whilst waiting", "DEBUG")
 
         # reduce repetitive log messages
         max_log_seconds = 60
         last_logged = 0
+        last_speculative_check = time.time()
 
         # Listen for subtasks completing
         self.log(f"Connected to RabbitMQ, now waiting on {self.rabbit_mq.reply_queue} ....")
-        for method, properties, body in self.rabbit_mq.channel.consume(
-            queue=self.rabbit_mq.reply_queue,
-            inactivity_timeout=self.inactivity_timeout,
-        ):
-            if len(self.tasks_in_flight) == 0:
-                self.log("All tasks complete")
-                return
-
-            # heartbeats when using a blocking connection need to be explicitly handled
-            self.rabbit_mq.connection.process_data_events()
-
-            if method is None and properties is None and body is None:
-                # on inactivity_timeout
-                if last_logged < time.time() - max_log_seconds:
-                    in_flight_count = len(self.tasks_in_flight)
-                    msg = (
-                        f"Waiting on {in_flight_count} tasks to complete and "
-                        f"{pending_tasks_count} awaiting send to workers"
-                    )
-                    self.log(msg)
+        try:
+            for method, properties, body in self.rabbit_mq.channel.consume(
+                queue=self.rabbit_mq.reply_queue,
+                inactivity_timeout=self.inactivity_timeout,
+            ):
+                if len(self.tasks_in_flight) == 0:
+                    self.log("All tasks complete")
+                    return
+
+                # heartbeats when using a blocking connection need to be explicitly handled
+                self.rabbit_mq.connection.process_data_events()
+
+                if time.time() - last_speculative_check > self.speculative_check_interval:
+                    self.redispatch_slow_subtasks()
+                    last_speculative_check = time.time()
+
+                if method is None and properties is None and body is None:
+                    # on inactivity_timeout
+                    if last_logged < time.time() - max_log_seconds:
+                        in_flight_count = len(self.tasks_in_flight)
+                        msg = (
+                            f"Waiting on {in_flight_count} tasks to complete and "
+                            f"{pending_tasks_count} awaiting send to workers"
+                        )
+                        self.log(msg)
+
+                        task_ids = ",".join([t for t in self.tasks_in_flight.keys()])
+                        max_output = 1024
+                        if len(task_ids) > max_output:
+                            task_ids = task_ids[0:max_output] + "..."
+                        self.log(f"Waiting on task_ids: {task_ids}", "DEBUG")
+
+                        last_logged = time.time()
+
+                    # inactivity timeout doesn't yield a message
+                    continue
 
-                    task_ids = ",".join([t for t in self.tasks_in_flight.keys()])
-                    max_output = 1024
-                    if len(task_ids) > max_output:
-                        task_ids = task_ids[0:max_output] + "..."
-                    self.log(f"Waiting on task_ids: {task_ids}", "DEBUG")
+                # 'reply_queue' message is received.
+                self.rabbit_mq.channel.basic_ack(delivery_tag=method.delivery_tag)
+
+                # The :class:`ResultsPublisher` can send the results of many subtasks in one message
+                for correlation_id, task_message in unpack_results(properties, body):
+                    subtask_id = subtask_id_from_correlation_id(correlation_id)
+                    if subtask_id in self.finished_subtasks:
+                        # From a speculative or retried copy of the subtask
+                        self.log(f"Discarding duplicate result for subtask {subtask_id}", "DEBUG")
+                        if isinstance(task_message, TaskComplete):
+                            discard(task_message.return_value)
+                        continue
+
+                    # could be a complete, fail or log
+                    if isinstance(task_message, TaskFailed):
+                        if subtask_id not in self.tasks_in_flight:
+                            msg = (
+                                f"Failed subtask {subtask_id} is not registered as in flight so "
+                                "must have already been completed"
+                            )
+                            self.log(msg, "WARNING")
+                            continue
+
+                        # record this failure
+                        task_attempts = self.failed_attempts.get(subtask_id, 0) + 1
+                        self.failed_attempts[subtask_id] = task_attempts
+
+                        if self.retry_policy.should_retry(task_attempts):
+                            # try it again after a delay, don't yield it
+                            delay = self.retry_policy.delay(task_attempts)
+                            msg = f"Failed subtask {subtask_id} is being retried in {delay:.1f} seconds"
+                            self.log(msg, "WARNING")
+                            in_flight = self.tasks_in_flight[subtask_id]
+
+                            # the retry isn't slow whilst it's waiting to be delivered
+                            in_flight["last_dispatch"] = datetime.utcnow() + timedelta(
+                                seconds=delay
+                            )
+                            self.send_tasks([(subtask_id, in_flight["task_payload"])], delay=delay)
+                            metrics.inc("fossa_subtask_retries_total")
+
+                        else:
+                            self.log(f"Subtask {subtask_id} failed: {task_message}")
+                            in_flight = self.tasks_in_flight.pop(subtask_id)
+                            del self.failed_attempts[subtask_id]
+
+                            # the worker only had the claim check if the kwargs were large
+                            task_message.method_kwargs = in_flight["task_definition"][
+                                "method_kwargs"
+                            ]
+
+                            self.finished_subtasks.add(subtask_id)
+                            yield task_message
+
+                    elif isinstance(task_message, TaskComplete):
+                        if subtask_id in self.tasks_in_flight:
+                            in_flight = self.tasks_in_flight.pop(subtask_id)
+                            self.failed_attempts.pop(subtask_id, None)
+                            elapsed_s = (
+                                datetime.utcnow() - in_flight["start_time"]
+                            ).total_seconds()
+                            self.log(
+                                f"Subtask {subtask_id} complete. Took {elapsed_s} seconds. {task_message}"
+                            )
+
+                            # Time from the latest dispatch so retries don't skew the stats
+                            last_run_s = (
+                                datetime.utcnow() - in_flight["last_dispatch"]
+                            ).total_seconds()
+                            self.runtime_stats.record(self.stats_key(in_flight), last_run_s)
+
+                            task_message.method_kwargs = in_flight["task_definition"][
+                                "method_kwargs"
+                            ]
+                        else:
+                            self.log(
+                                f"Complete task {subtask_id} not found in in-flight list", "WARNING"
+                            )
+
+                        self.finished_subtasks.add(subtask_id)
+                        task_message.return_value = claim(task_message.return_value, delete=True)
+                        yield task_message
+
+                    else:
+                        msg_type = str(type(task_message))
+                        msg = f"Unknown message type {msg_type} received with subtask_id: {subtask_id} : {task_message}"
+                        self.log(msg, "ERROR")
+
+                pending_tasks_count = send_pending_subtasks()
+        finally:
+            # the workers have finished with the method_kwargs
+            while self.claim_checks:
+                discard(self.claim_checks.pop())
+
+            if self.coordinator is not None:
+                self.coordinator.end()
+
+    @staticmethod
+    def stats_key(in_flight):
+        "@return: (model_class_name, method_name) for an entry in `tasks_in_flight`"
+        task_definition = in_flight["task_definition"]
+        return task_definition["model_class"], task_definition["method"]
+
+    def redispatch_slow_subtasks(self):
+        """
+        Send again subtasks that are taking much longer than others of the same type or have
+        gone without a result for `lost_subtask_timeout` seconds. Whichever copy finishes first
+        is used.
 
-                    last_logged = time.time()
+        @return: list of subtask_ids that were sent again
+        """
+        now = datetime.utcnow()
+        thresholds = {}
+        redispatch = []
+        for subtask_id, in_flight in self.tasks_in_flight.items():
+            if in_flight["speculative_dispatches"] >= self.max_speculative_dispatches:
+                continue
 
-                # inactivity timeout doesn't yield a message
+            key = self.stats_key(in_flight)
+            if key not in thresholds:
+                percentile = self.runtime_stats.percentile(
+                    key, self.speculative_percentile, self.speculative_min_samples
+                )
+                candidates = [self.lost_subtask_timeout]
+                if percentile is not None:
+                    candidates.append(percentile * self.speculative_multiple)
+                candidates = [c for c in candidates if c is not None]
+                thresholds[key] = min(candidates) if candidates else None
+
+            threshold = thresholds[key]
+            if threshold is None:
                 continue
 
-            # 'reply_queue' message is received.
-            self.rabbit_mq.channel.basic_ack(delivery_tag=method.delivery_tag)
+            if (now - in_flight["last_dispatch"]).total_seconds() > threshold:
+                redispatch.append(subtask_id)
 
-            # could be a complete, fail or log
-            task_message = task_message_factory(body)
-            subtask_id = properties.correlation_id
+        to_send = []
+        for subtask_id in redispatch:
+            in_flight = self.tasks_in_flight[subtask_id]
+            in_flight["speculative_dispatches"] += 1
+            in_flight["last_dispatch"] = now
+            to_send.append((subtask_id, in_flight["task_payload"]))
+            self.log(f"Subtask {subtask_id} is slow or lost, sending it again", "WARNING")
 
-            if isinstance(task_message, TaskFailed):
-                # record this failure
-                self.failed_tasks_scoreboard.append(subtask_id)
+        if to_send:
+            self.send_tasks(to_send)
+            metrics.inc("fossa_subtask_speculative_total", len(to_send))
 
-                if subtask_id not in self.tasks_in_flight:
-                    msg = (
-                        f"Failed subtask {subtask_id} is not registered as in flight so "
-                        "must have already been completed"
-                    )
-                    self.log(msg, "WARNING")
-                    continue
+        return redispatch
 
-                task_attempts = self.failed_tasks_scoreboard.count(subtask_id)
-                if task_attempts < self.task_retries + 1:
-                    # try it again, don't yield it
-                    self.log(f"Failed subtask {subtask_id} is being retried", "WARNING")
-                    task_definition = copy.copy(self.tasks_in_flight[subtask_id])
-                    del task_definition["start_time"]
-                    task_definition_json = json.dumps(task_definition)
-                    self.send_task(subtask_id=subtask_id, task_payload=task_definition_json)
+    def publish_channel(self):
+        """
+        A channel, separate from the one consuming results, in transaction mode. It's re-made if
+        the connection has changed.
 
-                else:
-                    self.log(f"Subtask {subtask_id} failed: {body}")
-                    if subtask_id in self.tasks_in_flight:
-                        del self.tasks_in_flight[subtask_id]
+        Transactions rather than publisher confirms (`confirm_delivery`) are used because the
+        channel is a pika `BlockingChannel`. With confirms it waits for the broker after every
+        `basic_publish`, a round trip per subtask, and it has no public way to publish a batch
+        and then wait for all of its confirms. `tx_commit` gives the same guarantee, the broker
+        has the whole batch or none of it, with one round trip per batch.
 
-                    yield task_message
+        @return: :class:`pika.adapters.blocking_connection.BlockingChannel`
+        """
+        connection = self.rabbit_mq.connection
+        if self._publish_channel is None or self._publish_channel[0] is not connection:
+            channel = connection.channel()
+            channel.tx_select()
+            self._publish_channel = (connection, channel)
+            self._delay_queues = {}
 
-            elif isinstance(task_message, TaskComplete):
-                if subtask_id in self.tasks_in_flight:
-                    elapsed = datetime.utcnow() - self.tasks_in_flight[subtask_id]["start_time"]
-                    elapsed_s = elapsed.total_seconds()
-                    self.log(f"Subtask {subtask_id} complete. Took {elapsed_s} seconds. {body}")
-                    del self.tasks_in_flight[subtask_id]
-                else:
-                    self.log(f"Complete task {subtask_id} not found in in-flight list", "WARNING")
+        return self._publish_channel[1]
 
-                yield task_message
+    def send_tasks(self, subtasks, delay=0):
+        """
+        Send work instructions to be picked up by any RabbitMq worker.
 
-            else:
-                msg_type = str(type(task_message))
-                msg = f"Unknown message type {msg_type} received with subtask_id: {subtask_id} : {body}"
-                self.log(msg, "ERROR")
+        Messages are published in batches of `publish_batch_size`. Each batch is committed as a
+        transaction so the broker confirms the whole batch with one round trip (see
+        :meth:`publish_channel`).
 
-            pending_tasks_count = send_pending_subtasks()
+        @param subtasks: list of (subtask_id, task_payload) - str and :class:`Envelope`
+        @param delay: (float) seconds before workers can receive the subtasks. Rounded up to a
+            whole number of seconds. See :func:`declare_delay_queue`.
+        """
+        for _not_connected in self.rabbit_mq.connect():
+            self.log("Waiting to connect to RabbitMQ....", "WARNING")
+
+        channel = self.publish_channel()
+        reply_to = self.rabbit_mq.reply_queue
+
+        routing_key = self.rabbit_mq.task_queue_name
+        if delay > 0:
+            delay_seconds = math.ceil(delay)
+            if delay_seconds not in self._delay_queues:
+                self._delay_queues[delay_seconds] = declare_delay_queue(
+                    channel, self.rabbit_mq.task_queue_name, delay_seconds
+                )
+            routing_key = self._delay_queues[delay_seconds]
+
+        for batch_start in range(0, len(subtasks), self.publish_batch_size):
+            batch = subtasks[batch_start : batch_start + self.publish_batch_size]
+            with metrics.timer("fossa_broker_publish_seconds"):
+                for subtask_id, task_payload in batch:
+                    attempt = self.dispatch_attempts.get(subtask_id, 0) + 1
+                    self.dispatch_attempts[subtask_id] = attempt
+                    channel.basic_publish(
+                        exchange="",
+                        routing_key=routing_key,
+                        body=task_payload.body,
+                        properties=pika.BasicProperties(
+                            delivery_mode=pika.DeliveryMode.Persistent,
+                            reply_to=reply_to,
+                            content_type=task_payload.content_type,
+                            content_encoding=task_payload.content_encoding,
+                            correlation_id=attempt_correlation_id(subtask_id, attempt),
+                            headers={REPLY_CODEC_HEADER: self.codec.name},
+                            priority=self.priority,
+                        ),
+                    )
+                channel.tx_commit()
+            metrics.inc("fossa_subtasks_sent_total", len(batch))
+
+        self.log(f"{len(subtasks)} subtasks have been sent to RabbitMq exchange", "DEBUG")
 
     def send_task(self, subtask_id, task_payload):
         """
         Send a work instruction to be picked up by any RabbitMq worker.
         @param subtask_id (str):
-        @param task_payload (str):
+        @param task_payload (:class:`Envelope`):
         """
-        for _not_connected in self.rabbit_mq.connect():
-            self.log("Waiting to connect to RabbitMQ....", "WARNING")
-        self.log("Connected to RabbitMQ")
-
-        self.rabbit_mq.channel.basic_publish(
-            exchange="",
-            routing_key=self.rabbit_mq.task_queue_name,
-            body=task_payload,
-            properties=pika.BasicProperties(
-                delivery_mode=pika.DeliveryMode.Persistent,
-                reply_to=self.rabbit_mq.reply_queue,
-                content_type="application/json",
-                correlation_id=subtask_id,
-            ),
-            # mandatory=True,
-        )
-        self.log(f"Subtask: {subtask_id} has been sent to RabbitMq exchange", "DEBUG")
+        self.send_tasks([(subtask_id, task_payload)])
@@ -0,0 +1,286 @@
+"""
+Send the results of finished tasks back to the originating :class:`RabbitMqProcessPool`.
+"""
+import json
+from multiprocessing import util
+import os
+import queue
+import threading
+import time
+
+from ayeaye.runtime.task_message import task_message_factory
+import pika
+
+from fossa.control import metrics
+from fossa.control.rabbit_mq.codec import (
+    decode,
+    JSON_CONTENT_TYPE,
+    MessageCodec,
+    MSGPACK_CONTENT_TYPE,
+    task_message_from_dict,
+)
+from fossa.control.rabbit_mq.pika_client import BasicPikaClient
+from fossa.tools.logging import LoggingMixin
+
+# A message with one of these content types has the results of many subtasks. For JSON the body
+# is a list of {"correlation_id": str, "body": str}, "body" being the JSON encoded task message.
+# For msgpack it's a list of [correlation_id, task message as a dict].
+BATCH_CONTENT_TYPE = "application/vnd.fossa.results-batch+json"
+MSGPACK_BATCH_CONTENT_TYPE = "application/vnd.fossa.results-batch.v1+msgpack"
+
+# batch content type -> content type of the serialiser
+_batch_content_types = {
+    BATCH_CONTENT_TYPE: JSON_CONTENT_TYPE,
+    MSGPACK_BATCH_CONTENT_TYPE: MSGPACK_CONTENT_TYPE,
+}
+
+
+def unpack_results(properties, body):
+    """
+    Results sent by :class:`ResultsPublisher` could be a single result or a batch.
+
+    @param properties: (pika.BasicProperties)
+    @param body: (str or bytes)
+    @return: list of (correlation_id, task message) tuples. The task message is a subclass of
+        :class:`AbstractTaskMessage`.
+    """
+    content_type = properties.content_type
+    content_encoding = properties.content_encoding
+
+    if content_type == BATCH_CONTENT_TYPE:
+        batch = decode(body, _batch_content_types[content_type], content_encoding)
+        return [(r["correlation_id"], task_message_factory(r["body"])) for r in batch]
+
+    if content_type == MSGPACK_BATCH_CONTENT_TYPE:
+        batch = decode(body, _batch_content_types[content_type], content_encoding)
+        return [(correlation_id, task_message_from_dict(m)) for correlation_id, m in batch]
+
+    if content_type in (None, JSON_CONTENT_TYPE) and not content_encoding:
+        # as sent by the worker, not decoded twice
+        return [(properties.correlation_id, task_message_factory(body))]
+
+    task_message = task_message_from_dict(decode(body, content_type, content_encoding))
+    return [(properties.correlation_id, task_message)]
+
+
+class ResultsPublisher(LoggingMixin):
+    """
+    A long lived connection to RabbitMQ that is used to publish results from a background thread.
+
+    The connection is kept alive between results by servicing heartbeats. Publisher confirms
+    are used so a result is only considered sent once the broker has it. Results for the same
+    `reply_to` queue that are waiting to be sent are sent together as one message (see
+    :func:`unpack_results`) when the originator sent :data:`REPLY_CODEC_HEADER` and so knows how
+    to unpack a batch. Results for older originators are sent one per message as before.
+
+    Results are sent in the format requested by the subtask's originator (see
+    :meth:`MessageCodec.negotiate`). Re-encoding happens in the background thread.
+
+    If the connection fails the batch is sent again on a new connection so a result could be
+    received twice.
+
+    Use :func:`get_results_publisher` to share one instance per process and broker.
+    """
+
+    # seconds between servicing the connection when there aren't any results. Must be well
+    # within the broker's heartbeat interval.
+    heartbeat_interval = 5.0
+
+    # maximum number of results sent as one message
+    max_batch_size = 100
+
+    # seconds to wait before reconnecting after a failure
+    retry_interval = 5.0
+
+    def __init__(self, broker_url, max_priority=None):
+        """
+        @param broker_url: (str) see :class:`BasicPikaClient`
+        @param max_priority: (int or None) see :class:`BasicPikaClient`
+        """
+        LoggingMixin.__init__(self)
+        self.broker_url = broker_url
+        self.max_priority = max_priority
+
+        # (reply_to, correlation_id, body, reply_codec) or None to end the background thread
+        self._results = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def publish(self, reply_to, correlation_id, body, reply_codec=None):
+        """
+        Queue a result to be sent. Doesn't block.
+
+        @param reply_to: (str) name of the RabbitMQ queue
+        @param correlation_id: (str) subtask_id
+        @param body: (str) JSON encoded task message
+        @param reply_codec: (str) name of the :class:`MessageCodec` the originator asked for.
+            None for JSON.
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run_forever, daemon=True)
+                self._thread.start()
+
+        self._results.put((reply_to, correlation_id, body, reply_codec))
+
+    def close(self, timeout=10.0):
+        """
+        Send any queued results and stop the background thread.
+
+        @param timeout: (float) seconds to wait for queued results to be sent
+        """
+        with self._lock:
+            if self._thread is None:
+                return
+            self._results.put(None)
+            thread, self._thread = self._thread, None
+
+        thread.join(timeout=timeout)
+
+    @classmethod
+    def batch_messages(cls, results):
+        """
+        @param results: list of (reply_to, correlation_id, body, reply_codec)
+        @return: list of (reply_to, pika.BasicProperties, body) - one message per reply_to and
+            codec. The order of results for each reply_to is kept. Results without a
+            `reply_codec` are for an originator that can't unpack batches so each is sent as its
+            own message.
+        """
+        grouped = {}
+        for reply_to, correlation_id, body, reply_codec in results:
+            grouped.setdefault((reply_to, reply_codec), []).append((correlation_id, body))
+
+        messages = []
+        for (reply_to, reply_codec), replies in grouped.items():
+            if reply_codec is None:
+                for correlation_id, body in replies:
+                    properties = pika.BasicProperties(correlation_id=correlation_id)
+                    messages.append((reply_to, properties, body))
+                continue
+
+            codec = MessageCodec.negotiate(reply_codec)
+            if len(replies) == 1:
+                correlation_id, body = replies[0]
+                if codec.serialiser == "json":
+                    envelope = codec.compress(body)
+                else:
+                    envelope = codec.dumps(json.loads(body))
+                content_type = envelope.content_type
+
+            else:
+                correlation_id = None
+                if codec.serialiser == "json":
+                    batch = [{"correlation_id": c, "body": b} for c, b in replies]
+                    content_type = BATCH_CONTENT_TYPE
+                else:
+                    batch = [[c, json.loads(b)] for c, b in replies]
+                    content_type = MSGPACK_BATCH_CONTENT_TYPE
+                envelope = codec.dumps(batch)
+
+            properties = pika.BasicProperties(
+                correlation_id=correlation_id,
+                content_type=content_type,
+                content_encoding=envelope.content_encoding,
+            )
+            messages.append((reply_to, properties, envelope.body))
+
+        return messages
+
+    def _next_batch(self):
+        """
+        Wait for results.
+
+        @return: (list of results, bool - the thread should end)
+        """
+        try:
+            result = self._results.get(timeout=self.heartbeat_interval)
+        except queue.Empty:
+            return [], False
+
+        batch = []
+        while result is not None:
+            batch.append(result)
+            if len(batch) >= self.max_batch_size:
+                break
+            try:
+                result = self._results.get_nowait()
+            except queue.Empty:
+                return batch, False
+
+        return batch, result is None
+
+    def _connect(self):
+        rabbit_mq = BasicPikaClient(url=self.broker_url, max_priority=self.max_priority)
+        for _not_connected in rabbit_mq.connect():
+            self.log("Results publisher waiting to connect to RabbitMQ....", "WARNING")
+
+        # basic_publish blocks until the broker has confirmed the message
+        rabbit_mq.channel.confirm_delivery()
+        return rabbit_mq
+
+    def _run_forever(self):
+        "Runs in the background thread which is the only user of the connection"
+        rabbit_mq = None
+        ending = False
+        while not ending:
+            batch, ending = self._next_batch()
+
+            while True:
+                try:
+                    if rabbit_mq is None:
+                        rabbit_mq = self._connect()
+
+                    with metrics.timer("fossa_broker_publish_seconds"):
+                        for reply_to, properties, body in self.batch_messages(batch):
+                            rabbit_mq.channel.basic_publish(
+                                exchange="", routing_key=reply_to, properties=properties, body=body
+                            )
+
+                    # heartbeats
+                    rabbit_mq.connection.process_data_events()
+                    break
+
+                except Exception as e:
+                    self.log(f"Results publisher failed, will retry: {e}", "ERROR")
+                    try:
+                        rabbit_mq.close_connection()
+                    except:
+                        pass
+                    rabbit_mq = None
+                    time.sleep(self.retry_interval)
+
+            if batch:
+                self.log(f"Sent {len(batch)} results", "DEBUG")
+
+        if rabbit_mq is not None:
+            rabbit_mq.close_connection()
+
+
+# (process id, broker_url) -> ResultsPublisher
+_results_publishers = {}
+_results_publishers_lock = threading.Lock()
+
+
+def get_results_publisher(broker_url, logging_setup=None, max_priority=None):
+    """
+    One :class:`ResultsPublisher` for each broker and process. Queued results are sent before the
+    process ends.
+
+    @param broker_url: (str)
+    @param logging_setup: (subclass of :class:`LoggingMixin`) copied by a new publisher
+    @param max_priority: (int or None) see :class:`BasicPikaClient`
+    @return: :class:`ResultsPublisher`
+    """
+    # A forked process mustn't use its parent's connection or thread
+    key = (os.getpid(), broker_url)
+    with _results_publishers_lock:
+        if key not in _results_publishers:
+            publisher = ResultsPublisher(broker_url, max_priority=max_priority)
+            if logging_setup is not None:
+                publisher.copy_logging_setup(logging_setup)
+
+            # run when a :class:`multiprocessing.Process` ends
+            util.Finalize(publisher, publisher.close, exitpriority=10)
+            _results_publishers[key] = publisher
+
+        return _results_publishers[key]
@@ -0,0 +1,80 @@
+import math
+import random
+
+
+class RetryPolicy:
+    """
+    When and how soon a failed subtask is sent again.
+
+    Delays grow exponentially with each attempt and have random jitter so a failing dependency
+    isn't hit by every retry at the same moment.
+    """
+
+    def __init__(self, max_attempts=2, base_delay=1.0, multiplier=2.0, max_delay=60.0, jitter=0.5):
+        """
+        @param max_attempts: (int) total number of times a subtask is run, including the first
+        @param base_delay: (float) seconds before the first retry
+        @param multiplier: (float) each retry waits this much longer than the previous one
+        @param max_delay: (float) upper limit in seconds
+        @param jitter: (float) between 0 and 1. Proportion of the delay that is random. 0 for
+            no jitter.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.multiplier = multiplier
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def should_retry(self, attempts):
+        """
+        @param attempts: (int) number of times the subtask has failed
+        @return: bool
+        """
+        return attempts < self.max_attempts
+
+    def delay(self, attempts):
+        """
+        @param attempts: (int) number of times the subtask has failed, 1 or more
+        @return: (float) seconds to wait before sending the subtask again
+        """
+        delay = min(self.max_delay, self.base_delay * self.multiplier ** (attempts - 1))
+        return delay * (1 - self.jitter * random.random())
+
+
+def delay_queue_name(task_queue_name, delay):
+    """
+    Delayed messages wait in a queue with a fixed TTL before being dead-lettered to the task
+    queue. Delays are rounded up to a whole number of seconds so there is a limited number of
+    these queues.
+
+    @param task_queue_name: (str)
+    @param delay: (float) seconds
+    @return: (str, int) - queue name, TTL in milliseconds
+    """
+    seconds = max(1, math.ceil(delay))
+    return f"{task_queue_name}.delay.{seconds}s", seconds * 1000
+
+
+def declare_delay_queue(channel, task_queue_name, delay):
+    """
+    Make a queue for messages that should reach `task_queue_name` after `delay` seconds. Messages
+    expire after the queue's TTL and are dead-lettered through the default exchange to the task
+    queue. Each queue has a single TTL so expired messages are never stuck behind longer lived
+    ones.
+
+    @param channel: (pika channel)
+    @param task_queue_name: (str)
+    @param delay: (float) seconds
+    @return: (str) queue name to publish to
+    """
+    queue_name, ttl_ms = delay_queue_name(task_queue_name, delay)
+    channel.queue_declare(
+        queue=queue_name,
+        durable=True,
+        arguments={
+            "x-message-ttl": ttl_ms,
+            "x-dead-letter-exchange": "",
+            "x-dead-letter-routing-key": task_queue_name,
+        },
+    )
+    return queue_name
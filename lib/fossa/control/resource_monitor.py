@@ -0,0 +1,259 @@
+"""
+Memory use of the node and of each ETL process, sampled from `/proc` by a thread in the
+governor's process. New tasks aren't started whilst memory use is above a high-water mark.
+"""
+import multiprocessing
+import os
+import time
+
+# position of each value in :attr:`ResourceMonitor._node`
+_MEM_TOTAL, _MEM_AVAILABLE, _SWAP_TOTAL, _SWAP_FREE, _SWAP_RATE, _SAMPLED_AT, _THROTTLED = range(7)
+
+
+def read_meminfo(path="/proc/meminfo"):
+    """
+    @param path: (str)
+    @return: (dict) field name -> value in kB, e.g. {"MemTotal": 16303528, ...}
+    """
+    meminfo = {}
+    with open(path) as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            fields = value.split()
+            if fields:
+                meminfo[name] = int(fields[0])
+    return meminfo
+
+
+def read_vmstat(path="/proc/vmstat"):
+    """
+    @param path: (str)
+    @return: (dict) counter name -> value, e.g. {"pswpin": 1048, "pswpout": 2210, ...}
+    """
+    vmstat = {}
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 2:
+                vmstat[fields[0]] = int(fields[1])
+    return vmstat
+
+
+def read_rss_kb(pid, proc_path="/proc"):
+    """
+    @param pid: (int)
+    @param proc_path: (str)
+    @return: (int or None) resident set size of the process in kB. None if the process has ended.
+    """
+    try:
+        with open(os.path.join(proc_path, str(pid), "status")) as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except (FileNotFoundError, ProcessLookupError):
+        return None
+
+    # kernel threads and zombies don't have a VmRSS
+    return 0
+
+
+class ResourceMonitor:
+    """
+    Samples `/proc/meminfo` and the resident set size of each ETL process in the task table.
+
+    New tasks are throttled when memory use goes above `memory_high_water_percent` or pages are
+    being swapped in and out faster than `swap_rate_high_water`. They start again once memory use
+    has dropped below `memory_low_water_percent` and swapping has slowed, the gap stops
+    throttling flapping on and off. The amount of swap in use isn't a sign of memory pressure,
+    pages can stay in swap long after the pressure has passed.
+
+    Samples are in shared memory so web workers and sidecars can read them. On platforms without
+    `/proc` nothing is sampled and tasks are never throttled.
+    """
+
+    def __init__(
+        self,
+        mp_context=None,
+        max_processes=256,
+        sample_interval=1.0,
+        memory_high_water_percent=90.0,
+        memory_low_water_percent=80.0,
+        swap_rate_high_water=1000.0,
+        proc_path="/proc",
+    ):
+        """
+        @param mp_context: (multiprocessing context or None) see :class:`ProcessingSlots`
+        @param max_processes: (int) most ETL processes sampled, the size of the task table
+        @param sample_interval: (float) seconds between samples
+        @param memory_high_water_percent: (float) of MemTotal not available
+        @param memory_low_water_percent: (float)
+        @param swap_rate_high_water: (float) pages swapped in and out per second, from the
+            `pswpin` and `pswpout` counters in `/proc/vmstat`. None to ignore swap.
+        @param proc_path: (str)
+        """
+        mp_context = mp_context or multiprocessing.get_context()
+        self.sample_interval = sample_interval
+        self.memory_high_water_percent = memory_high_water_percent
+        self.memory_low_water_percent = memory_low_water_percent
+        self.swap_rate_high_water = swap_rate_high_water
+        self.proc_path = proc_path
+
+        self._node = mp_context.RawArray("d", 7)
+
+        # (pages swapped in and out, time.monotonic()) at the previous sample. Only used by the
+        # sampling thread.
+        self._previous_swapped = None
+
+        # (pid, rss kB) pairs, pid 0 marks the end
+        self._processes = mp_context.RawArray("d", 2 * max_processes)
+        self._lock = mp_context.Lock()
+
+        self._stopping = mp_context.Event()
+
+    @property
+    def available(self):
+        "@return: (bool) this platform has the `/proc` files"
+        return os.path.exists(os.path.join(self.proc_path, "meminfo"))
+
+    @property
+    def throttled(self):
+        "@return: (bool) new tasks mustn't start"
+        return bool(self._node[_THROTTLED])
+
+    def sample(self, pids):
+        """
+        Take a sample and decide if new tasks are throttled. Called by :meth:`run_forever`.
+
+        @param pids: (list of int) ETL processes
+        @return: (bool) throttled changed
+        """
+        meminfo = read_meminfo(os.path.join(self.proc_path, "meminfo"))
+        rss = []
+        for pid in pids[: len(self._processes) // 2]:
+            rss_kb = read_rss_kb(pid, self.proc_path)
+            if rss_kb is not None:
+                rss.append((pid, rss_kb))
+
+        mem_total = meminfo.get("MemTotal", 0)
+        # MemAvailable is missing on very old kernels
+        mem_available = meminfo.get("MemAvailable", meminfo.get("MemFree", 0))
+        swap_total = meminfo.get("SwapTotal", 0)
+        swap_free = meminfo.get("SwapFree", 0)
+
+        memory_used = self._percent(mem_total - mem_available, mem_total)
+        swap_rate = self._swap_rate()
+        swapping = self.swap_rate_high_water is not None and (swap_rate > self.swap_rate_high_water)
+
+        was_throttled = self.throttled
+        if memory_used > self.memory_high_water_percent or swapping:
+            throttled = True
+        elif memory_used < self.memory_low_water_percent:
+            throttled = False
+        else:
+            throttled = was_throttled
+
+        with self._lock:
+            self._node[_MEM_TOTAL] = mem_total
+            self._node[_MEM_AVAILABLE] = mem_available
+            self._node[_SWAP_TOTAL] = swap_total
+            self._node[_SWAP_FREE] = swap_free
+            self._node[_SWAP_RATE] = swap_rate
+            self._node[_SAMPLED_AT] = time.time()
+            self._node[_THROTTLED] = throttled
+
+            for position in range(len(self._processes)):
+                self._processes[position] = 0
+            for position, (pid, rss_kb) in enumerate(rss):
+                self._processes[2 * position] = pid
+                self._processes[2 * position + 1] = rss_kb
+
+        return throttled != was_throttled
+
+    def _swap_rate(self):
+        "@return: (float) pages swapped in and out per second since the previous sample"
+        vmstat_path = os.path.join(self.proc_path, "vmstat")
+        if not os.path.exists(vmstat_path):
+            return 0.0
+
+        vmstat = read_vmstat(vmstat_path)
+        swapped = vmstat.get("pswpin", 0) + vmstat.get("pswpout", 0)
+        now = time.monotonic()
+
+        rate = 0.0
+        if self._previous_swapped is not None:
+            previous_swapped, previous_time = self._previous_swapped
+            elapsed = now - previous_time
+            if elapsed > 0:
+                rate = max(0, swapped - previous_swapped) / elapsed
+
+        self._previous_swapped = (swapped, now)
+        return rate
+
+    @staticmethod
+    def _percent(used, total):
+        return 100.0 * used / total if total > 0 else 0.0
+
+    def run_forever(self, task_table, logger):
+        """
+        Runs in a thread in the governor's process until :meth:`stop`.
+
+        @param task_table: (:class:`SharedTaskTable`) ETL processes are those with a pid
+        @param logger: (subclass of :class:`LoggingMixin`)
+        """
+        if not self.available:
+            logger.log(f"No {self.proc_path}/meminfo, memory isn't monitored", level="WARNING")
+            return
+
+        while not self._stopping.wait(self.sample_interval):
+            pids = [r["proc_id"] for r in task_table.records() if r["proc_id"] > 0]
+            try:
+                changed = self.sample(pids)
+            except (OSError, ValueError) as e:
+                logger.log(f"Memory sample failed: {e}", level="ERROR")
+                continue
+
+            if changed and self.throttled:
+                msg = f"Memory use above high-water mark, new tasks are held back: {self.summary()}"
+                logger.log(msg, level="WARNING")
+            elif changed:
+                logger.log("Memory use below low-water mark, new tasks can start")
+
+    def stop(self):
+        "End :meth:`run_forever`"
+        self._stopping.set()
+
+    def rss_mb(self):
+        "@return: (dict) pid -> resident set size in MB of each ETL process in the last sample"
+        with self._lock:
+            values = self._processes[:]
+
+        rss = {}
+        for position in range(0, len(values), 2):
+            pid = int(values[position])
+            if pid == 0:
+                break
+            rss[pid] = round(values[position + 1] / 1024, 1)
+        return rss
+
+    def summary(self):
+        """
+        @return: (dict) of the last sample, for `node_info`. Memory is in MB and 'sampled_at' is
+            None if there hasn't been a sample yet.
+        """
+        with self._lock:
+            node = self._node[:]
+
+        mem_total = node[_MEM_TOTAL]
+        swap_total = node[_SWAP_TOTAL]
+        return {
+            "sampled_at": node[_SAMPLED_AT] or None,
+            "memory_total_mb": round(mem_total / 1024, 1),
+            "memory_available_mb": round(node[_MEM_AVAILABLE] / 1024, 1),
+            "memory_used_percent": round(
+                self._percent(mem_total - node[_MEM_AVAILABLE], mem_total), 1
+            ),
+            "swap_used_percent": round(self._percent(swap_total - node[_SWAP_FREE], swap_total), 1),
+            "swap_pages_per_second": round(node[_SWAP_RATE], 1),
+            "etl_process_rss_mb": round(sum(self.rss_mb().values()), 1),
+            "throttled": bool(node[_THROTTLED]),
+        }
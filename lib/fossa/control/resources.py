@@ -0,0 +1,192 @@
+"""
+Resources (CPU, memory and IO) that tasks declare they need and the node's resources they are
+packed into.
+
+A model class declares what each of its tasks needs with a `fossa_resources` class attribute. A
+method can declare its own needs with the :func:`resources` decorator, e.g.-
+
+    class Aggregation(ayeaye.PartitionedModel):
+        fossa_resources = {"cpu": 1, "memory_mb": 50}
+
+        @resources(cpu=2, memory_mb=8192)
+        def aggregate(self, partition):
+            ...
+
+Tasks that don't declare anything need nothing and are only limited by the governor's
+processing slots.
+"""
+from dataclasses import asdict, dataclass
+import math
+import multiprocessing
+import os
+
+# dimensions of :class:`ResourceRequirements` and :class:`NodeResources`
+RESOURCE_NAMES = ("cpu", "memory_mb", "io_weight")
+
+# `io_weight` can't be measured, it's relative to this unless set with NODE_RESOURCES
+DEFAULT_IO_WEIGHT_CAPACITY = 10.0
+
+
+@dataclass(frozen=True)
+class ResourceRequirements:
+    cpu: float = 0.0  # CPUs
+    memory_mb: float = 0.0
+    io_weight: float = 0.0  # share of the node's IO, see `DEFAULT_IO_WEIGHT_CAPACITY`
+
+    def as_tuple(self):
+        return tuple(getattr(self, name) for name in RESOURCE_NAMES)
+
+    def as_dict(self):
+        return asdict(self)
+
+
+def resources(**requirements):
+    """
+    Decorator for a model's method that declares the resources a task running that method needs.
+    Takes precedence over the model class's `fossa_resources`.
+
+    @param requirements: keyword arguments for :class:`ResourceRequirements`
+    """
+    declared = ResourceRequirements(**requirements)
+
+    def decorator(method):
+        method.fossa_resources = declared
+        return method
+
+    return decorator
+
+
+def requirements_for(model_cls, method_name):
+    """
+    @param model_cls: (subclass of :class:`ayeaye.Model`, not an instance)
+    @param method_name: (str)
+    @return: (:class:`ResourceRequirements`) declared by the method or the class
+    """
+    method = getattr(model_cls, method_name, None)
+    declared = getattr(method, "fossa_resources", None)
+    if declared is None:
+        declared = getattr(model_cls, "fossa_resources", None)
+
+    if declared is None:
+        return ResourceRequirements()
+
+    if isinstance(declared, dict):
+        return ResourceRequirements(**declared)
+
+    return declared
+
+
+def measure_node_resources():
+    """
+    @return: (dict) resource name -> amount this node has. CPUs are those this process may run
+        on and memory is the physical memory.
+    """
+    try:
+        cpu = len(os.sched_getaffinity(0))
+    except AttributeError:
+        # not on all platforms
+        cpu = os.cpu_count() or 1
+
+    try:
+        memory_mb = os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        memory_mb = math.inf
+
+    return {
+        "cpu": float(cpu),
+        "memory_mb": float(memory_mb),
+        "io_weight": DEFAULT_IO_WEIGHT_CAPACITY,
+    }
+
+
+class NodeResources:
+    """
+    The node's resources and how much of each is reserved by running tasks.
+
+    The governor's process reserves a task's resources before starting it and releases them when
+    it finishes. The values are in shared memory so sidecars and web workers can see how much
+    room the node has.
+    """
+
+    def __init__(self, mp_context=None):
+        """
+        @param mp_context: (multiprocessing context or None) see :class:`ProcessingSlots`
+        """
+        mp_context = mp_context or multiprocessing.get_context()
+        self._totals = mp_context.RawArray("d", len(RESOURCE_NAMES))
+        self._in_use = mp_context.RawArray("d", len(RESOURCE_NAMES))
+        self._lock = mp_context.Lock()
+
+    def set_totals(self, **totals):
+        """
+        @param totals: resource name -> amount. Resources not given are unchanged.
+        """
+        with self._lock:
+            for position, name in enumerate(RESOURCE_NAMES):
+                if name in totals:
+                    self._totals[position] = totals[name]
+
+    def totals(self):
+        "@return: (dict) resource name -> amount the node has"
+        with self._lock:
+            return dict(zip(RESOURCE_NAMES, self._totals[:]))
+
+    def in_use(self):
+        "@return: (dict) resource name -> amount reserved by running tasks"
+        with self._lock:
+            return dict(zip(RESOURCE_NAMES, self._in_use[:]))
+
+    def could_fit(self, requirements):
+        """
+        @param requirements: (:class:`ResourceRequirements`)
+        @return: (bool) the task would fit on this node when it's idle
+        """
+        with self._lock:
+            totals = self._totals[:]
+        return all(need <= total for need, total in zip(requirements.as_tuple(), totals))
+
+    def _fits(self, needs):
+        "Called with the lock held"
+        for position, need in enumerate(needs):
+            if need > 0 and self._in_use[position] + need > self._totals[position]:
+                return False
+        return True
+
+    def reserve(self, requirements):
+        """
+        Reserve the resources if there is room for all of them.
+
+        @param requirements: (:class:`ResourceRequirements`)
+        @return: (bool) the resources were reserved
+        """
+        needs = requirements.as_tuple()
+        with self._lock:
+            if not self._fits(needs):
+                return False
+            for position, need in enumerate(needs):
+                self._in_use[position] += need
+        return True
+
+    def release(self, requirements):
+        """
+        @param requirements: (:class:`ResourceRequirements`) reserved with :meth:`reserve`
+        """
+        with self._lock:
+            for position, need in enumerate(requirements.as_tuple()):
+                self._in_use[position] = max(0.0, self._in_use[position] - need)
+
+    def headroom(self, requirements):
+        """
+        @param requirements: (:class:`ResourceRequirements`)
+        @return: (int or float) number of tasks needing `requirements` that would fit in the free
+            resources. `math.inf` when the task doesn't need anything.
+        """
+        with self._lock:
+            totals = self._totals[:]
+            in_use = self._in_use[:]
+
+        fits = math.inf
+        for need, total, used in zip(requirements.as_tuple(), totals, in_use):
+            if need > 0 and total != math.inf:
+                fits = min(fits, max(0, math.floor((total - used) / need)))
+        return fits
@@ -0,0 +1,128 @@
+"""
+Large results are passed from the ETL process to the governor in shared memory instead of being
+pickled through the governor's queue.
+"""
+from dataclasses import dataclass
+import hashlib
+from multiprocessing import resource_tracker, shared_memory
+import os
+import sys
+
+from fossa.control.message import ResultsMessage
+
+
+class ResultLost(Exception):
+    "The shared memory segment with a task's results has gone"
+
+
+@dataclass
+class SharedMemoryResult:
+    """
+    Takes the place of the JSON `task_message` in a :class:`ResultsMessage` when the task message
+    is in a shared memory segment.
+    """
+
+    segment_name: str
+    length: int  # bytes. The segment can be larger, it's rounded up to a page size.
+
+
+class SharedMemoryResultChannel:
+    """
+    The ETL process writes results over `min_bytes` into a shared memory segment and puts just
+    the segment's name and length on the governor's queue. The governor reads the segment and
+    removes it.
+
+    Segment names are made from the task_id so the governor can remove a segment when a task's
+    process dies between writing the segment and sending the :class:`ResultsMessage`.
+
+    Instances are made 'pre-fork' by the :class:`Governor` and passed to the ETL processes.
+    """
+
+    def __init__(self, min_bytes=64 * 1024):
+        """
+        @param min_bytes: (int) smaller results are sent through the queue. None to always use
+            the queue.
+        """
+        self.min_bytes = min_bytes
+
+        # Unique to this governor. Short as some platforms limit names to 31 characters.
+        self.segment_prefix = f"fossa_{os.getpid()}_"
+
+    def segment_name(self, task_id):
+        """
+        @param task_id: (str)
+        @return: (str) name of the shared memory segment for the task's results
+        """
+        return self.segment_prefix + hashlib.sha1(task_id.encode("utf-8")).hexdigest()[:12]
+
+    def send(self, result_spec):
+        """
+        Called in the ETL process.
+
+        @param result_spec: (:class:`ResultsMessage`) with a JSON `task_message`
+        @return: (:class:`ResultsMessage`) to put on the governor's queue. It's `result_spec`
+            unless the task message has been moved to shared memory.
+        """
+        if self.min_bytes is None or len(result_spec.task_message) < self.min_bytes:
+            return result_spec
+
+        encoded = result_spec.task_message.encode("utf-8")
+        segment_kwargs = {"name": self.segment_name(result_spec.task_id), "create": True}
+        if sys.version_info >= (3, 13):
+            # The governor owns the segment, it mustn't be removed when this process ends
+            segment_kwargs["track"] = False
+
+        shm = shared_memory.SharedMemory(size=len(encoded), **segment_kwargs)
+        shm.buf[: len(encoded)] = encoded
+
+        if sys.version_info < (3, 13) and os.name == "posix":
+            # As above. The resource tracker has the name with a leading slash.
+            resource_tracker.unregister(f"/{shm.name}", "shared_memory")
+        shm.close()
+
+        shared_result = SharedMemoryResult(segment_name=shm.name, length=len(encoded))
+        return ResultsMessage(task_id=result_spec.task_id, task_message=shared_result)
+
+    @staticmethod
+    def receive(result_spec):
+        """
+        Called in the governor's process.
+
+        @param result_spec: (:class:`ResultsMessage`) from the queue
+        @return: (:class:`ResultsMessage`) with the JSON `task_message`. The shared memory
+            segment, if there was one, has been removed.
+        @raise ResultLost: the segment has gone, e.g. it was removed by :meth:`discard`
+        """
+        shared_result = result_spec.task_message
+        if not isinstance(shared_result, SharedMemoryResult):
+            return result_spec
+
+        try:
+            shm = shared_memory.SharedMemory(name=shared_result.segment_name)
+        except FileNotFoundError:
+            msg = f"Shared memory segment {shared_result.segment_name} with results has gone"
+            raise ResultLost(msg)
+
+        try:
+            with shm.buf[: shared_result.length] as view:
+                task_message = str(view, "utf-8")
+        finally:
+            shm.close()
+            shm.unlink()
+
+        return ResultsMessage(task_id=result_spec.task_id, task_message=task_message)
+
+    def discard(self, task_id):
+        """
+        Remove the task's segment if it was written but never received, e.g. the ETL process
+        died after writing it. Called in the governor's process.
+
+        @param task_id: (str)
+        """
+        try:
+            shm = shared_memory.SharedMemory(name=self.segment_name(task_id))
+        except FileNotFoundError:
+            return
+
+        shm.close()
+        shm.unlink()
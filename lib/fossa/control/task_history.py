@@ -0,0 +1,185 @@
+"""
+Completed tasks kept by the governor so the web frontend can show recent activity.
+"""
+from collections import OrderedDict
+from dataclasses import asdict
+import json
+from multiprocessing.managers import SyncManager
+import pickle
+import sqlite3
+import threading
+
+
+def running_task_summary(task_record):
+    """
+    @param task_record: (dict) from :class:`fossa.control.task_table.SharedTaskTable`
+    @return: dict with keys from :class:`TaskMessage` plus 'started' and 'status'
+    """
+    summary = dict(task_record["task_spec"])
+    summary["on_completion_callback"] = None
+    summary["task_id"] = task_record["task_id"]
+    summary["started"] = task_record["started"]
+    summary["status"] = task_record["state"]
+    return summary
+
+
+def completed_task_summary(process_details):
+    """
+    Extract the details of a finished task that are shown by the web frontend and API.
+
+    @param process_details: (dict) from the governor's `running_tasks` with 'finished' and
+        'result_spec' keys added when the task finished.
+    @return: dict with keys from :class:`TaskMessage` plus 'started', 'finished', 'results' and
+        'status'. Status can be-
+                - failed
+                - complete
+                - unknown (indicates something missing in the code)
+    """
+    summary = asdict(process_details["task_spec"])
+    summary["started"] = process_details["started"]
+    summary["finished"] = process_details["finished"]
+    summary["results"] = json.loads(process_details["result_spec"].task_message)
+
+    if summary["results"]["type"] == "TaskComplete":
+        summary["status"] = "complete"
+    elif summary["results"]["type"] == "TaskFailed":
+        summary["status"] = "failed"
+    else:
+        summary["status"] = "unknown"
+
+    return summary
+
+
+class TaskHistory:
+    """
+    Bounded record of finished tasks, indexed by task_id.
+
+    The most recent `max_entries` tasks are kept in memory. When full, the oldest entry is
+    discarded or, if a `spill_path` is given, moved to a local SQLite file where it can still be
+    found by :meth:`get`.
+
+    An instance lives in the governor's manager process (see :class:`GovernorManager`) and is
+    used through a proxy by the governor's process and web requests. The manager serves each
+    connection in a separate thread, hence the lock.
+    """
+
+    def __init__(self, max_entries=1000, spill_path=None):
+        """
+        @param max_entries: (int) number of finished tasks kept in memory
+        @param spill_path: (str or None) SQLite file for tasks that no longer fit in memory
+        """
+        self._lock = threading.Lock()
+
+        # task_id -> (process_details, summary). Oldest first.
+        self._entries = OrderedDict()
+
+        self.max_entries = None
+        self._spill_db = None
+        self.set_retention(max_entries, spill_path)
+
+    def set_retention(self, max_entries, spill_path=None):
+        """
+        @param max_entries: (int) number of finished tasks kept in memory
+        @param spill_path: (str or None) SQLite file for tasks that no longer fit in memory
+        """
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+
+        with self._lock:
+            self.max_entries = max_entries
+
+            if self._spill_db is not None:
+                self._spill_db.close()
+                self._spill_db = None
+
+            if spill_path is not None:
+                self._spill_db = sqlite3.connect(spill_path, check_same_thread=False)
+                self._spill_db.execute(
+                    "CREATE TABLE IF NOT EXISTS task_history "
+                    "(task_id TEXT PRIMARY KEY, summary BLOB NOT NULL)"
+                )
+                self._spill_db.commit()
+
+            self._evict()
+
+    def append(self, process_details):
+        """
+        Record a finished task.
+
+        @param process_details: (dict) see :func:`completed_task_summary`. The task_spec's
+            callback must already have been removed as it might not be pickle-able.
+        """
+        task_id = process_details["task_spec"].task_id
+        summary = completed_task_summary(process_details)
+
+        with self._lock:
+            self._entries.pop(task_id, None)
+            self._entries[task_id] = (process_details, summary)
+            self._evict()
+
+    def _evict(self):
+        "Must be called with the lock held"
+        spilled = []
+        while len(self._entries) > self.max_entries:
+            task_id, (_, summary) = self._entries.popitem(last=False)
+            if self._spill_db is not None:
+                spilled.append((task_id, pickle.dumps(summary)))
+
+        if spilled:
+            self._spill_db.executemany(
+                "INSERT OR REPLACE INTO task_history (task_id, summary) VALUES (?, ?)", spilled
+            )
+            self._spill_db.commit()
+
+    def get(self, task_id):
+        """
+        @param task_id: (str)
+        @return: (dict) see :func:`completed_task_summary` or None if the task isn't known
+        """
+        with self._lock:
+            entry = self._entries.get(task_id)
+            if entry is not None:
+                return entry[1]
+
+            if self._spill_db is None:
+                return None
+
+            row = self._spill_db.execute(
+                "SELECT summary FROM task_history WHERE task_id = ?", (task_id,)
+            ).fetchone()
+
+        return pickle.loads(row[0]) if row else None
+
+    def summaries(self):
+        """
+        @return: list of dict, see :func:`completed_task_summary`. Just the tasks held in memory,
+            most recently finished first.
+        """
+        with self._lock:
+            # tasks are recorded as they finish
+            return [summary for _, summary in reversed(self._entries.values())]
+
+    def details(self):
+        """
+        @return: list of dict - the `process_details` for the tasks held in memory, in the order
+            they were recorded.
+        """
+        with self._lock:
+            return [process_details for process_details, _ in self._entries.values()]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+
+class GovernorManager(SyncManager):
+    "The governor's shared objects. i.e. :class:`SyncManager` plus :class:`TaskHistory`"
+
+    pass
+
+
+GovernorManager.register(
+    "TaskHistory",
+    TaskHistory,
+    exposed=("set_retention", "append", "get", "summaries", "details", "__len__"),
+)
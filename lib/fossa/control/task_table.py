@@ -0,0 +1,228 @@
+"""
+Running tasks in shared memory so any process (e.g. gunicorn workers) can read them without
+a round trip to a manager process.
+"""
+from dataclasses import asdict
+from datetime import datetime, timezone
+import json
+from multiprocessing import shared_memory
+import os
+import struct
+import threading
+import weakref
+
+
+def _unlink_if_owner(shm, owner_pid):
+    "Finalizer. Forked children inherit the finalizer but mustn't remove the shared memory."
+    if os.getpid() == owner_pid:
+        shm.close()
+        shm.unlink()
+
+
+class SharedTaskTable:
+    """
+    Fixed size table of the tasks currently running on this node.
+
+    Each slot holds the task_id, process id, start time, state and a bounded JSON copy of the
+    task's :class:`TaskMessage`. The governor's process is the only writer, its threads take turns
+    with a lock. Readers are lock free, each slot has a sequence number (a 'seqlock') which is odd
+    whilst the slot is being written. A reader retries if the sequence number was odd or changed
+    during the read.
+    """
+
+    FREE = 0
+    RUNNING = 1
+    QUEUED = 2  # waiting for a processing slot, see :class:`AdmissionQueue`
+    COORDINATING = 3  # waiting for subtasks on a coordinator slot, see :class:`CoordinatorSlot`
+
+    # state names used by summaries
+    state_names = {RUNNING: "running", QUEUED: "queued", COORDINATING: "coordinating"}
+
+    # A slot that stays mid-write (i.e. the writer died) is treated as free after this many reads
+    max_read_attempts = 10000
+
+    max_task_id_bytes = 128
+    max_details_bytes = 2048
+
+    # sequence, state, pid, started (unix epoch), task_id length, details length
+    _header = struct.Struct("<IBxxxidHH")
+
+    slot_size = _header.size + max_task_id_bytes + max_details_bytes
+
+    def __init__(self, slots=256):
+        """
+        @param slots: (int) maximum number of tasks in the table at the same time
+        """
+        self.slots = slots
+        self._shm = shared_memory.SharedMemory(create=True, size=slots * self.slot_size)
+
+        # Writer's index, only used within the governor's process. task_id -> slot number
+        self._slot_index = {}
+        self._write_lock = threading.Lock()
+
+        self._finalizer = weakref.finalize(self, _unlink_if_owner, self._shm, os.getpid())
+
+    def __getstate__(self):
+        # For start methods that pickle, attach to the same shared memory by name.
+        return {"slots": self.slots, "name": self._shm.name}
+
+    def __setstate__(self, state):
+        self.slots = state["slots"]
+        self._shm = shared_memory.SharedMemory(name=state["name"])
+        self._slot_index = {}
+        self._write_lock = threading.Lock()
+        self._finalizer = None
+
+    def close(self):
+        """
+        Remove the shared memory. Only has an effect in the process that made the table.
+        """
+        if self._finalizer is not None:
+            self._finalizer()
+
+    def _read_slot(self, slot):
+        """
+        @return: (state, pid, started, task_id, details) or None if the slot is free. The
+            details are left as JSON bytes.
+        """
+        buf = self._shm.buf
+        offset = slot * self.slot_size
+        for _ in range(self.max_read_attempts):
+            seq, state, pid, started, task_id_len, details_len = self._header.unpack_from(
+                buf, offset
+            )
+            if seq % 2:
+                # being written
+                continue
+
+            if state == self.FREE:
+                record = None
+            else:
+                field_offset = offset + self._header.size
+                task_id = bytes(buf[field_offset : field_offset + task_id_len])
+                field_offset += self.max_task_id_bytes
+                details = bytes(buf[field_offset : field_offset + details_len])
+                record = (state, pid, started, task_id.decode("utf-8"), details)
+
+            if self._header.unpack_from(buf, offset)[0] == seq:
+                return record
+
+        return None
+
+    def _write_slot(self, slot, state, pid=0, started=0.0, task_id=b"", details=b""):
+        "Only called by the single writer"
+        buf = self._shm.buf
+        offset = slot * self.slot_size
+        seq = self._header.unpack_from(buf, offset)[0]
+
+        # odd sequence marks the slot as being written
+        struct.pack_into("<I", buf, offset, seq + 1)
+
+        field_offset = offset + self._header.size
+        buf[field_offset : field_offset + len(task_id)] = task_id
+        field_offset += self.max_task_id_bytes
+        buf[field_offset : field_offset + len(details)] = details
+
+        self._header.pack_into(
+            buf, offset, seq + 1, state, pid, started, len(task_id), len(details)
+        )
+        struct.pack_into("<I", buf, offset, (seq + 2) % 2**32)
+
+    @classmethod
+    def _encode_details(cls, task_spec):
+        """
+        @param task_spec: (:class:`TaskMessage`)
+        @return: (bytes) JSON. The arguments are dropped if they don't fit in the slot.
+        """
+        details = asdict(task_spec)
+        details.pop("on_completion_callback", None)
+        encoded = json.dumps(details, default=str).encode("utf-8")
+        if len(encoded) <= cls.max_details_bytes:
+            return encoded
+
+        details = {
+            "model_class": task_spec.model_class,
+            "method": task_spec.method,
+            "details_truncated": True,
+        }
+        return json.dumps(details).encode("utf-8")[: cls.max_details_bytes]
+
+    def add(self, task_spec, pid, started, state=RUNNING):
+        """
+        Put a task into a free slot, or update the task's slot if it's already in the table.
+        Only called by the governor's process.
+
+        @param task_spec: (:class:`TaskMessage`)
+        @param pid: (int) process running the task
+        @param started: (datetime) UTC
+        @param state: (int)
+        @return: (bool) False if the table is full
+        """
+        task_id = task_spec.task_id.encode("utf-8")
+        if len(task_id) > self.max_task_id_bytes:
+            raise ValueError(f"task_id is longer than {self.max_task_id_bytes} bytes")
+
+        started_epoch = started.replace(tzinfo=timezone.utc).timestamp()
+        details = self._encode_details(task_spec)
+
+        with self._write_lock:
+            slot = self._slot_index.get(task_spec.task_id)
+            if slot is None:
+                in_use = set(self._slot_index.values())
+                for slot in range(self.slots):
+                    if slot not in in_use:
+                        break
+                else:
+                    return False
+
+            self._write_slot(slot, state, pid, started_epoch, task_id, details)
+            self._slot_index[task_spec.task_id] = slot
+        return True
+
+    def remove(self, task_id):
+        """
+        Free the task's slot. Only called by the governor's process.
+
+        @param task_id: (str)
+        """
+        with self._write_lock:
+            slot = self._slot_index.pop(task_id, None)
+            if slot is not None:
+                self._write_slot(slot, self.FREE)
+
+    def _as_dict(self, record):
+        state, pid, started, task_id, details = record
+        return {
+            "task_id": task_id,
+            "proc_id": pid,
+            "started": datetime.fromtimestamp(started, tz=timezone.utc).replace(tzinfo=None),
+            "state": self.state_names.get(state, "unknown"),
+            "task_spec": json.loads(details),
+        }
+
+    def get(self, task_id):
+        """
+        @param task_id: (str)
+        @return: (dict) with keys 'task_id', 'proc_id', 'started', 'state' and 'task_spec' (dict
+            of the :class:`TaskMessage` without the callback) or None if the task isn't in the
+            table.
+        """
+        for slot in range(self.slots):
+            record = self._read_slot(slot)
+            if record is not None and record[3] == task_id:
+                return self._as_dict(record)
+        return None
+
+    def records(self):
+        """
+        @return: list of dict, see :meth:`get`, for each task in the table
+        """
+        records = []
+        for slot in range(self.slots):
+            record = self._read_slot(slot)
+            if record is not None:
+                records.append(self._as_dict(record))
+        return records
+
+    def __len__(self):
+        return sum(1 for slot in range(self.slots) if self._read_slot(slot) is not None)
@@ -6,10 +6,74 @@ class BaseConfig:
     HTTP_PORT = 2345
     ACCEPTED_MODEL_CLASSES = []  # iterable of classes that the node is authorised to run
     MESSAGE_BROKER_MANAGERS = []  # subclasses of  to run in a separate process
-    EXTERNAL_LOGGERS = []  # subclasses of
+    EXTERNAL_LOGGERS = []  # subclasses of AbstractExternalLogger, see BufferedLogShipper
     LOG_TO_STDOUT = True  # i.e. print out log messages
 
     # dictionary of options for modifying :class:`ayeaye.runtime.knowledge.RuntimeKnowledge`
     # options-
     # "CPU_TASK_RATIO" - number of tasks to run in parallel on each CPU
     RUNTIME = {}
+
+    # How the governor runs each task-
+    # "process_per_task" - a new Process for every task. Most isolated, nothing persists between
+    #       tasks.
+    # "worker_pool" - long lived worker processes each run many tasks. Saves the cost of
+    #       starting a process and importing modules for each (sub)task.
+    EXECUTION_MODE = "process_per_task"
+
+    # In "worker_pool" mode, a worker process is replaced after running this many tasks
+    WORKER_MAX_TASKS_PER_CHILD = 100
+
+    # How the governor and ETL processes are started - "fork", "spawn" or "forkserver". None is
+    # the platform's default. "forkserver" starts each ETL process from a small, pre-warmed process
+    # so the cost doesn't grow with the size of the governor's process.
+    MULTIPROCESSING_START_METHOD = None
+
+    # With "forkserver", these modules are imported once by the fork server. The modules of
+    # ACCEPTED_MODEL_CLASSES are always included.
+    PRELOAD_MODULES = []
+
+    # Number of finished tasks kept in memory for the web frontend and API
+    TASK_HISTORY_MAX_ENTRIES = 1000
+
+    # Optional SQLite file. Finished tasks beyond TASK_HISTORY_MAX_ENTRIES are moved here so they
+    # can still be looked up by task_id. None to discard them.
+    TASK_HISTORY_SPILL_PATH = None
+
+    # Results larger than this many bytes are passed from the ETL process to the governor in
+    # shared memory instead of through the governor's queue. None to always use the queue.
+    RESULT_SHARED_MEMORY_MIN_BYTES = 64 * 1024
+
+    # Number of threads in the governor's process that run tasks' completion callbacks and the
+    # seconds after which a callback is reported as stuck and its thread replaced
+    CALLBACK_THREADS = 4
+    CALLBACK_TIMEOUT = 60.0
+
+    # Tasks POSTed to the API when there isn't a free processing slot wait in an admission queue
+    # of up to this many tasks. 0 to reject them with a 503 instead.
+    ADMISSION_QUEUE_DEPTH = 100
+
+    # Tasks waiting for subtasks sent through a message broker give their processing slot to
+    # other tasks. This many can wait at the same time, others keep their processing slot.
+    MAX_CONCURRENT_COORDINATORS = 4
+
+    # Tasks declaring the resources they need (see fossa.control.resources) are packed into the
+    # node's CPUs, memory and IO. These are measured, this replaces any of them e.g.
+    # {"memory_mb": 16000, "io_weight": 4}
+    NODE_RESOURCES = {}
+
+    # Seconds a task can wait for resources whilst smaller tasks that arrived after it start
+    RESOURCE_BACKFILL_LIMIT = 60.0
+
+    # The governor samples memory use (from /proc) every RESOURCE_SAMPLE_INTERVAL seconds. New
+    # tasks wait whilst memory use is above the high-water mark or more than SWAP_RATE_HIGH_WATER
+    # pages a second are swapped in and out. They start again once memory use is below the
+    # low-water mark.
+    RESOURCE_SAMPLE_INTERVAL = 1.0
+    MEMORY_HIGH_WATER_PERCENT = 90.0
+    MEMORY_LOW_WATER_PERCENT = 80.0
+    SWAP_RATE_HIGH_WATER = 1000.0
+
+    # Waiting tasks with a higher 'priority' (0 to 9) start first. A waiting task's priority goes
+    # up by one every PRIORITY_AGING_SECONDS so low priority tasks still start. None for no aging.
+    PRIORITY_AGING_SECONDS = 60.0
@@ -1,5 +1,21 @@
 import copy
+from dataclasses import dataclass
 from datetime import datetime
+from multiprocessing import util
+import os
+import queue
+import sys
+import threading
+import time
+
+
+@dataclass
+class LogRecord:
+    "A log message waiting to be sent by :class:`BufferedLogShipper`"
+
+    timestamp: float  # time.time() when it was logged
+    level: str
+    msg: str
 
 
 class AbstractExternalLogger:
@@ -15,6 +31,216 @@ class AbstractExternalLogger:
         """
         raise NotImplementedError("Must be implemented by subclasses")
 
+    def write_batch(self, records):
+        """
+        Send many messages. Subclasses for services that accept many messages in one request
+        should override this.
+
+        @param records: (list of :class:`LogRecord`) oldest first
+        @return: bool for success to log all of them
+        """
+        return all([self.write(msg=r.msg, level=r.level) for r in records])
+
+
+class BufferedLogShipper(AbstractExternalLogger):
+    """
+    Wraps another external logger so :meth:`write` doesn't wait for the network. Messages are
+    queued and sent by a background thread with the wrapped logger's :meth:`write_batch`.
+
+    A batch is sent when it has `batch_size` messages or its oldest message has waited for
+    `flush_interval` seconds. Messages in a batch are sorted by timestamp.
+
+    When `max_queue` messages are waiting, new messages are dropped (`on_full="drop"`) or the
+    caller waits up to `block_timeout` seconds for space before dropping (`on_full="block"`).
+    Dropped messages are counted in `dropped`.
+
+    Each process has its own queue and thread, started by the first message it logs. Messages
+    still queued are sent when the process ends.
+
+    e.g. in config- `EXTERNAL_LOGGERS = [BufferedLogShipper(CloudwatchLogs(...))]`
+    """
+
+    def __init__(
+        self,
+        logger,
+        max_queue=10000,
+        batch_size=500,
+        flush_interval=2.0,
+        on_full="drop",
+        block_timeout=1.0,
+    ):
+        """
+        @param logger: (subclass of :class:`AbstractExternalLogger`) sends the batches
+        @param max_queue: (int) messages waiting to be sent
+        @param batch_size: (int) maximum messages passed to `logger.write_batch`
+        @param flush_interval: (float) seconds
+        @param on_full: (str) "drop" or "block"
+        @param block_timeout: (float) seconds to wait for space in the queue when `on_full` is
+            "block"
+        """
+        if on_full not in ("drop", "block"):
+            raise ValueError("on_full must be 'drop' or 'block'")
+
+        self.logger = logger
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_full = on_full
+        self.block_timeout = block_timeout
+        self._reset()
+
+    def _reset(self):
+        "State that belongs to a single process"
+        # :class:`LogRecord`, threading.Event to flush or None to end the thread
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+        # messages not sent because the queue was full or the wrapped logger failed
+        self.dropped = 0
+        self.failed = 0
+
+    def __getstate__(self):
+        "Pickle safe so this logger can be moved between processes."
+        return dict(
+            logger=self.logger,
+            max_queue=self.max_queue,
+            batch_size=self.batch_size,
+            flush_interval=self.flush_interval,
+            on_full=self.on_full,
+            block_timeout=self.block_timeout,
+        )
+
+    def __setstate__(self, state):
+        "Pickle safe so this logger can be moved between processes."
+        self.__dict__.update(state)
+        self._reset()
+
+    def __copy__(self):
+        "An independent shipper, with a copy of the wrapped logger, that hasn't started"
+        return self.__class__(
+            logger=copy.copy(self.logger),
+            max_queue=self.max_queue,
+            batch_size=self.batch_size,
+            flush_interval=self.flush_interval,
+            on_full=self.on_full,
+            block_timeout=self.block_timeout,
+        )
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+
+            if self._pid is not None:
+                # Forked with messages from the parent, which will send them itself
+                self._queue = queue.Queue(maxsize=self.max_queue)
+
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run_forever, daemon=True)
+            self._thread.start()
+
+            # run when a :class:`multiprocessing.Process` ends and at interpreter exit
+            util.Finalize(self, self.close, exitpriority=10)
+
+    def write(self, msg, level="INFO"):
+        """
+        Queue a message to be sent.
+
+        @return: bool - False if the message was dropped
+        """
+        self._ensure_thread()
+        record = LogRecord(timestamp=time.time(), level=level, msg=msg)
+        try:
+            if self.on_full == "block":
+                self._queue.put(record, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+        return True
+
+    def write_batch(self, records):
+        "@see :meth:`AbstractExternalLogger.write_batch`"
+        return all([self.write(msg=r.msg, level=r.level) for r in records])
+
+    def flush(self, timeout=10.0):
+        """
+        Send the messages that are waiting.
+
+        @param timeout: (float) seconds
+        @return: bool - messages were sent within `timeout`
+        """
+        if self._thread is None or self._pid != os.getpid():
+            return True
+
+        flushed = threading.Event()
+        self._queue.put(flushed)
+        return flushed.wait(timeout)
+
+    def close(self, timeout=10.0):
+        """
+        Send the messages that are waiting and stop the background thread.
+
+        @param timeout: (float) seconds
+        """
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                return
+            thread, self._thread = self._thread, None
+
+        self._queue.put(None)
+        thread.join(timeout=timeout)
+
+    def _send(self, batch):
+        if not batch:
+            return
+
+        batch.sort(key=lambda r: r.timestamp)
+        try:
+            sent = self.logger.write_batch(batch)
+        except Exception as e:
+            sent = False
+            print(f"External logger failed: {e}", file=sys.stderr)
+
+        if not sent:
+            self.failed += len(batch)
+
+    def _run_forever(self):
+        "Background thread"
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                # `flush_interval` reached
+                self._send(batch)
+                batch = []
+                deadline = None
+                continue
+
+            if isinstance(item, LogRecord):
+                if not batch:
+                    deadline = time.monotonic() + self.flush_interval
+                batch.append(item)
+                if len(batch) < self.batch_size:
+                    continue
+
+            # full batch, flush or close
+            self._send(batch)
+            batch = []
+            deadline = None
+
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is None:
+                return
+
 
 class LoggingMixin:
     """
@@ -15,9 +15,16 @@ class CloudwatchLogs(AbstractExternalLogger):
     See https://docs.aws.amazon.com/AmazonCloudWatch/latest/logs/WhatIsCloudWatchLogs.html
 
     If you are using the one config file way to run Fossa, add an instance of this class to your
-    config in the `EXTERNAL_LOGGERS` list.
+    config in the `EXTERNAL_LOGGERS` list. Wrap it in a :class:`BufferedLogShipper` so messages are
+    sent in batches by a background thread instead of one HTTP request for each message.
     """
 
+    # `put_log_events` limits
+    max_batch_events = 10000
+    max_batch_bytes = 1048576
+    event_overhead_bytes = 26  # counted by Cloudwatch for each event
+    max_batch_span = 24 * 60 * 60 * 1000  # milliseconds between the first and last events
+
     def __init__(self, group_name, stream_name, region_name):
         """
         @param group_name: (str) - AWS cloudwatch logs's group name - must exist before running this
@@ -66,25 +73,75 @@ class CloudwatchLogs(AbstractExternalLogger):
             self._client = boto3.client("logs", region_name=self.region_name)
         return self._client
 
-    def write(self, msg, level="INFO"):
-        "Send a message to Cloudwatch logs"
-
+    @staticmethod
+    def log_event(msg, level, timestamp):
+        """
+        @param timestamp: (float) from time.time()
+        @return: (dict) for `put_log_events`
+        """
         structured_log = {
             "log_level": level,
             "message": msg,
         }
-        serialised_msg = json.dumps(structured_log)
+        return {
+            "timestamp": int(timestamp * 1000),  # milliseconds
+            "message": json.dumps(structured_log),
+        }
 
+    def _put_log_events(self, log_events):
         response = self.client.put_log_events(
             logGroupName=self.group_name,
             logStreamName=self.stream_name,
-            logEvents=[
-                {
-                    "timestamp": int(time.time() * 1000),  # milliseconds
-                    "message": serialised_msg,
-                },
-            ],
+            logEvents=log_events,
         )
 
         # did the log work?
         return response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 200
+
+    def write(self, msg, level="INFO"):
+        "Send a message to Cloudwatch logs"
+        return self._put_log_events([self.log_event(msg, level, time.time())])
+
+    def write_batch(self, records):
+        """
+        Send many messages with as few `put_log_events` calls as Cloudwatch's limits allow. Use
+        with :class:`BufferedLogShipper`.
+
+        @param records: (list of :class:`LogRecord`)
+        @return: bool - all the messages were sent
+        """
+        log_events = [self.log_event(r.msg, r.level, r.timestamp) for r in records]
+
+        # Cloudwatch rejects a batch that isn't in chronological order
+        log_events.sort(key=lambda e: e["timestamp"])
+
+        success = True
+        for chunk in self.chunk_log_events(log_events):
+            success = self._put_log_events(chunk) and success
+        return success
+
+    def chunk_log_events(self, log_events):
+        """
+        Split log events into batches within the `put_log_events` limits.
+
+        @param log_events: (list of dict) sorted by timestamp
+        @return: generator of lists of dict
+        """
+        chunk = []
+        chunk_bytes = 0
+        for log_event in log_events:
+            event_bytes = len(log_event["message"].encode("utf-8")) + self.event_overhead_bytes
+            too_big = chunk_bytes + event_bytes > self.max_batch_bytes
+            too_long = (
+                chunk and log_event["timestamp"] - chunk[0]["timestamp"] > self.max_batch_span
+            )
+            if chunk and (len(chunk) >= self.max_batch_events or too_big or too_long):
+                yield chunk
+                chunk = []
+                chunk_bytes = 0
+
+            chunk.append(log_event)
+            chunk_bytes += event_bytes
+
+        if chunk:
+            yield chunk
@@ -2,17 +2,38 @@
 API views in JSON
 """
 import itertools
+import time
 
-from flask import Blueprint, current_app, jsonify, request, url_for
+from flask import Blueprint, current_app, jsonify, request, stream_with_context, url_for
 
+from fossa.control.admission import AdmissionQueueFull
 from fossa.control.governor import InvalidTaskSpec
 from fossa.control.message import TaskMessage
+from fossa.control.priority import check_priority
 from fossa.utils import JsonException
-from fossa.views.controller import node_summary, task_summary
+from fossa.views.controller import node_summary, task_etag, task_summary
 
 
 api_views = Blueprint("api", __name__)
 
+# Longest a client can ask :func:`task_wait` to hold a request open for, seconds
+MAX_WAIT_TIMEOUT = 60.0
+
+# An event stream sends a comment when the task hasn't changed for this many seconds so proxies
+# don't close it
+EVENTS_KEEP_ALIVE = 15.0
+
+# An event stream ends after this many seconds, with a hint for the client to reconnect after
+# EVENTS_RETRY_MS, so a long running task doesn't keep a web worker busy
+EVENTS_STREAM_TIMEOUT = 60.0
+EVENTS_RETRY_MS = 1000
+
+# A task that was just submitted isn't known until the governor's process has received it
+ADMISSION_GRACE_SECONDS = 2.0
+
+# statuses after which a task doesn't change
+FINISHED_STATUSES = ("complete", "failed")
+
 
 @api_views.route("/")
 def index():
@@ -25,11 +46,41 @@ def test_func(*args):
     print("completed task", args)
 
 
+def _build_task_message(task_id, request_doc):
+    """
+    @param task_id: (str)
+    @param request_doc: (dict) a task from the body of a POST request, it has a 'model_class'
+    @return: (:class:`TaskMessage`)
+    @raise JsonException: for an invalid 'priority'
+    """
+    try:
+        priority = check_priority(request_doc.get("priority", 0))
+    except ValueError as e:
+        raise JsonException(message=str(e), status_code=400)
+
+    task_attribs = {
+        "task_id": task_id,
+        "model_class": request_doc["model_class"],
+        "model_construction_kwargs": request_doc.get("model_construction_kwargs", {}),
+        "method": request_doc.get("method", "go"),  # default for Ayeaye is to run the whole model
+        "method_kwargs": request_doc.get("method_kwargs", {}),
+        "resolver_context": request_doc.get("resolver_context", {}),
+        "on_completion_callback": test_func,
+        "priority": priority,
+    }
+    return TaskMessage(**task_attribs)
+
+
 @api_views.route("/task", methods=["POST"])
 def submit_task():
     at_capacity_msg = "Node at full capacity and can't accept new tasks"
+    governor = current_app.fossa_governor
+
+    # Without an admission queue the task is rejected when there isn't a free processing slot.
+    # With one it waits as "queued" and the client follows the 'wait' or 'events' link.
+    use_admission_queue = governor.admission_queue.depth > 0
 
-    if not current_app.fossa_governor.has_processing_capacity:
+    if not use_admission_queue and not governor.has_processing_capacity:
         # 503 Service Unavailable
         raise JsonException(message=at_capacity_msg, status_code=503)
 
@@ -37,41 +88,133 @@ def submit_task():
     if "model_class" not in request_doc:
         raise JsonException(message="'model_class' is a mandatory field", status_code=400)
 
-    task_id = current_app.fossa_governor.new_task_id()
-    task_attribs = {
-        "task_id": task_id,
-        "model_class": request_doc["model_class"],
-        "model_construction_kwargs": request_doc.get("model_construction_kwargs", {}),
-        "method": request_doc.get("method", "go"),  # default for Ayeaye is to run the whole model
-        "method_kwargs": request_doc.get("method_kwargs", {}),
-        "resolver_context": request_doc.get("resolver_context", {}),
-        "on_completion_callback": test_func,
-    }
-    new_task = TaskMessage(**task_attribs)
+    task_id = governor.new_task_id()
+    new_task = _build_task_message(task_id, request_doc)
 
     # identifier for the governor process that accepted the task
     try:
-        governor_id = current_app.fossa_governor.submit_task(new_task)
+        if use_admission_queue:
+            governor_id = governor.admit_task(new_task)
+        else:
+            governor_id = governor.submit_task(new_task)
     except InvalidTaskSpec as e:
         raise JsonException(message=str(e), status_code=412)
+    except AdmissionQueueFull as e:
+        raise JsonException(message=str(e), status_code=503)
 
     if governor_id is None:
         raise JsonException(message=at_capacity_msg, status_code=503)
 
-    api_url = url_for(
-        "api.task_details",
-        task_id=task_id,
-        _external=True,
-    )
-
+    links = {
+        "task": url_for("api.task_details", task_id=task_id, _external=True),
+        "wait": url_for("api.task_wait", task_id=task_id, _external=True),
+        "events": url_for("api.task_events", task_id=task_id, _external=True),
+    }
     page_vars = {
-        "_metadata": {"links": {"task": api_url}},
+        "_metadata": {"links": links},
         "governor_accepted_ident": governor_id,
         "task_id": task_id,
     }
+    if use_admission_queue:
+        page_vars["status"] = "queued"
     return jsonify(page_vars)
 
 
+@api_views.route("/tasks", methods=["POST"])
+def submit_tasks():
+    """
+    Submit a batch of tasks. The body is a JSON list of task documents, each like the body for
+    :func:`submit_task`. All the tasks are checked before any are submitted and either all are
+    accepted or none are.
+    """
+    governor = current_app.fossa_governor
+    use_admission_queue = governor.admission_queue.depth > 0
+
+    request_doc = request.get_json()
+    if not isinstance(request_doc, list) or not request_doc:
+        raise JsonException(message="Expected a list of tasks", status_code=400)
+
+    for task_number, task_doc in enumerate(request_doc):
+        if not isinstance(task_doc, dict) or "model_class" not in task_doc:
+            msg = f"'model_class' is a mandatory field, it's missing from task {task_number}"
+            raise JsonException(message=msg, status_code=400)
+
+    if use_admission_queue and len(request_doc) > governor.admission_queue.depth:
+        msg = (
+            f"Batch of {len(request_doc)} tasks is larger than the admission queue "
+            f"({governor.admission_queue.depth})"
+        )
+        # 413 Payload Too Large - it's never going to fit
+        raise JsonException(message=msg, status_code=413)
+
+    batch_id = governor.new_batch_id(len(request_doc))
+    task_ids = governor.batch_task_ids(batch_id)
+    new_tasks = [
+        _build_task_message(task_id, task_doc) for task_id, task_doc in zip(task_ids, request_doc)
+    ]
+
+    try:
+        if use_admission_queue:
+            governor_id = governor.admit_tasks(new_tasks)
+        else:
+            governor_id = governor.submit_tasks(new_tasks)
+    except InvalidTaskSpec as e:
+        raise JsonException(message=str(e), status_code=412)
+    except AdmissionQueueFull as e:
+        raise JsonException(message=str(e), status_code=503)
+
+    if governor_id is None:
+        msg = f"Node doesn't have capacity for {len(new_tasks)} more tasks"
+        raise JsonException(message=msg, status_code=503)
+
+    page_vars = {
+        "_metadata": {
+            "links": {"batch": url_for("api.batch_details", batch_id=batch_id, _external=True)}
+        },
+        "governor_accepted_ident": governor_id,
+        "batch_id": batch_id,
+        "task_ids": task_ids,
+    }
+    return jsonify(page_vars)
+
+
+@api_views.route("/batch/<batch_id>")
+def batch_details(batch_id):
+    """
+    Status of each task in a batch submitted to :func:`submit_tasks` and the number of tasks with
+    each status.
+    """
+    governor = current_app.fossa_governor
+    try:
+        task_ids = governor.batch_task_ids(batch_id)
+    except ValueError:
+        return jsonify({"message": "batch unknown"}), 404
+
+    tasks = []
+    status_counts = {}
+    for task_id in task_ids:
+        task_info = governor.task_info(task_id)
+        # tasks that haven't reached the task table yet or have left the task history
+        status = "unknown" if task_info is None else task_info["status"]
+        tasks.append({"task_id": task_id, "status": status})
+        status_counts[status] = status_counts.get(status, 0) + 1
+
+    page_vars = {
+        "batch_id": batch_id,
+        "status_counts": status_counts,
+        "tasks": tasks,
+    }
+    return jsonify(page_vars)
+
+
+def _serialisable(task_info):
+    "Remove callables from a task's details"
+    for k, v in task_info.items():
+        if callable(v):
+            task_info[k] = None
+    return task_info
+
+
 @api_views.route("/task/<task_id>")
 def task_details(task_id):
     governor = current_app.fossa_governor
@@ -80,11 +223,95 @@ def task_details(task_id):
     if task_info is None:
         return jsonify({"message": "task unknown"}), 404
 
-    for k, v in task_info.items():
-        if callable(v):
-            task_info[k] = None
+    # pollers send back the ETag, skip serialising details that haven't changed
+    etag = task_etag(task_info)
+    if request.if_none_match.contains(etag):
+        return "", 304, {"ETag": f'"{etag}"'}
+
+    response = jsonify(_serialisable(task_info))
+    response.set_etag(etag)
+    return response
+
 
-    return jsonify(task_info)
+@api_views.route("/task/<task_id>/wait")
+def task_wait(task_id):
+    """
+    Long-poll for a change to a task.
+
+    Query string args-
+        - status - the status the client already knows, e.g. "queued". The response is sent as
+            soon as the task's status is something else. Without it the current details are sent
+            straight away.
+        - timeout - seconds, at most :data:`MAX_WAIT_TIMEOUT`. The task's current details are sent
+            when it hasn't changed within this time.
+    """
+    governor = current_app.fossa_governor
+    status = request.args.get("status")
+    try:
+        timeout = min(float(request.args.get("timeout", 30)), MAX_WAIT_TIMEOUT)
+    except ValueError:
+        raise JsonException(message="'timeout' must be a number", status_code=400)
+
+    task_info = governor.wait_for_task_change(task_id, status=status, timeout=timeout)
+    if task_info is None:
+        return jsonify({"message": "task unknown"}), 404
+
+    response = jsonify(_serialisable(task_info))
+    response.set_etag(task_etag(task_info))
+    return response
+
+
+@api_views.route("/task/<task_id>/events")
+def task_events(task_id):
+    """
+    Server-sent events stream of a task's details. An event is sent each time the task's status
+    changes and the stream ends when the task has finished.
+
+    The stream also ends after :data:`EVENTS_STREAM_TIMEOUT` seconds. It starts with a `retry`
+    hint so clients (e.g. a browser's `EventSource`) reconnect and are sent the current details
+    again.
+    """
+    governor = current_app.fossa_governor
+
+    # A task from a submit that has only just returned might not be known yet
+    task_info = governor.wait_for_task_change(
+        task_id, status="unknown", timeout=ADMISSION_GRACE_SECONDS
+    )
+    if task_info is None:
+        return jsonify({"message": "task unknown"}), 404
+
+    def generate():
+        yield f"retry: {EVENTS_RETRY_MS}\n\n"
+
+        status = None
+        latest = task_info
+        stream_ends = time.monotonic() + EVENTS_STREAM_TIMEOUT
+        last_sent = time.monotonic()
+        while time.monotonic() < stream_ends:
+            if latest is None:
+                # task history doesn't keep it any more
+                return
+
+            if latest["status"] != status:
+                status = latest["status"]
+                last_sent = time.monotonic()
+                event_data = current_app.json.dumps(_serialisable(latest))
+                yield f"event: {status}\ndata: {event_data}\n\n"
+
+                if status in FINISHED_STATUSES:
+                    return
+
+            elif time.monotonic() - last_sent > EVENTS_KEEP_ALIVE:
+                last_sent = time.monotonic()
+                yield ": keep-alive\n\n"
+
+            latest = governor.wait_for_task_change(task_id, status=status, timeout=1.0)
+
+    return current_app.response_class(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
 
 
 @api_views.route("/node_info")
@@ -1,5 +1,6 @@
-from dataclasses import asdict
-import json
+import hashlib
+
+from fossa.control.task_history import running_task_summary
 
 
 def node_summary(governor):
@@ -19,34 +20,24 @@ def node_summary(governor):
         "node_ident": governor.governor_id,
         "max_concurrent_tasks": governor.runtime.max_concurrent_tasks,
         "available_processing_capacity": governor.available_processing_capacity.value,
+        "max_concurrent_coordinators": governor.max_concurrent_coordinators,
+        "available_coordinator_capacity": governor.coordinator_capacity.value,
+        "node_resources": governor.node_resources.totals(),
+        "node_resources_in_use": governor.node_resources.in_use(),
+        "memory": governor.resource_monitor.summary(),
+        "callbacks_waiting": governor.callbacks_waiting.value,
     }
 
-    # Just the details of what to execute. Results to be added here later.
-    previous_tasks = []
-    for t in governor.previous_tasks:
-        summary = asdict(t["task_spec"])
-        summary["started"] = t["started"]
-        summary["finished"] = t["finished"]
-        summary["results"] = json.loads(t["result_spec"].task_message)
-
-        if summary["results"]["type"] == "TaskComplete":
-            summary["status"] = "complete"
-        elif summary["results"]["type"] == "TaskFailed":
-            summary["status"] = "failed"
-        else:
-            summary["status"] = "unknown"
-
-        previous_tasks.append(summary)
-
-    previous_tasks.sort(key=lambda t: t["finished"], reverse=True)
+    # pre-parsed when each task finished, most recent first
+    previous_tasks = governor.previous_tasks.summaries()
 
+    # read from shared memory, no round trip to the governor
     current_tasks = []
-    for task_id, process_details in governor.process_table.items():
-        process_extract = asdict(process_details["task_spec"])
-        process_extract["task_id"] = task_id
-        process_extract["started"] = process_details["started"]
-        process_extract["status"] = "running"
-        current_tasks.append(process_extract)
+    rss_mb = governor.resource_monitor.rss_mb()
+    for task_record in governor.task_table.records():
+        task_summary = running_task_summary(task_record)
+        task_summary["rss_mb"] = rss_mb.get(task_record["proc_id"])
+        current_tasks.append(task_summary)
 
     current_tasks.sort(key=lambda t: t["started"], reverse=False)
 
@@ -67,14 +58,16 @@ def task_summary(governor, task_id):
         keys from :class:`TaskMessage`
     """
 
-    ns = node_summary(governor)
+    return governor.task_info(task_id)
 
-    for t in ns["running_tasks"]:
-        if t["task_id"] == task_id:
-            return t
 
-    for t in ns["recent_completed_tasks"]:
-        if t["task_id"] == task_id:
-            return t
+def task_etag(task_info):
+    """
+    A task's details only change when it finishes so the status and finish time are enough to
+    identify the version of the details.
 
-    return None  # task not known
+    @param task_info: (dict) from :func:`task_summary`
+    @return: (str) for use as a HTTP ETag
+    """
+    version = f"{task_info['task_id']}:{task_info['status']}:{task_info.get('finished')}"
+    return hashlib.sha1(version.encode("utf-8")).hexdigest()
@@ -3,6 +3,7 @@ Non-API views in HTML
 """
 from flask import Blueprint, current_app, render_template
 
+from fossa.control.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
 from fossa.views.controller import node_summary, task_summary
 
 web_views = Blueprint("web", __name__)
@@ -25,3 +26,12 @@ def task_details(task_id):
         return "Task not found", 404
     page_vars = {"task": task_details}
     return render_template("task_details.html", **page_vars)
+
+
+@web_views.route("/metrics")
+def metrics():
+    "Counters and histograms from all of the node's processes in the Prometheus text format"
+    governor = current_app.fossa_governor
+    return current_app.response_class(
+        governor.metrics.exposition(), content_type=METRICS_CONTENT_TYPE
+    )
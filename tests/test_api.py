@@ -1,9 +1,13 @@
+from datetime import datetime
 import json
+from unittest import mock
 
 from tests.base import BaseTest
 
 from examples.example_etl import NothingEtl
 from fossa.app import api_base_url
+from fossa.control.message import TaskMessage
+from tests.test_task_history import finished_task
 
 
 class TestWeb(BaseTest):
@@ -23,10 +27,11 @@ class TestWeb(BaseTest):
         node_info = resp.json["node_info"]
         self.assertIn("node_ident", node_info)
         self.assertIn("max_concurrent_tasks", node_info)
+        self.assertIn("throttled", node_info["memory"])
 
     def test_submit_task(self):
         # Fakes
-        self.governor.available_processing_capacity.value = 1
+        self.governor.available_processing_capacity.set_capacity(1)
         self.governor.set_accepted_class(NothingEtl)
 
         task_doc = {"model_class": "NothingEtl"}
@@ -47,3 +52,177 @@ class TestWeb(BaseTest):
         )
         self.assertIn("governor_accepted_ident", resp_doc)
         self.assertIn("task_id", resp_doc)
+
+    def test_submit_task_priority(self):
+        self.governor.available_processing_capacity.set_capacity(0)
+        self.governor.set_accepted_class(NothingEtl)
+        self.governor.admission_queue.depth = 1
+
+        task_doc = json.dumps({"model_class": "NothingEtl", "priority": 10})
+        rv = self.test_client.post(
+            api_base_url + "task", data=task_doc, content_type="application/json"
+        )
+        self.assertEqual(400, rv.status_code)
+
+        task_doc = json.dumps({"model_class": "NothingEtl", "priority": 9})
+        rv = self.test_client.post(
+            api_base_url + "task", data=task_doc, content_type="application/json"
+        )
+        self.assertEqual(200, rv.status_code)
+        self.assertEqual("queued", rv.json["status"])
+
+    def test_submit_task_at_capacity(self):
+        self.governor.available_processing_capacity.set_capacity(0)
+        self.governor.set_accepted_class(NothingEtl)
+        task_doc = json.dumps({"model_class": "NothingEtl"})
+
+        # waits in the admission queue
+        self.governor.admission_queue.depth = 1
+        rv = self.test_client.post(
+            api_base_url + "task", data=task_doc, content_type="application/json"
+        )
+        self.assertEqual(200, rv.status_code)
+        self.assertEqual("queued", rv.json["status"])
+        self.assertIn("wait", rv.json["_metadata"]["links"])
+        self.assertIn("events", rv.json["_metadata"]["links"])
+
+        # admission queue is full
+        rv = self.test_client.post(
+            api_base_url + "task", data=task_doc, content_type="application/json"
+        )
+        self.assertEqual(503, rv.status_code)
+
+        # without an admission queue
+        self.governor.admission_queue.depth = 0
+        rv = self.test_client.post(
+            api_base_url + "task", data=task_doc, content_type="application/json"
+        )
+        self.assertEqual(503, rv.status_code)
+
+    def test_submit_tasks(self):
+        self.governor.set_accepted_class(NothingEtl)
+        self.governor.admission_queue.depth = 3
+        tasks_doc = [{"model_class": "NothingEtl"}, {"model_class": "NothingEtl", "method": "go"}]
+
+        rv = self.test_client.post(
+            api_base_url + "tasks", data=json.dumps(tasks_doc), content_type="application/json"
+        )
+        self.assertEqual(200, rv.status_code)
+        batch_id = rv.json["batch_id"]
+        self.assertEqual([f"{batch_id}-0", f"{batch_id}-1"], rv.json["task_ids"])
+        self.assertTrue(rv.json["_metadata"]["links"]["batch"].endswith(f"/batch/{batch_id}"))
+        self.assertEqual(2, len(self.governor.admission_queue))
+
+        # checked before anything is admitted
+        for bad_doc, status_code in [
+            ([{"model_class": "NothingEtl"}, {"method": "go"}], 400),
+            ([{"model_class": "NothingEtl"}, {"model_class": "UnknownEtl"}], 412),
+            ([{"model_class": "NothingEtl"}] * 4, 413),
+            ([{"model_class": "NothingEtl"}] * 2, 503),  # only one place left
+        ]:
+            rv = self.test_client.post(
+                api_base_url + "tasks", data=json.dumps(bad_doc), content_type="application/json"
+            )
+            self.assertEqual(status_code, rv.status_code)
+            self.assertEqual(2, len(self.governor.admission_queue))
+
+    def test_batch_details(self):
+        batch_id = self.governor.new_batch_id(3)
+        task_ids = self.governor.batch_task_ids(batch_id)
+        self.governor.previous_tasks.append(finished_task(task_ids[0]))
+        self.governor.previous_tasks.append(finished_task(task_ids[2]))
+
+        resp = self.test_client.get(api_base_url + f"batch/{batch_id}")
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual({"complete": 2, "unknown": 1}, resp.json["status_counts"])
+        self.assertEqual(task_ids, [t["task_id"] for t in resp.json["tasks"]])
+
+        for unknown_batch_id in ["not_a_batch", "abcde-999999999", "abcde-1x", "abcde-\u0663"]:
+            resp = self.test_client.get(api_base_url + f"batch/{unknown_batch_id}")
+            self.assertEqual(404, resp.status_code, unknown_batch_id)
+
+        # larger than the batch limit so it can't have been submitted
+        too_big = self.governor.max_batch_size + 1
+        resp = self.test_client.get(api_base_url + f"batch/abcde-{too_big}")
+        self.assertEqual(404, resp.status_code)
+
+    def test_task_wait(self):
+        self.governor.previous_tasks.append(finished_task("task_0"))
+
+        resp = self.test_client.get(api_base_url + "task/task_0/wait?status=queued&timeout=1")
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual("complete", resp.json["status"])
+
+        # unchanged within the timeout
+        resp = self.test_client.get(api_base_url + "task/task_0/wait?status=complete&timeout=0.1")
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual("complete", resp.json["status"])
+
+        resp = self.test_client.get(api_base_url + "task/unknown_task/wait")
+        self.assertEqual(404, resp.status_code)
+
+    def test_task_events(self):
+        self.governor.previous_tasks.append(finished_task("task_0"))
+
+        resp = self.test_client.get(api_base_url + "task/task_0/events")
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual("text/event-stream", resp.mimetype)
+
+        # stream ends after the task has finished
+        retry, *events = resp.get_data(as_text=True).strip().split("\n\n")
+        self.assertEqual("retry: 1000", retry, "Clients reconnect when the stream times out")
+        self.assertEqual(1, len(events))
+        event_type, event_data = events[0].split("\n")
+        self.assertEqual("event: complete", event_type)
+        self.assertEqual("task_0", json.loads(event_data[len("data: ") :])["task_id"])
+
+        resp = self.test_client.get(api_base_url + "task/unknown_task/events")
+        self.assertEqual(404, resp.status_code)
+
+    def test_task_events_just_submitted(self):
+        "The task reaches the governor whilst the events request is waiting for it"
+        self.governor.previous_tasks.append(finished_task("task_0"))
+        task_info = self.governor.task_info
+        lookups = []
+
+        def not_known_at_first(task_id):
+            lookups.append(task_id)
+            return None if len(lookups) < 3 else task_info(task_id)
+
+        with mock.patch.object(self.governor, "task_info", side_effect=not_known_at_first):
+            resp = self.test_client.get(api_base_url + "task/task_0/events")
+        self.assertEqual(200, resp.status_code)
+        self.assertIn("event: complete", resp.get_data(as_text=True))
+
+    @mock.patch("fossa.views.api.EVENTS_STREAM_TIMEOUT", 0.5)
+    def test_task_events_stream_timeout(self):
+        self.governor.task_table.add(
+            TaskMessage(
+                task_id="task_0",
+                model_class="NothingEtl",
+                method="go",
+                method_kwargs={},
+                resolver_context={},
+                on_completion_callback=None,
+            ),
+            pid=0,
+            started=datetime.utcnow(),
+            state=self.governor.task_table.QUEUED,
+        )
+        resp = self.test_client.get(api_base_url + "task/task_0/events")
+        events = resp.get_data(as_text=True).strip().split("\n\n")
+        self.assertEqual(["retry: 1000", "event: queued"], [e.split("\n")[0] for e in events])
+
+    def test_task_details_etag(self):
+        self.governor.previous_tasks.append(finished_task("task_0"))
+
+        resp = self.test_client.get(api_base_url + "task/task_0")
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual("complete", resp.json["status"])
+        etag = resp.headers["ETag"]
+
+        resp = self.test_client.get(api_base_url + "task/task_0", headers={"If-None-Match": etag})
+        self.assertEqual(304, resp.status_code, "Unchanged task shouldn't be sent again")
+
+        resp = self.test_client.get(api_base_url + "task/unknown_task")
+        self.assertEqual(404, resp.status_code)
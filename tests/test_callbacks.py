@@ -0,0 +1,126 @@
+import multiprocessing
+import threading
+import time
+import unittest
+
+from fossa.control import metrics
+from fossa.control.callbacks import CallbackRunner
+from fossa.tools.logging import MiniLogger
+
+
+class RecordingLogger(MiniLogger):
+    def __init__(self):
+        super().__init__()
+        self.log_to_stdout = False
+        self.messages = []
+
+    def log(self, msg, level="INFO"):
+        self.messages.append((level, msg))
+
+
+def wait_for(condition, timeout=5):
+    start_time = time.time()
+    while not condition():
+        if time.time() > start_time + timeout:
+            raise AssertionError("Timed out")
+        time.sleep(0.01)
+
+
+class TestCallbackRunner(unittest.TestCase):
+    def setUp(self):
+        self.logger = RecordingLogger()
+
+    def test_callbacks_run(self):
+        runner = CallbackRunner(logger=self.logger, max_workers=2)
+        results = []
+        for i in range(5):
+            runner.submit(results.append, i)
+        runner.shutdown()
+        self.assertEqual([0, 1, 2, 3, 4], sorted(results))
+
+    def test_failed_callback_isolated(self):
+        def fail():
+            raise ValueError("broken callback")
+
+        runner = CallbackRunner(logger=self.logger, max_workers=1)
+        results = []
+        runner.submit(fail, description="for task_0")
+        runner.submit(results.append, "next")
+        runner.shutdown()
+
+        self.assertEqual(["next"], results)
+        [(level, msg)] = self.logger.messages
+        self.assertEqual("ERROR", level)
+        self.assertIn("for task_0", msg)
+        self.assertIn("broken callback", msg)
+
+    def test_waiting_count(self):
+        waiting_count = multiprocessing.Value("i", 0)
+        runner = CallbackRunner(logger=self.logger, max_workers=1, waiting_count=waiting_count)
+        release = threading.Event()
+        runner.submit(release.wait)
+        wait_for(lambda: runner.waiting == 0)
+
+        for _ in range(3):
+            runner.submit(time.sleep, 0)
+        self.assertEqual(3, waiting_count.value)
+
+        self.assertEqual(3, metrics.get_registry().values()["fossa_callbacks_waiting"])
+
+        release.set()
+        runner.shutdown()
+        self.assertEqual(0, waiting_count.value)
+        self.assertEqual(0, metrics.get_registry().values()["fossa_callbacks_waiting"])
+
+    def test_timeout_replaces_thread(self):
+        timeouts_before = metrics.get_registry().values()["fossa_callback_timeouts_total"]
+        runner = CallbackRunner(logger=self.logger, max_workers=1, timeout=0.1)
+        release = threading.Event()
+        results = []
+        runner.submit(release.wait, description="stuck")
+        runner.submit(results.append, "after stuck")
+
+        time.sleep(0.2)
+        self.assertEqual(1, runner.check_timeouts())
+        self.assertEqual(0, runner.check_timeouts(), "Only reported once")
+
+        # the replacement thread runs the next callback
+        wait_for(lambda: results == ["after stuck"])
+        self.assertIn("stuck", self.logger.messages[0][1])
+
+        release.set()
+        runner.shutdown()
+
+        timeouts = metrics.get_registry().values()["fossa_callback_timeouts_total"]
+        self.assertEqual(1, timeouts - timeouts_before)
+
+    def test_abandoned_threads_limited(self):
+        runner = CallbackRunner(logger=self.logger, max_workers=1, timeout=0.1, max_abandoned=1)
+        first_release = threading.Event()
+        second_release = threading.Event()
+        results = []
+        runner.submit(first_release.wait, description="first stuck")
+        runner.submit(second_release.wait, description="second stuck")
+        runner.submit(results.append, "after stuck")
+
+        time.sleep(0.2)
+        self.assertEqual(1, runner.check_timeouts())
+        self.assertEqual(2, len(runner._threads), "Replaced")
+
+        time.sleep(0.2)
+        self.assertEqual(1, runner.check_timeouts())
+        self.assertEqual(2, len(runner._threads), "Not replaced, max_abandoned reached")
+        self.assertEqual([], results)
+
+        # the first thread rejoins the pool as the second wasn't replaced
+        first_release.set()
+        wait_for(lambda: results == ["after stuck"])
+        self.assertEqual(2, len(runner._threads))
+
+        # the second thread was effectively replaced by the first so it ends
+        second_release.set()
+        wait_for(lambda: len(runner._threads) == 1)
+
+        runner.submit(results.append, "pool still works")
+        runner.shutdown()
+        self.assertEqual(["after stuck", "pool still works"], results)
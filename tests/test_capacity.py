@@ -0,0 +1,103 @@
+import multiprocessing
+import time
+import unittest
+
+from fossa.control.capacity import CoordinatorSlot, ProcessingSlots
+from fossa.control.message import CoordinatorMessage
+
+
+def reserve_slot(slots, results_queue):
+    "Runs in a separate process. Blocks until a slot is released by the parent process."
+    start_time = time.time()
+    reserved = slots.acquire(timeout=10)
+    results_queue.put((reserved, time.time() - start_time))
+
+
+class TestProcessingSlots(unittest.TestCase):
+    def test_release_clamped_to_capacity(self):
+        slots = ProcessingSlots()
+        slots.set_capacity(1)
+
+        self.assertTrue(slots.acquire(block=False))
+        self.assertFalse(slots.acquire(block=False))
+
+        slots.release()
+        slots.release()
+        self.assertEqual(1, slots.value, "Free slots shouldn't exceed capacity")
+
+    def test_acquire_many(self):
+        slots = ProcessingSlots()
+        slots.set_capacity(3)
+
+        self.assertFalse(slots.acquire(block=False, slots=4))
+        self.assertEqual(3, slots.value, "Nothing reserved when there aren't enough slots")
+        self.assertTrue(slots.acquire(block=False, slots=2))
+        self.assertFalse(slots.acquire(block=True, timeout=0.1, slots=2))
+        self.assertEqual(1, slots.value)
+
+    def test_release_wakes_other_process(self):
+        """
+        A submitter blocked in another process should be woken as soon as the governor's process
+        releases a slot.
+        """
+        slots = ProcessingSlots()
+        slots.set_capacity(1)
+        self.assertTrue(slots.acquire(block=False))
+
+        results_queue = multiprocessing.Queue()
+        proc = multiprocessing.Process(target=reserve_slot, args=(slots, results_queue))
+        proc.start()
+
+        # give the other process time to be blocked on the slot
+        time.sleep(0.5)
+        self.assertTrue(results_queue.empty(), "Other process shouldn't have a slot yet")
+
+        slots.release()
+        reserved, waited = results_queue.get(timeout=5)
+        proc.join()
+
+        self.assertTrue(reserved)
+        self.assertLess(waited, 2.0, "Should be woken by the release, not the timeout")
+        self.assertEqual(0, slots.value, "The other process holds the only slot")
+
+
+class TestCoordinatorSlot(unittest.TestCase):
+    def setUp(self):
+        self.processing_slots = ProcessingSlots()
+        self.processing_slots.set_capacity(1)
+        self.coordinator_slots = ProcessingSlots()
+        self.work_queue = multiprocessing.Queue()
+
+        # the task's processing slot
+        self.assertTrue(self.processing_slots.acquire(block=False))
+
+    def coordinator(self):
+        return CoordinatorSlot(
+            task_id="parent_task",
+            work_queue=self.work_queue,
+            available_processing_capacity=self.processing_slots,
+            coordinator_capacity=self.coordinator_slots,
+        )
+
+    def test_keeps_processing_slot_without_coordinator_slot(self):
+        coordinator = self.coordinator()
+        self.assertFalse(coordinator.begin())
+        coordinator.end()
+        self.assertTrue(self.work_queue.empty(), "The governor has nothing to change")
+
+    def test_swap_slots(self):
+        self.coordinator_slots.set_capacity(1)
+        coordinator = self.coordinator()
+
+        self.assertTrue(coordinator.begin())
+        self.assertEqual(0, self.coordinator_slots.value)
+        message = self.work_queue.get(timeout=5)
+        self.assertEqual(CoordinatorMessage(task_id="parent_task", coordinating=True), message)
+
+        # what the governor's process does on receiving the message
+        self.processing_slots.release()
+
+        coordinator.end()
+        self.assertEqual(0, self.processing_slots.value, "Processing slot taken back")
+        message = self.work_queue.get(timeout=5)
+        self.assertFalse(message.coordinating)
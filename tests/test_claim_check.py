@@ -0,0 +1,85 @@
+import json
+import os
+import queue
+import tempfile
+import unittest
+
+import ayeaye
+
+from fossa.control.claim_check import (
+    AbstractBlobStore,
+    check_in,
+    claim,
+    discard,
+    FilesystemBlobStore,
+    is_claim_check,
+)
+from fossa.control.process import LocalAyeAyeProcessor
+
+
+class EchoEtl(ayeaye.Model):
+    def build(self):
+        pass
+
+    def echo(self, payload):
+        return payload
+
+
+class TestClaimCheck(unittest.TestCase):
+    def setUp(self):
+        self.blob_dir = tempfile.TemporaryDirectory()
+        self.blob_store = FilesystemBlobStore(self.blob_dir.name)
+
+    def tearDown(self):
+        self.blob_dir.cleanup()
+
+    def test_check_in_and_claim(self):
+        value = {"rows": list(range(100))}
+        claim_check = check_in(self.blob_store, value)
+        self.assertTrue(is_claim_check(claim_check))
+        self.assertLess(len(json.dumps(claim_check)), len(json.dumps(value)))
+
+        self.assertEqual(value, claim(claim_check))
+        self.assertEqual(value, claim(claim_check, delete=True))
+        self.assertEqual([], os.listdir(self.blob_dir.name))
+
+        # discarding twice is harmless
+        discard(claim_check)
+
+    def test_other_values_unchanged(self):
+        self.assertEqual({"a": 1}, claim({"a": 1}))
+        self.assertIsNone(claim(None))
+
+    def test_unknown_blob_store(self):
+        with self.assertRaises(ValueError):
+            claim({"__fossa_claim_check__": "nowhere://bucket/key"})
+
+    def test_abstract_blob_store(self):
+        with self.assertRaises(NotImplementedError):
+            AbstractBlobStore().put(b"")
+
+    def test_processor_claim_checks(self):
+        processor = LocalAyeAyeProcessor(blob_store=self.blob_store, claim_check_min_bytes=1000)
+        processor.log_to_stdout = False
+        results = queue.Queue()
+        processor.set_work_queue(results)
+
+        payload = ["x" * 100] * 20
+        method_kwargs = check_in(self.blob_store, {"payload": payload})
+        processor(
+            task_id="t1",
+            model_cls=EchoEtl,
+            model_construction_kwargs={},
+            method="echo",
+            method_kwargs=method_kwargs,
+            resolver_context={},
+            partition_initialise_kwargs={},
+        )
+
+        task_message = json.loads(results.get_nowait().task_message)
+        self.assertEqual("TaskComplete", task_message["type"])
+        self.assertEqual(method_kwargs, task_message["payload"]["method_kwargs"])
+
+        return_value = task_message["payload"]["return_value"]
+        self.assertTrue(is_claim_check(return_value))
+        self.assertEqual(payload, claim(return_value))
@@ -0,0 +1,596 @@
+import json
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+import ayeaye
+from ayeaye.runtime.task_message import TaskFailed
+
+from examples.example_etl import HalfSecondEtl, NothingEtl
+from fossa.control.capacity import ProcessingSlots
+from fossa.control.execution import AbstractTaskExecutor
+from fossa.control.governor_pool import GovernorProcessPool
+from fossa.control.governor import Governor
+from fossa.control.message import TaskMessage, TerminateMessage
+from fossa.control.process import LocalAyeAyeProcessor, LocalGovernorProcessor
+from fossa.control.resources import resources
+from fossa.control.result_channel import SharedMemoryResultChannel
+from tests.base import BaseTest
+from tests.test_resource_monitor import write_meminfo
+
+
+class SuddenDeathEtl(ayeaye.Model):
+    "Process ends without sending results, like the OOM killer would"
+
+    def build(self):
+        os.kill(os.getpid(), signal.SIGKILL)
+
+
+class CleanExitEtl(ayeaye.Model):
+    "Process ends cleanly (exitcode 0) without sending results"
+
+    def build(self):
+        sys.exit(0)
+
+
+class LingeringEtl(ayeaye.Model):
+    "Process doesn't end for a while after results have been sent"
+
+    def build(self):
+        threading.Thread(target=time.sleep, args=(3,)).start()
+
+
+class SquaresEtl(ayeaye.PartitionedModel):
+    "Subtasks return their pid so it's possible to see they ran in separate processes"
+
+    def build(self):
+        pass
+
+    def partition_slice(self, partition_count):
+        return [("square", {"value": value}) for value in range(4)]
+
+    def square(self, value):
+        time.sleep(0.2)
+        return value * value, os.getpid()
+
+
+class CoordinatingProcessor(LocalAyeAyeProcessor):
+    "Gives models the coordinator slot a process pool for a message broker would use"
+
+    def on_model_start(self, model):
+        model.coordinator = self.coordinator_slot()
+
+
+class WaitingParentEtl(ayeaye.Model):
+    "Waits, like it's waiting for subtasks run elsewhere, without a processing slot"
+
+    def build(self):
+        self.coordinator.begin()
+        time.sleep(1.0)
+        self.coordinator.end()
+
+
+class BigMemoryEtl(ayeaye.Model):
+    @resources(memory_mb=800)
+    def go(self):
+        time.sleep(0.3)
+
+
+class SlowBigMemoryEtl(ayeaye.Model):
+    @resources(memory_mb=800)
+    def go(self):
+        time.sleep(1.0)
+
+
+class SmallMemoryEtl(ayeaye.Model):
+    fossa_resources = {"memory_mb": 100}
+
+    def go(self):
+        pass
+
+
+class VanishingResultChannel(SharedMemoryResultChannel):
+    "The segment has gone by the time the governor reads it"
+
+    def send(self, result_spec):
+        sent = super().send(result_spec)
+        self.discard(result_spec.task_id)
+        return sent
+
+
+def process_exists(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def ignore_callback(final_task_message, task_spec):
+    pass
+
+
+def slow_callback(final_task_message, task_spec):
+    time.sleep(1.5)
+
+
+class TestExecution(BaseTest):
+    def run_tasks(
+        self, model_classes, timeout=10, terminate_governor=True, callback=ignore_callback
+    ):
+        """
+        Run tasks in the governor's process and wait for them to finish.
+
+        @return: list of finished task details from the governor's `previous_tasks`
+        """
+        for model_cls in set(model_classes):
+            self.governor.set_accepted_class(model_cls)
+
+        proc = self.governor.start_internal_processes()
+
+        for task_number, model_cls in enumerate(model_classes):
+            task_spec = TaskMessage(
+                task_id=f"task_{task_number}",
+                model_class=model_cls.__name__,
+                method="go",
+                method_kwargs={},
+                resolver_context={},
+                on_completion_callback=callback,
+            )
+            self.governor.submit_task(task_spec, blocking=True)
+
+        start_time = time.time()
+        while len(self.governor.previous_tasks) < len(model_classes):
+            if time.time() > start_time + timeout:
+                self.fail("Tasks didn't finish")
+            time.sleep(0.05)
+
+        if terminate_governor:
+            self.governor._task_queue_submit.put(TerminateMessage())
+            proc.join()
+
+        return self.governor.previous_tasks.details()
+
+    def check_lost_process_fails_task(self, execution_mode):
+        self.governor.execution_mode = execution_mode
+        self.governor.runtime.max_concurrent_tasks = 1
+
+        finished = self.run_tasks([SuddenDeathEtl, NothingEtl])
+        results = {
+            t["task_spec"].task_id: json.loads(t["result_spec"].task_message) for t in finished
+        }
+
+        self.assertEqual("TaskFailed", results["task_0"]["type"])
+        self.assertEqual("ProcessLost", results["task_0"]["payload"]["exception_class_name"])
+
+        msg = "Slot should be released by the lost task so the next task can run"
+        self.assertEqual("TaskComplete", results["task_1"]["type"], msg)
+
+    def test_lost_process_fails_task(self):
+        self.check_lost_process_fails_task("process_per_task")
+
+    def test_lost_worker_fails_task(self):
+        self.check_lost_process_fails_task("worker_pool")
+
+    def test_worker_pool_reuses_processes(self):
+        self.governor.execution_mode = "worker_pool"
+        self.governor.worker_max_tasks_per_child = 3
+        self.governor.runtime.max_concurrent_tasks = 1
+
+        finished = self.run_tasks([NothingEtl] * 6)
+
+        process_ids = set([t["proc_id"] for t in finished])
+        self.assertEqual(2, len(process_ids), "Worker should be recycled after 3 tasks")
+
+    @mock.patch.object(AbstractTaskExecutor, "lost_task_grace_period", 0.5)
+    def check_clean_exit_without_results(self, execution_mode):
+        self.governor.execution_mode = execution_mode
+        self.governor.runtime.max_concurrent_tasks = 1
+
+        finished = self.run_tasks([CleanExitEtl, NothingEtl])
+        results = {
+            t["task_spec"].task_id: json.loads(t["result_spec"].task_message) for t in finished
+        }
+
+        self.assertEqual("ProcessLost", results["task_0"]["payload"]["exception_class_name"])
+        self.assertEqual("TaskComplete", results["task_1"]["type"])
+
+    def test_clean_exit_without_results(self):
+        self.check_clean_exit_without_results("process_per_task")
+
+    def test_clean_worker_exit_without_results(self):
+        self.check_clean_exit_without_results("worker_pool")
+
+    def test_lingering_process_doesnt_block_governor(self):
+        """
+        A process that has sent results but hasn't ended mustn't stop the governor starting the
+        next task.
+        """
+        self.governor.runtime.max_concurrent_tasks = 1
+
+        start_time = time.time()
+        self.run_tasks([LingeringEtl, NothingEtl], terminate_governor=False)
+        elapsed = time.time() - start_time
+        self.governor.shutdown(None)
+
+        self.assertLess(elapsed, 2.5, "Governor waited for the lingering process to end")
+
+    def test_slow_callbacks_dont_block_tasks(self):
+        self.governor.runtime.max_concurrent_tasks = 1
+
+        start_time = time.time()
+        self.run_tasks([NothingEtl] * 2, terminate_governor=False, callback=slow_callback)
+        elapsed = time.time() - start_time
+
+        self.governor.shutdown(None)
+
+        self.assertLess(elapsed, 2.5, "Governor waited for the callbacks")
+
+    def test_running_task_info(self):
+        self.governor.set_accepted_class(HalfSecondEtl)
+        self.governor.start_internal_processes()
+        task_spec = TaskMessage(
+            task_id="task_0",
+            model_class="HalfSecondEtl",
+            method="go",
+            method_kwargs={},
+            resolver_context={},
+            on_completion_callback=ignore_callback,
+        )
+        self.governor.submit_task(task_spec, blocking=True)
+
+        start_time = time.time()
+        while self.governor.task_info("task_0") is None:
+            if time.time() > start_time + 5:
+                self.fail("Running task not found in task table")
+            time.sleep(0.01)
+
+        task_info = self.governor.task_info("task_0")
+        self.assertEqual("running", task_info["status"])
+        self.assertEqual("HalfSecondEtl", task_info["model_class"])
+
+        while self.governor.task_info("task_0")["status"] == "running":
+            if time.time() > start_time + 10:
+                self.fail("Task didn't finish")
+            time.sleep(0.05)
+
+        self.assertEqual("complete", self.governor.task_info("task_0")["status"])
+        self.governor.shutdown(None)
+
+    def test_admitted_tasks_wait_for_slot(self):
+        self.governor.runtime.max_concurrent_tasks = 1
+        self.governor.set_accepted_class(HalfSecondEtl)
+        self.governor.start_internal_processes()
+
+        for task_id in ["task_0", "task_1"]:
+            task_spec = TaskMessage(
+                task_id=task_id,
+                model_class="HalfSecondEtl",
+                method="go",
+                method_kwargs={},
+                resolver_context={},
+                on_completion_callback=ignore_callback,
+            )
+            self.governor.admit_task(task_spec)
+
+        task_info = self.governor.wait_for_task_change("task_1", status="unknown", timeout=5)
+        self.assertEqual("queued", task_info["status"])
+
+        statuses = []
+        status = "queued"
+        while status not in ("complete", "failed"):
+            task_info = self.governor.wait_for_task_change("task_1", status=status, timeout=10)
+            self.assertNotEqual(status, task_info["status"], "Task didn't change")
+            status = task_info["status"]
+            statuses.append(status)
+
+        self.governor.shutdown(None)
+        self.assertEqual(["running", "complete"], statuses)
+
+    def test_duplicate_task_id_rejected(self):
+        "A second task with the same task_id, e.g. a re-sent subtask, mustn't lose capacity"
+        self.governor.runtime.max_concurrent_tasks = 2
+        self.governor.set_accepted_class(HalfSecondEtl)
+        self.governor.start_internal_processes()
+
+        for _ in range(2):
+            task_spec = TaskMessage(
+                task_id="task_0",
+                model_class="HalfSecondEtl",
+                method="go",
+                method_kwargs={},
+                resolver_context={},
+                on_completion_callback=ignore_callback,
+            )
+            self.governor.submit_task(task_spec, blocking=True)
+
+        start_time = time.time()
+        while len(self.governor.previous_tasks) < 1:
+            if time.time() > start_time + 10:
+                self.fail("Task didn't finish")
+            time.sleep(0.05)
+
+        capacity = self.governor.available_processing_capacity
+        while capacity.value < 2:
+            if time.time() > start_time + 10:
+                self.fail("Processing slots weren't released")
+            time.sleep(0.05)
+
+        self.assertEqual(1, len(self.governor.previous_tasks), "Duplicate mustn't run")
+        self.governor.shutdown(None)
+
+    def test_subtasks_run_by_local_governor(self):
+        self.governor.runtime.max_concurrent_tasks = 3
+        self.governor.isolated_processor = LocalGovernorProcessor()
+
+        # the parent task and its 4 subtasks
+        self.run_tasks([SquaresEtl], timeout=20, terminate_governor=False)
+        start_time = time.time()
+        while len(self.governor.previous_tasks) < 5:
+            if time.time() > start_time + 20:
+                self.fail("Subtasks didn't finish")
+            time.sleep(0.05)
+        finished = self.governor.previous_tasks.details()
+        self.governor.shutdown(None)
+
+        results = {
+            t["task_spec"].task_id: json.loads(t["result_spec"].task_message) for t in finished
+        }
+        subtask_results = [r for task_id, r in results.items() if task_id.startswith("subtask-")]
+        self.assertEqual(4, len(subtask_results))
+        self.assertTrue(all(r["type"] == "TaskComplete" for r in subtask_results))
+
+        squares = sorted(r["payload"]["return_value"][0] for r in subtask_results)
+        self.assertEqual([0, 1, 4, 9], squares)
+
+        pids = {r["payload"]["return_value"][1] for r in subtask_results}
+        self.assertGreater(len(pids), 1, "Subtasks should run in their own processes")
+
+        self.assertEqual("TaskComplete", results["task_0"]["type"])
+        self.assertEqual(3, self.governor.available_processing_capacity.value)
+        self.assertEqual(
+            self.governor.max_concurrent_coordinators, self.governor.coordinator_capacity.value
+        )
+
+    def test_local_governor_parents_limited_by_coordinators(self):
+        "One parent waits in a coordinator slot, the other keeps its processing slot"
+        self.governor.runtime.max_concurrent_tasks = 2
+        self.governor.max_concurrent_coordinators = 1
+        self.governor.isolated_processor = LocalGovernorProcessor()
+
+        # two parent tasks and their 4 subtasks each
+        self.run_tasks([SquaresEtl, SquaresEtl], timeout=30, terminate_governor=False)
+        start_time = time.time()
+        while len(self.governor.previous_tasks) < 10:
+            if time.time() > start_time + 30:
+                self.fail("Subtasks didn't finish")
+            time.sleep(0.05)
+        finished = self.governor.previous_tasks.details()
+        self.governor.shutdown(None)
+
+        statuses = {json.loads(t["result_spec"].task_message)["type"] for t in finished}
+        self.assertEqual({"TaskComplete"}, statuses)
+        self.assertEqual(2, self.governor.available_processing_capacity.value)
+        self.assertEqual(1, self.governor.coordinator_capacity.value)
+
+    def test_local_governor_fails_unaccepted_subtasks(self):
+        work_queue = mock.Mock()
+        slots = ProcessingSlots()
+        slots.set_capacity(1)
+        pool = GovernorProcessPool(
+            work_queue_submit=work_queue,
+            available_processing_capacity=slots,
+            accepted_class_names={"NothingEtl"},
+        )
+        pool.log_to_stdout = False
+        sub_task = SimpleNamespace(
+            model_cls=SquaresEtl,
+            method_name="square",
+            method_kwargs={"value": 2},
+            model_construction_kwargs={},
+            partition_initialise_kwargs={},
+        )
+
+        results = list(pool.run_subtasks([sub_task]))
+        self.assertEqual(1, len(results))
+        self.assertIsInstance(results[0], TaskFailed)
+        self.assertEqual("InvalidTaskSpec", results[0].exception_class_name)
+        work_queue.put.assert_not_called()
+        self.assertEqual(1, slots.value)
+
+    def test_coordinator_releases_processing_slot(self):
+        self.governor.runtime.max_concurrent_tasks = 1
+        self.governor.isolated_processor = CoordinatingProcessor()
+
+        # The second task can only start whilst the first is waiting as a coordinator
+        finished = self.run_tasks([WaitingParentEtl, NothingEtl])
+        finish_order = [t["task_spec"].task_id for t in finished]
+        self.assertEqual(["task_1", "task_0"], finish_order)
+
+        self.assertEqual(1, self.governor.available_processing_capacity.value)
+        self.assertEqual(
+            self.governor.max_concurrent_coordinators, self.governor.coordinator_capacity.value
+        )
+
+    def test_coordinators_limited(self):
+        self.governor.runtime.max_concurrent_tasks = 1
+        self.governor.max_concurrent_coordinators = 0
+        self.governor.isolated_processor = CoordinatingProcessor()
+
+        # Without a coordinator slot the waiting task keeps its processing slot
+        finished = self.run_tasks([WaitingParentEtl, NothingEtl])
+        finish_order = [t["task_spec"].task_id for t in finished]
+        self.assertEqual(["task_0", "task_1"], finish_order)
+
+    def test_tasks_packed_into_node_resources(self):
+        self.governor.runtime.max_concurrent_tasks = 3
+        self.governor.node_resource_overrides = {"memory_mb": 1000}
+
+        # The second big task waits for the first, the small task fits beside the first
+        finished = self.run_tasks([BigMemoryEtl, BigMemoryEtl, SmallMemoryEtl])
+        tasks = {t["task_spec"].task_id: t for t in finished}
+        self.assertEqual(["task_2", "task_0", "task_1"], [t["task_spec"].task_id for t in finished])
+        self.assertGreaterEqual(tasks["task_1"]["started"], tasks["task_0"]["finished"])
+
+        in_use = self.governor.node_resources.in_use()
+        self.assertEqual(0, in_use["memory_mb"], "Resources released by finished tasks")
+
+    def test_high_priority_task_waiting_for_resources_is_queued(self):
+        self.governor.runtime.max_concurrent_tasks = 3
+        self.governor.node_resource_overrides = {"memory_mb": 1000}
+        self.governor.set_accepted_class(SlowBigMemoryEtl)
+        self.governor.start_internal_processes()
+
+        for task_id, priority in [("running", 0), ("low", 0), ("high", 5)]:
+            task_spec = TaskMessage(
+                task_id=task_id,
+                model_class="SlowBigMemoryEtl",
+                method="go",
+                method_kwargs={},
+                resolver_context={},
+                on_completion_callback=ignore_callback,
+                priority=priority,
+            )
+            self.governor.submit_task(task_spec, blocking=True)
+
+        # "high" goes in front of "low" whilst both wait for "running"'s memory
+        start_time = time.time()
+        while self.governor.task_info("high") is None:
+            if time.time() > start_time + 5:
+                self.fail("High priority task isn't in the task table")
+            time.sleep(0.02)
+        self.assertEqual("queued", self.governor.task_info("high")["status"])
+        self.assertEqual("queued", self.governor.task_info("low")["status"])
+
+        task_info = self.governor.wait_for_task_change("high", status="queued", timeout=5)
+        self.assertEqual("running", task_info["status"])
+        self.assertEqual("queued", self.governor.task_info("low")["status"])
+        self.governor.shutdown(None)
+
+    def test_task_too_big_for_node(self):
+        self.governor.node_resource_overrides = {"memory_mb": 500}
+
+        finished = self.run_tasks([BigMemoryEtl])
+        task_message = json.loads(finished[0]["result_spec"].task_message)
+        self.assertEqual("TaskFailed", task_message["type"])
+        self.assertEqual("InsufficientResources", task_message["payload"]["exception_class_name"])
+
+    def test_memory_pressure_holds_back_tasks(self):
+        proc_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(proc_dir.cleanup)
+        write_meminfo(proc_dir.name, mem_total_kb=1000, mem_available_kb=50)
+
+        monitor = self.governor.resource_monitor
+        monitor.proc_path = proc_dir.name
+        monitor.sample_interval = 0.05
+        monitor.sample([])
+        self.assertTrue(monitor.throttled)
+
+        self.governor.set_accepted_class(NothingEtl)
+        self.governor.start_internal_processes()
+        task_spec = TaskMessage(
+            task_id="task_0",
+            model_class="NothingEtl",
+            method="go",
+            method_kwargs={},
+            resolver_context={},
+            on_completion_callback=ignore_callback,
+        )
+        self.governor.submit_task(task_spec, blocking=True)
+
+        time.sleep(0.5)
+        self.assertEqual("queued", self.governor.task_info("task_0")["status"])
+
+        write_meminfo(proc_dir.name, mem_total_kb=1000, mem_available_kb=500)
+        task_info = self.governor.wait_for_task_change("task_0", status="queued", timeout=5)
+        self.assertIn(task_info["status"], ("running", "complete"))
+
+        self.governor.shutdown(None)
+        self.assertFalse(monitor.throttled)
+
+    def check_large_results_through_shared_memory(self, execution_mode):
+        self.governor.execution_mode = execution_mode
+        self.governor.result_channel.min_bytes = 1  # all results
+
+        finished = self.run_tasks([NothingEtl, NothingEtl])
+        for task in finished:
+            task_message = json.loads(task["result_spec"].task_message)
+            self.assertEqual("TaskComplete", task_message["type"])
+
+        prefix = self.governor.result_channel.segment_prefix
+        if os.path.isdir("/dev/shm"):
+            leftover = [f for f in os.listdir("/dev/shm") if f.startswith(prefix)]
+            self.assertEqual([], leftover, "Segments should be removed by the governor")
+
+    def test_lost_shared_memory_fails_task(self):
+        self.governor.runtime.max_concurrent_tasks = 1
+        self.governor.result_channel = VanishingResultChannel(min_bytes=1)
+
+        finished = self.run_tasks([NothingEtl, NothingEtl])
+        for task in finished:
+            task_message = json.loads(task["result_spec"].task_message)
+            self.assertEqual("TaskFailed", task_message["type"])
+            self.assertEqual("ResultLost", task_message["payload"]["exception_class_name"])
+
+    def test_large_results_through_shared_memory(self):
+        self.check_large_results_through_shared_memory("process_per_task")
+
+    def test_large_worker_results_through_shared_memory(self):
+        self.check_large_results_through_shared_memory("worker_pool")
+
+    def test_shutdown_ends_idle_workers(self):
+        self.governor.execution_mode = "worker_pool"
+        self.governor.runtime.max_concurrent_tasks = 3
+
+        # concurrent tasks so each is run by a different worker
+        finished = self.run_tasks([HalfSecondEtl] * 3, terminate_governor=False)
+        worker_pids = set([t["proc_id"] for t in finished])
+        self.assertEqual(3, len(worker_pids))
+
+        self.governor.shutdown(None)
+
+        start_time = time.time()
+        while any(process_exists(pid) for pid in worker_pids):
+            if time.time() > start_time + 5:
+                self.fail("Idle workers are still running after shutdown")
+            time.sleep(0.05)
+
+    def check_start_method(self, start_method, execution_mode):
+        """
+        The governor's queue and locks are made with the same start method as the processes
+        that share them.
+        """
+        self.governor = Governor(mp_start_method=start_method)
+        self.governor.log_to_stdout = False
+        self.governor.execution_mode = execution_mode
+        self.governor.runtime.max_concurrent_tasks = 1
+
+        finished = self.run_tasks([NothingEtl, NothingEtl], timeout=30)
+        results = [json.loads(t["result_spec"].task_message) for t in finished]
+        self.assertEqual(["TaskComplete", "TaskComplete"], [r["type"] for r in results])
+
+        # recorded in the governor's process and the ETL processes
+        metric_values = self.governor.metrics.values()
+        self.assertEqual(2, metric_values["fossa_tasks_started_total"])
+        self.assertEqual(2, metric_values["fossa_task_run_seconds"]["count"])
+        self.assertEqual(2, metric_values["fossa_result_bytes"]["count"])
+
+    def test_start_methods(self):
+        for start_method in ["fork", "spawn", "forkserver"]:
+            for execution_mode in ["process_per_task", "worker_pool"]:
+                with self.subTest(start_method=start_method, execution_mode=execution_mode):
+                    self.check_start_method(start_method, execution_mode)
+
+    def test_forkserver_preloads_model_modules(self):
+        self.governor.set_accepted_class(NothingEtl)
+        self.governor.preload_modules = ["json"]
+
+        preload = self.governor.preload_module_names()
+        self.assertIn("examples.example_etl", preload)
+        self.assertIn("json", preload)
+        self.assertEqual(len(preload), len(set(preload)))
@@ -46,7 +46,7 @@ class TestGovernor(BaseTest):
 
     def test_submit_task(self):
         # faker
-        self.governor.available_processing_capacity.value = 1
+        self.governor.available_processing_capacity.set_capacity(1)
 
         task_spec = TaskMessage(
             model_class="NothingEtl",
@@ -66,3 +66,60 @@ class TestGovernor(BaseTest):
         msg = "Should be allowed now"
         governor_id = self.governor.submit_task(task_spec)
         self.assertIsNotNone(governor_id, msg)
+
+    def test_submit_task_reserves_slot(self):
+        """
+        Each accepted task reserves a processing slot so the node can't be over committed.
+        """
+        self.governor.available_processing_capacity.set_capacity(2)
+        self.governor.set_accepted_class(NothingEtl)
+
+        task_spec = TaskMessage(
+            model_class="NothingEtl",
+            method="go",
+            method_kwargs={},
+            resolver_context={},
+            on_completion_callback=None,
+        )
+
+        accepted = [self.governor.submit_task(task_spec) for _ in range(3)]
+        self.assertEqual(2, len([a for a in accepted if a is not None]))
+        self.assertIsNone(accepted[-1], "Third task should be rejected, only two slots")
+        self.assertFalse(self.governor.has_processing_capacity)
+
+        # governor's process does this when a task finishes
+        self.governor.available_processing_capacity.release()
+        self.assertIsNotNone(self.governor.submit_task(task_spec))
+
+    def test_submit_tasks_all_or_nothing(self):
+        self.governor.available_processing_capacity.set_capacity(2)
+        self.governor.set_accepted_class(NothingEtl)
+
+        batch_id = self.governor.new_batch_id(3)
+        task_specs = [
+            TaskMessage(
+                task_id=task_id,
+                model_class="NothingEtl",
+                method="go",
+                method_kwargs={},
+                resolver_context={},
+                on_completion_callback=None,
+            )
+            for task_id in self.governor.batch_task_ids(batch_id)
+        ]
+        self.assertEqual(f"{batch_id}-2", task_specs[-1].task_id)
+
+        self.assertIsNone(self.governor.submit_tasks(task_specs), "Only two slots")
+        self.assertEqual(2, self.governor.available_processing_capacity.value)
+        self.assertIsNotNone(self.governor.submit_tasks(task_specs[:2]))
+        self.assertEqual(0, self.governor.available_processing_capacity.value)
+
+        task_specs[1].model_class = "UnknownEtl"
+        task_specs[2].model_class = "OtherEtl"
+        with self.assertRaises(ValueError) as context:
+            self.governor.admit_tasks(task_specs)
+        self.assertIn("'UnknownEtl', 'OtherEtl' are not in", str(context.exception))
+        self.assertEqual(0, len(self.governor.admission_queue))
+
+        with self.assertRaises(ValueError):
+            self.governor.batch_task_ids("not_a_batch")
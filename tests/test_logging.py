@@ -1,8 +1,14 @@
+import copy
 import multiprocessing
+import pickle
+import threading
+import time
+import unittest
 
 from fossa.control.broker import AbstractMycorrhiza
 from fossa.control.message import TerminateMessage
-from fossa.tools.logging import AbstractExternalLogger
+from fossa.tools.logging import AbstractExternalLogger, BufferedLogShipper, LogRecord
+from fossa.tools.logging_cloudwatch import CloudwatchLogs
 
 from tests.base import BaseTest
 
@@ -16,6 +22,29 @@ class QueueLogger(AbstractExternalLogger):
         return True
 
 
+class BatchLogger(AbstractExternalLogger):
+    "Records the batches it's given. Sending waits for `release` to be set."
+
+    def __init__(self):
+        self.batches = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def write_batch(self, records):
+        self.release.wait()
+        self.batches.append([r.msg for r in records])
+        return True
+
+
+class StubCloudwatchClient:
+    def __init__(self):
+        self.calls = []
+
+    def put_log_events(self, logGroupName, logStreamName, logEvents):
+        self.calls.append(logEvents)
+        return {"ResponseMetadata": {"HTTPStatusCode": 200}}
+
+
 class FakeSideCar(AbstractMycorrhiza):
     def run_forever(self, work_queue_submit, available_processing_capacity):
         self.log("This is the fake sidecar")
@@ -39,8 +68,9 @@ class TestLogging(BaseTest):
         # instruct the governor to stop
         self.governor._task_queue_submit.put(TerminateMessage())
 
-        # wait for it to terminate
-        proc.join()
+        # wait for it and the sidecar to terminate
+        for p in self.governor._internal_process_table:
+            p.join()
 
         all_the_logs = []
         while not log_queue.empty():
@@ -48,3 +78,84 @@ class TestLogging(BaseTest):
             all_the_logs.append(log_msg)
 
         self.assertIn("INFO This is the fake sidecar", all_the_logs)
+
+
+class TestBufferedLogShipper(unittest.TestCase):
+    def test_batches(self):
+        batch_logger = BatchLogger()
+        shipper = BufferedLogShipper(batch_logger, batch_size=3, flush_interval=60)
+
+        for message_number in range(4):
+            self.assertTrue(shipper.write(f"message {message_number}"))
+
+        # full batch is sent straight away, the rest when flushed
+        self.assertTrue(shipper.flush())
+        self.assertEqual(
+            [["message 0", "message 1", "message 2"], ["message 3"]], batch_logger.batches
+        )
+        shipper.close()
+
+    def test_flush_interval(self):
+        batch_logger = BatchLogger()
+        shipper = BufferedLogShipper(batch_logger, batch_size=100, flush_interval=0.1)
+        shipper.write("message 0")
+
+        start_time = time.time()
+        while not batch_logger.batches:
+            if time.time() > start_time + 5:
+                self.fail("Batch wasn't sent after the flush interval")
+            time.sleep(0.02)
+
+        self.assertEqual([["message 0"]], batch_logger.batches)
+        shipper.close()
+
+    def test_drop_when_full(self):
+        batch_logger = BatchLogger()
+        batch_logger.release.clear()
+        shipper = BufferedLogShipper(batch_logger, max_queue=2, batch_size=1)
+
+        # first is being sent, blocked by `release`, next two fill the queue
+        results = [shipper.write(f"message {message_number}") for message_number in range(4)]
+        time.sleep(0.1)
+        results.append(shipper.write("message 4"))
+
+        self.assertFalse(all(results))
+        self.assertEqual(results.count(False), shipper.dropped)
+
+        batch_logger.release.set()
+        shipper.close()
+        self.assertEqual(5 - shipper.dropped, len(batch_logger.batches))
+
+    def test_sorted_by_timestamp(self):
+        batch_logger = BatchLogger()
+        shipper = BufferedLogShipper(batch_logger)
+        shipper._send([LogRecord(2.0, "INFO", "later"), LogRecord(1.0, "INFO", "earlier")])
+        self.assertEqual([["earlier", "later"]], batch_logger.batches)
+
+    def test_copy_and_pickle(self):
+        cloudwatch = CloudwatchLogs(group_name="g", stream_name="s", region_name="eu-west-2")
+        cloudwatch._client = StubCloudwatchClient()
+        shipper = BufferedLogShipper(cloudwatch, batch_size=7)
+        shipper.write("started")
+
+        for other in [copy.copy(shipper), pickle.loads(pickle.dumps(shipper))]:
+            self.assertEqual(7, other.batch_size)
+            self.assertIsNone(other._thread)
+            self.assertTrue(other._queue.empty())
+
+        shipper.close()
+
+
+class TestCloudwatchLogs(unittest.TestCase):
+    def test_write_batch(self):
+        cloudwatch = CloudwatchLogs(group_name="g", stream_name="s", region_name="eu-west-2")
+        cloudwatch._client = StubCloudwatchClient()
+        cloudwatch.max_batch_events = 2
+
+        records = [LogRecord(float(t), "INFO", f"message {t}") for t in [3, 1, 2]]
+        self.assertTrue(cloudwatch.write_batch(records))
+
+        calls = cloudwatch._client.calls
+        self.assertEqual([2, 1], [len(c) for c in calls])
+        timestamps = [e["timestamp"] for c in calls for e in c]
+        self.assertEqual([1000, 2000, 3000], timestamps)
@@ -0,0 +1,119 @@
+import multiprocessing
+import os
+import signal
+import time
+import unittest
+
+from fossa.control import metrics
+from fossa.control.metrics import MetricSpec, SharedMetrics
+
+test_specs = [
+    MetricSpec("test_events_total", "counter", "Events"),
+    MetricSpec("test_seconds", "histogram", "Durations", (0.1, 1.0)),
+    MetricSpec("test_waiting", "gauge", "Waiting"),
+]
+
+
+def record_events(events):
+    "Runs in a separate process, uses the registry installed by :func:`run_with_registry`"
+    for _ in range(events):
+        metrics.inc("test_events_total")
+    metrics.observe("test_seconds", 5.0)
+
+
+def die_holding_lock(registry):
+    "Runs in a separate process, killed whilst holding the registry's lock"
+    registry._acquire()
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+class TestSharedMetrics(unittest.TestCase):
+    def test_counter_and_histogram(self):
+        registry = SharedMetrics(specs=test_specs)
+        registry.inc("test_events_total")
+        registry.inc("test_events_total", 2)
+        for value in [0.05, 0.1, 0.5, 2.0]:
+            registry.observe("test_seconds", value)
+
+        values = registry.values()
+        self.assertEqual(3, values["test_events_total"])
+
+        histogram = values["test_seconds"]
+        self.assertEqual(4, histogram["count"])
+        self.assertAlmostEqual(2.65, histogram["sum"])
+        self.assertEqual([(0.1, 2), (1.0, 3), (float("inf"), 4)], histogram["buckets"])
+
+        with self.assertRaises(ValueError):
+            registry.observe("test_events_total", 1.0)
+
+    def test_exposition(self):
+        registry = SharedMetrics(specs=test_specs)
+        registry.observe("test_seconds", 0.5)
+
+        exposition = registry.exposition()
+        self.assertIn("# TYPE test_events_total counter\ntest_events_total 0.0\n", exposition)
+        self.assertIn('test_seconds_bucket{le="0.1"} 0.0\n', exposition)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 1.0\n', exposition)
+        self.assertIn("test_seconds_sum 0.5\ntest_seconds_count 1.0\n", exposition)
+
+    def test_gauge(self):
+        registry = SharedMetrics(specs=test_specs)
+        registry.set_gauge("test_waiting", 3)
+        registry.set_gauge("test_waiting", 2)
+        self.assertEqual(2, registry.values()["test_waiting"])
+        self.assertIn("# TYPE test_waiting gauge\ntest_waiting 2.0\n", registry.exposition())
+
+        with self.assertRaises(ValueError):
+            registry.set_gauge("test_events_total", 1)
+
+    def test_aggregated_across_processes(self):
+        for start_method in ["fork", "spawn"]:
+            with self.subTest(start_method=start_method):
+                mp_context = multiprocessing.get_context(start_method)
+                registry = SharedMetrics(mp_context=mp_context, specs=test_specs)
+
+                processes = [
+                    mp_context.Process(
+                        target=metrics.run_with_registry, args=(registry, record_events, 10)
+                    )
+                    for _ in range(3)
+                ]
+                for process in processes:
+                    process.start()
+                for process in processes:
+                    process.join()
+
+                values = registry.values()
+                self.assertEqual(30, values["test_events_total"])
+                self.assertEqual(3, values["test_seconds"]["count"])
+
+    def test_lock_held_by_dead_process(self):
+        mp_context = multiprocessing.get_context("fork")
+        registry = SharedMetrics(mp_context=mp_context, specs=test_specs, lock_timeout=0.05)
+
+        process = mp_context.Process(target=die_holding_lock, args=(registry,))
+        process.start()
+        process.join()
+        self.assertEqual(-signal.SIGKILL, process.exitcode)
+
+        registry.inc("test_events_total")
+        registry.observe("test_seconds", 0.5)
+        values = registry.values()
+        self.assertEqual(1, values["test_events_total"])
+        self.assertEqual(1, values["test_seconds"]["count"])
+        self.assertEqual(0, registry.dropped)
+
+    def test_lock_held_by_live_process(self):
+        registry = SharedMetrics(specs=test_specs, lock_timeout=0.05)
+        registry._acquire()
+        try:
+            start = time.monotonic()
+            registry.inc("test_events_total")
+            self.assertLess(time.monotonic() - start, 1.0)
+            self.assertEqual(1, registry.dropped)
+            self.assertEqual(0, registry.values()["test_events_total"])
+        finally:
+            registry._release()
+
+        registry.inc("test_events_total")
+        self.assertEqual(1, registry.values()["test_events_total"])
@@ -0,0 +1,689 @@
+import asyncio
+from collections import deque
+from datetime import datetime, timedelta
+import json
+import os
+import queue
+import tempfile
+import threading
+from types import SimpleNamespace
+import unittest
+from unittest import mock
+
+from ayeaye.runtime.task_message import TaskComplete, TaskFailed
+import pika
+
+from examples.example_etl import NothingEtl
+
+from fossa.control import metrics
+from fossa.control.capacity import ProcessingSlots
+from fossa.control.claim_check import check_in, FilesystemBlobStore, is_claim_check
+from fossa.control.message import TaskMessage
+from fossa.control.rabbit_mq.async_message_exchange import (
+    AsyncRabbitMx,
+    AsyncSlotWindowConsumer,
+)
+from fossa.control.rabbit_mq.async_pika_client import AsyncPikaClient
+from fossa.control.rabbit_mq.codec import decode, MessageCodec, REPLY_CODEC_HEADER
+from fossa.control.rabbit_mq.message_exchange import RabbitMx, SlotWindowConsumer
+from fossa.control.rabbit_mq.process_pool import (
+    RabbitMqProcessPool,
+    SubtaskRuntimeStats,
+    subtask_id_from_correlation_id,
+)
+from fossa.control.rabbit_mq.retry import RetryPolicy
+from fossa.control.rabbit_mq.results_publisher import (
+    BATCH_CONTENT_TYPE,
+    get_results_publisher,
+    ResultsPublisher,
+    unpack_results,
+)
+
+EMPTY_PAYLOAD = MessageCodec().dumps({})
+
+
+class FakeChannel:
+    "Just enough of a pika channel and broker to check the prefetch window"
+
+    def __init__(self, messages):
+        self.queued = deque(messages)
+        self.unacked = {}
+        self.acked = []
+        self.prefetch_count = None
+        self.on_message_callback = None
+        self._delivery_tag = 0
+
+    def basic_qos(self, prefetch_count, global_qos):
+        self.prefetch_count = prefetch_count
+
+    def basic_consume(self, queue, on_message_callback):
+        self.on_message_callback = on_message_callback
+        return "consumer_tag"
+
+    def basic_cancel(self, consumer_tag):
+        self.on_message_callback = None
+
+    def basic_ack(self, delivery_tag):
+        self.acked.append(self.unacked.pop(delivery_tag))
+
+    def basic_nack(self, delivery_tag, requeue):
+        self.queued.appendleft(self.unacked.pop(delivery_tag))
+
+    def deliver(self):
+        while self.on_message_callback and self.queued and len(self.unacked) < self.prefetch_count:
+            self._delivery_tag += 1
+            properties, body = self.queued.popleft()
+            self.unacked[self._delivery_tag] = (properties, body)
+            method = SimpleNamespace(delivery_tag=self._delivery_tag)
+            self.on_message_callback(self, method, properties, body)
+
+
+def make_message(subtask_id):
+    properties = pika.BasicProperties(correlation_id=subtask_id, reply_to="reply_queue")
+    body = json.dumps(
+        {"model_class": "NothingEtl", "method": "go", "method_kwargs": {}, "resolver_context": {}}
+    )
+    return properties, body
+
+
+class TestSlotWindowConsumer(unittest.TestCase):
+    def setUp(self):
+        self.channel = FakeChannel([make_message(f"subtask_{i}") for i in range(5)])
+        rabbit_mq = SimpleNamespace(
+            channel=self.channel,
+            connection=SimpleNamespace(
+                process_data_events=lambda time_limit: self.channel.deliver()
+            ),
+            task_queue_name="fossa_task_queue",
+        )
+        self.slots = ProcessingSlots()
+        self.work_queue = queue.Queue()
+        exchange = RabbitMx(broker_url="amqp://localhost")
+        exchange.log_to_stdout = False
+        self.consumer = SlotWindowConsumer(
+            rabbit_mq=rabbit_mq,
+            exchange=exchange,
+            work_queue_submit=self.work_queue,
+            available_processing_capacity=self.slots,
+        )
+
+    def test_prefetch_matches_free_slots(self):
+        self.slots.set_capacity(2)
+        self.consumer.step(wait=0.1)
+
+        self.assertEqual(2, self.channel.prefetch_count)
+        self.assertEqual(2, self.work_queue.qsize())
+        self.assertEqual(2, len(self.channel.acked), "Acked once on the governor's queue")
+        self.assertEqual(0, self.slots.value)
+
+        task_spec = self.work_queue.get()
+        self.assertIsInstance(task_spec, TaskMessage)
+        self.assertEqual("subtask_0::reply_queue", task_spec.task_id)
+
+        # node is full, nothing more is delivered
+        self.consumer.step(wait=0.1)
+        self.assertIsNone(self.consumer.consumer_tag)
+        self.assertEqual(3, len(self.channel.queued))
+
+        # a task finishes
+        self.slots.release()
+        self.consumer.step(wait=0.1)
+        self.assertEqual(1, self.channel.prefetch_count)
+        self.assertEqual(3, len(self.channel.acked))
+
+    def test_priority_from_message_properties(self):
+        exchange = self.consumer.exchange
+        properties, body = make_message("subtask_a")
+        self.assertEqual(0, exchange.build_task_message(properties, body).priority)
+
+        properties.priority = 4
+        self.assertEqual(4, exchange.build_task_message(properties, body).priority)
+
+        # another client's queue could allow more priorities than a task can have
+        properties.priority = 200
+        self.assertEqual(9, exchange.build_task_message(properties, body).priority)
+
+    def test_deliveries_without_slot_are_requeued(self):
+        self.slots.set_capacity(2)
+
+        def slot_taken_during_delivery(time_limit):
+            # another submitter takes a slot after the prefetch window was set
+            self.slots.acquire()
+            self.channel.deliver()
+
+        self.consumer.rabbit_mq.connection.process_data_events = slot_taken_during_delivery
+        self.consumer.step(wait=0.1)
+
+        self.assertEqual(1, len(self.channel.acked))
+        self.assertEqual(0, len(self.channel.unacked), "Extra delivery should be requeued")
+        self.assertEqual(4, len(self.channel.queued))
+        self.assertIsNone(self.consumer.consumer_tag)
+
+
+class FakePikaClient:
+    "Records published messages"
+
+    published = []
+
+    def __init__(self, url, max_priority=None):
+        self.channel = SimpleNamespace(
+            confirm_delivery=lambda: None,
+            basic_publish=lambda **kwargs: FakePikaClient.published.append(kwargs),
+        )
+        self.connection = SimpleNamespace(process_data_events=lambda: None)
+
+    def connect(self):
+        return iter([])
+
+    def close_connection(self):
+        pass
+
+
+def task_complete_json(return_value=None):
+    return TaskComplete(method_name="go", method_kwargs={}, return_value=return_value).to_json()
+
+
+class TestResultsPublisher(unittest.TestCase):
+    def test_batch_messages_round_trip(self):
+        results = [
+            ("reply_a", "subtask_0", task_complete_json(0), "json"),
+            ("reply_b", "subtask_1", task_complete_json(1), "json"),
+            ("reply_a", "subtask_2", task_complete_json(2), "json"),
+        ]
+        messages = ResultsPublisher.batch_messages(results)
+        self.assertEqual(["reply_a", "reply_b"], [m[0] for m in messages])
+
+        _, properties, body = messages[0]
+        self.assertEqual(BATCH_CONTENT_TYPE, properties.content_type)
+        unpacked = unpack_results(properties, body)
+        self.assertEqual(["subtask_0", "subtask_2"], [r[0] for r in unpacked])
+        self.assertEqual([0, 2], [r[1].return_value for r in unpacked])
+
+        # a single result is sent as it was before batching
+        _, properties, body = messages[1]
+        self.assertEqual(task_complete_json(1), body)
+        self.assertEqual(
+            [("subtask_1", TaskComplete(method_name="go", method_kwargs={}, return_value=1))],
+            unpack_results(properties, body),
+        )
+
+    def test_reply_codecs(self):
+        big_value = "x" * 4096
+        for reply_codec in ["json+gzip", "msgpack", "msgpack+zstd", "msgpack+lz4"]:
+            with self.subTest(reply_codec=reply_codec):
+                if not MessageCodec.from_name(reply_codec).is_available:
+                    self.skipTest(f"{reply_codec} isn't installed")
+
+                for batch_size in (1, 3):
+                    results = [
+                        ("reply_a", f"subtask_{i}", task_complete_json(big_value), reply_codec)
+                        for i in range(batch_size)
+                    ]
+                    [(_, properties, body)] = ResultsPublisher.batch_messages(results)
+                    if "+" in reply_codec:
+                        self.assertEqual(reply_codec.split("+")[1], properties.content_encoding)
+
+                    unpacked = unpack_results(properties, body)
+                    self.assertEqual(batch_size, len(unpacked))
+                    self.assertEqual(big_value, unpacked[-1][1].return_value)
+
+    def test_no_reply_codec_not_batched(self):
+        "An originator that didn't send REPLY_CODEC_HEADER can't unpack batches"
+        results = [("reply_a", f"subtask_{i}", task_complete_json(i), None) for i in range(3)] + [
+            ("reply_a", "subtask_3", task_complete_json(3), "json")
+        ]
+        messages = ResultsPublisher.batch_messages(results)
+        self.assertEqual(4, len(messages))
+        for position, (reply_to, properties, body) in enumerate(messages[:3]):
+            self.assertEqual("reply_a", reply_to)
+            self.assertEqual(f"subtask_{position}", properties.correlation_id)
+            self.assertIsNone(properties.content_type)
+            self.assertEqual(task_complete_json(position), body)
+
+    def test_get_results_publisher_shared_by_threads(self):
+        broker_url = "amqp://test_get_results_publisher_shared_by_threads"
+        publishers = []
+        start = threading.Barrier(8)
+
+        def get_publisher():
+            start.wait()
+            publishers.append(get_results_publisher(broker_url))
+
+        threads = [threading.Thread(target=get_publisher) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(8, len(publishers))
+        self.assertEqual(1, len({id(p) for p in publishers}))
+
+    def test_unavailable_reply_codec_falls_back_to_json(self):
+        results = [("reply_a", "subtask_0", task_complete_json(), "cbor+brotli")]
+        [(_, properties, body)] = ResultsPublisher.batch_messages(results)
+        self.assertEqual("application/json", properties.content_type)
+        self.assertEqual(task_complete_json(), body)
+
+    @mock.patch("fossa.control.rabbit_mq.results_publisher.BasicPikaClient", FakePikaClient)
+    def test_results_sent_on_close(self):
+        FakePikaClient.published = []
+        publisher = ResultsPublisher(broker_url="amqp://localhost")
+        publisher.log_to_stdout = False
+        for subtask_number in range(3):
+            publisher.publish("reply_a", f"subtask_{subtask_number}", task_complete_json())
+        publisher.close()
+
+        sent = []
+        for message in FakePikaClient.published:
+            sent.extend(unpack_results(message["properties"], message["body"]))
+        self.assertEqual(["subtask_0", "subtask_1", "subtask_2"], [s[0] for s in sent])
+
+
+class InMemoryAsyncClient:
+    "Stand-in for :class:`AsyncPikaClient` and the broker"
+
+    task_queue_name = "fossa_task_queue"
+    is_open = True
+
+    def __init__(self, messages):
+        self.queued = deque(messages)
+        self.unacked = {}
+        self.acked = []
+        self.prefetch_count = None
+        self.prefetch_history = []
+        self.on_message_callback = None
+        self._delivery_tag = 0
+        self.channel = SimpleNamespace(basic_ack=lambda delivery_tag: self.ack(delivery_tag))
+
+    def _deliver(self):
+        while self.on_message_callback and self.queued and len(self.unacked) < self.prefetch_count:
+            self._delivery_tag += 1
+            properties, body = self.queued.popleft()
+            self.unacked[self._delivery_tag] = (properties, body)
+            method = SimpleNamespace(delivery_tag=self._delivery_tag)
+            self.on_message_callback(self.channel, method, properties, body)
+
+    async def set_prefetch(self, prefetch_count):
+        self.prefetch_count = prefetch_count
+        self.prefetch_history.append(prefetch_count)
+
+    async def consume(self, queue, on_message_callback):
+        self.on_message_callback = on_message_callback
+        asyncio.get_running_loop().call_soon(self._deliver)
+        return "consumer_tag"
+
+    async def cancel(self, consumer_tag):
+        self.on_message_callback = None
+
+    def ack(self, delivery_tag):
+        self.acked.append(self.unacked.pop(delivery_tag))
+        self._deliver()
+
+    def nack(self, delivery_tag, requeue=True):
+        self.queued.appendleft(self.unacked.pop(delivery_tag))
+
+
+class TestAsyncRabbitMx(unittest.TestCase):
+    def test_prefetch_matches_free_slots(self):
+        rabbit_mq = InMemoryAsyncClient([make_message(f"subtask_{i}") for i in range(5)])
+        slots = ProcessingSlots()
+        slots.set_capacity(2)
+        work_queue = queue.Queue()
+        exchange = AsyncRabbitMx(broker_url="amqp://localhost")
+        exchange.log_to_stdout = False
+        consumer = AsyncSlotWindowConsumer(
+            rabbit_mq=rabbit_mq,
+            exchange=exchange,
+            work_queue_submit=work_queue,
+            available_processing_capacity=slots,
+            wait=0.1,
+        )
+
+        async def run_steps():
+            for _ in range(4):
+                await consumer.step()
+
+        received_before = metrics.get_registry().values()["fossa_broker_messages_received_total"]
+        asyncio.run(run_steps())
+        received = metrics.get_registry().values()["fossa_broker_messages_received_total"]
+
+        self.assertEqual([2, 1], rabbit_mq.prefetch_history, "Window should follow free slots")
+        self.assertEqual(2, len(rabbit_mq.acked), "Acked once on the governor's queue")
+        self.assertEqual(2, received - received_before, "Received through submit_delivery")
+        self.assertEqual(2, work_queue.qsize())
+        self.assertIsNone(consumer.consumer_tag, "Consumer cancelled when node is full")
+        self.assertEqual(3, len(rabbit_mq.queued))
+
+    def test_publisher_confirms(self):
+        client = AsyncPikaClient(url="amqp://localhost")
+        published = []
+        client.channel = SimpleNamespace(basic_publish=lambda **kwargs: published.append(kwargs))
+
+        async def publish_and_confirm():
+            publish = asyncio.ensure_future(client.publish("reply_a", "{}"))
+            await asyncio.sleep(0)
+            self.assertFalse(publish.done(), "Waits for the broker to confirm")
+
+            frame = SimpleNamespace(method=pika.spec.Basic.Ack(delivery_tag=1, multiple=False))
+            client._on_delivery_confirmation(frame)
+            await publish
+
+        asyncio.run(publish_and_confirm())
+        self.assertEqual("reply_a", published[0]["routing_key"])
+
+
+class TestRabbitMqProcessPool(unittest.TestCase):
+    def test_send_tasks_in_batches(self):
+        publish_channel = mock.Mock()
+        connection = mock.Mock()
+        connection.channel.return_value = publish_channel
+
+        pool = RabbitMqProcessPool(broker_url="amqp://localhost")
+        pool.log_to_stdout = False
+        pool.publish_batch_size = 500
+        pool.rabbit_mq = SimpleNamespace(
+            connect=lambda: iter([]),
+            connection=connection,
+            reply_queue="reply_a",
+            task_queue_name="fossa_task_queue",
+        )
+
+        pool.send_tasks([(f"subtask_{i}", EMPTY_PAYLOAD) for i in range(1200)])
+        pool.send_task("subtask_retry", EMPTY_PAYLOAD)
+
+        self.assertEqual(1, connection.channel.call_count, "Publish channel should be reused")
+        publish_channel.tx_select.assert_called_once()
+        publish_channel.confirm_delivery.assert_not_called()
+        self.assertEqual(1201, publish_channel.basic_publish.call_count)
+        self.assertEqual(4, publish_channel.tx_commit.call_count, "One commit per batch")
+
+    def test_subtasks_sent_with_parent_priority(self):
+        publish_channel = mock.Mock()
+        connection = mock.Mock()
+        connection.channel.return_value = publish_channel
+
+        pool = RabbitMqProcessPool(broker_url="amqp://localhost", max_priority=5, priority=7)
+        pool.log_to_stdout = False
+        pool.rabbit_mq = SimpleNamespace(
+            connect=lambda: iter([]),
+            connection=connection,
+            reply_queue="reply_a",
+            task_queue_name="fossa_task_queue",
+        )
+
+        pool.send_task("subtask_a", EMPTY_PAYLOAD)
+        properties = publish_channel.basic_publish.call_args.kwargs["properties"]
+        self.assertEqual(5, properties.priority, "Limited to the queue's priorities")
+
+    def make_pool(self):
+        pool = RabbitMqProcessPool(broker_url="amqp://localhost")
+        pool.log_to_stdout = False
+        pool.send_tasks = mock.Mock()
+        return pool
+
+    def add_in_flight(self, pool, subtask_id, seconds_ago):
+        dispatched = datetime.utcnow() - timedelta(seconds=seconds_ago)
+        pool.tasks_in_flight[subtask_id] = {
+            "task_definition": {"model_class": "NothingEtl", "method": "go"},
+            "task_payload": EMPTY_PAYLOAD,
+            "start_time": dispatched,
+            "last_dispatch": dispatched,
+            "speculative_dispatches": 0,
+        }
+
+    def test_runtime_stats_percentile(self):
+        stats = SubtaskRuntimeStats()
+        key = ("NothingEtl", "go")
+        self.assertIsNone(stats.percentile(key, 0.95))
+        for seconds in range(1, 101):
+            stats.record(key, seconds)
+        self.assertEqual(95, stats.percentile(key, 0.95))
+        self.assertIsNone(stats.percentile(key, 0.95, min_samples=101))
+
+    def test_slow_subtask_sent_again(self):
+        pool = self.make_pool()
+        pool.lost_subtask_timeout = None
+        for _ in range(10):
+            pool.runtime_stats.record(("NothingEtl", "go"), 1.0)
+
+        self.add_in_flight(pool, "slow_subtask", seconds_ago=10)
+        self.add_in_flight(pool, "normal_subtask", seconds_ago=0.5)
+
+        self.assertEqual(["slow_subtask"], pool.redispatch_slow_subtasks())
+        pool.send_tasks.assert_called_once_with([("slow_subtask", EMPTY_PAYLOAD)])
+
+        # not again until it's slow again
+        self.assertEqual([], pool.redispatch_slow_subtasks())
+
+    def test_lost_subtask_sent_again(self):
+        "Without any completed subtasks to compare with, the lost timeout is used"
+        pool = self.make_pool()
+        pool.lost_subtask_timeout = 60
+        pool.max_speculative_dispatches = 1
+        self.add_in_flight(pool, "lost_subtask", seconds_ago=120)
+
+        self.assertEqual(["lost_subtask"], pool.redispatch_slow_subtasks())
+
+        pool.tasks_in_flight["lost_subtask"]["last_dispatch"] -= timedelta(seconds=120)
+        self.assertEqual([], pool.redispatch_slow_subtasks(), "Limited number of extra copies")
+
+    def run_subtasks(self, pool, subtask_count, replies, method_kwargs=None):
+        """
+        @param replies: list of (subtask_number, task message JSON) received by the pool
+        @return: list of task messages yielded by the pool
+        """
+        sub_task = SimpleNamespace(
+            model_cls=NothingEtl,
+            method_name="go",
+            method_kwargs=method_kwargs or {},
+            model_construction_kwargs={},
+            partition_initialise_kwargs={},
+        )
+
+        consumed = []
+        for delivery_tag, (subtask_number, body) in enumerate(replies, start=1):
+            properties = pika.BasicProperties(
+                correlation_id=f"{pool.pool_id}:{subtask_number}", content_type="application/json"
+            )
+            consumed.append((SimpleNamespace(delivery_tag=delivery_tag), properties, body))
+        consumed.append((None, None, None))
+
+        pool.rabbit_mq = SimpleNamespace(
+            connect=lambda: iter([]),
+            reply_queue="reply_a",
+            connection=mock.Mock(),
+            channel=mock.Mock(),
+        )
+        pool.rabbit_mq.channel.consume.return_value = iter(consumed)
+
+        return list(pool.run_subtasks([sub_task] * subtask_count))
+
+    def test_duplicate_results_discarded(self):
+        pool = self.make_pool()
+        complete = TaskComplete(method_name="go", method_kwargs={}, return_value=None).to_json()
+
+        # the second result for subtask 0 is from a speculative copy
+        replies = [("0#1", complete), ("0#2", complete), ("1#1", complete)]
+        results = self.run_subtasks(pool, 2, replies)
+        self.assertEqual(2, len(results))
+
+    def test_each_dispatch_has_own_correlation_id(self):
+        publish_channel = mock.Mock()
+        connection = mock.Mock()
+        connection.channel.return_value = publish_channel
+
+        pool = RabbitMqProcessPool(broker_url="amqp://localhost")
+        pool.log_to_stdout = False
+        pool.rabbit_mq = SimpleNamespace(
+            connect=lambda: iter([]),
+            connection=connection,
+            reply_queue="reply_a",
+            task_queue_name="fossa_task_queue",
+        )
+
+        # the first dispatch and a speculative copy
+        pool.send_task("subtask_a", EMPTY_PAYLOAD)
+        pool.send_task("subtask_a", EMPTY_PAYLOAD)
+
+        correlation_ids = [
+            c.kwargs["properties"].correlation_id for c in publish_channel.basic_publish.mock_calls
+        ]
+        self.assertEqual(["subtask_a#1", "subtask_a#2"], correlation_ids)
+        self.assertEqual(
+            {"subtask_a"}, {subtask_id_from_correlation_id(c) for c in correlation_ids}
+        )
+
+    def test_failed_subtask_retried_with_delay(self):
+        pool = self.make_pool()
+        pool.retry_policy = RetryPolicy(max_attempts=2, base_delay=4.0, jitter=0)
+        failed = TaskFailed(
+            model_class_name="NothingEtl",
+            model_construction_kwargs={},
+            partition_initialise_kwargs={},
+            method_name="go",
+            method_kwargs={},
+            resolver_context={},
+            exception_class_name="ValueError",
+            traceback=[],
+        ).to_json()
+        complete = TaskComplete(method_name="go", method_kwargs={}, return_value=None).to_json()
+
+        results = self.run_subtasks(pool, 2, [(0, failed), (1, failed), (0, complete), (1, failed)])
+
+        self.assertEqual(["TaskComplete", "TaskFailed"], [r.__class__.__name__ for r in results])
+        retries = [c for c in pool.send_tasks.call_args_list if c.kwargs.get("delay")]
+        self.assertEqual(2, len(retries), "One retry for each subtask")
+        self.assertEqual(4.0, retries[0].kwargs["delay"])
+        self.assertEqual({}, pool.failed_attempts, "Finished subtasks aren't kept")
+
+    def test_large_payloads_claim_checked(self):
+        with tempfile.TemporaryDirectory() as blob_dir:
+            blob_store = FilesystemBlobStore(blob_dir)
+            pool = self.make_pool()
+            pool.blob_store = blob_store
+            pool.claim_check_min_bytes = 1000
+            pool.codec = MessageCodec()  # uncompressed
+
+            big_kwargs = {"rows": ["x" * 100] * 20}
+            return_value = check_in(blob_store, ["y" * 100] * 20)
+            # the worker sends back the claim check it was given for the method_kwargs
+            complete = TaskComplete(method_name="go", method_kwargs={}, return_value=return_value)
+            results = self.run_subtasks(
+                pool, 1, [(0, complete.to_json())], method_kwargs=big_kwargs
+            )
+
+            [(_subtask_id, task_payload)] = pool.send_tasks.call_args.args[0]
+            sent = decode(
+                task_payload.body, task_payload.content_type, task_payload.content_encoding
+            )
+            self.assertTrue(is_claim_check(sent["method_kwargs"]))
+            self.assertLess(len(task_payload.body), 1000)
+
+            self.assertEqual(big_kwargs, results[0].method_kwargs)
+            self.assertEqual(["y" * 100] * 20, results[0].return_value)
+            self.assertEqual([], os.listdir(blob_dir), "Blobs are removed once finished with")
+
+
+class TestMessageCodec(unittest.TestCase):
+    def test_round_trip(self):
+        task_definition = {"model_class": "NothingEtl", "method_kwargs": {"rows": list(range(500))}}
+        for name in ["json", "json+gzip", "msgpack", "msgpack+zstd", "msgpack+lz4"]:
+            with self.subTest(codec=name):
+                codec = MessageCodec.from_name(name)
+                if not codec.is_available:
+                    self.skipTest(f"{name} isn't installed")
+
+                envelope = codec.dumps(task_definition)
+                self.assertEqual(codec.compression, envelope.content_encoding)
+                self.assertEqual(
+                    task_definition,
+                    decode(envelope.body, envelope.content_type, envelope.content_encoding),
+                )
+
+    def test_small_messages_not_compressed(self):
+        envelope = MessageCodec("json", "gzip", compress_min_bytes=100).dumps({"a": 1})
+        self.assertIsNone(envelope.content_encoding)
+        self.assertEqual('{"a": 1}', envelope.body)
+
+    def test_negotiate(self):
+        self.assertEqual("json", MessageCodec.negotiate(None).name)
+        self.assertEqual("json", MessageCodec.negotiate("not_a_codec").name)
+        self.assertEqual("json+gzip", MessageCodec.negotiate("json+gzip").name)
+
+    def test_task_received_by_worker(self):
+        codec = MessageCodec.best_available()
+        pool = RabbitMqProcessPool(broker_url="amqp://localhost", message_codec=codec.name)
+        envelope = pool.codec.dumps(
+            {
+                "model_class": "NothingEtl",
+                "method": "go",
+                "method_kwargs": {},
+                "resolver_context": {},
+            }
+        )
+        properties = pika.BasicProperties(
+            correlation_id="subtask_0",
+            reply_to="reply_a",
+            content_type=envelope.content_type,
+            content_encoding=envelope.content_encoding,
+            headers={REPLY_CODEC_HEADER: pool.codec.name},
+        )
+
+        exchange = RabbitMx(broker_url="amqp://localhost")
+        task_spec = exchange.build_task_message(properties, envelope.body)
+        self.assertEqual("NothingEtl", task_spec.model_class)
+
+        publisher = mock.Mock()
+        with mock.patch(
+            "fossa.control.rabbit_mq.message_exchange.get_results_publisher",
+            return_value=publisher,
+        ):
+            task_spec.on_completion_callback("{}", task_spec)
+
+        publisher.publish.assert_called_once_with(
+            reply_to="reply_a", correlation_id="subtask_0", body="{}", reply_codec=codec.name
+        )
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_exponential_backoff(self):
+        policy = RetryPolicy(max_attempts=5, base_delay=1.0, multiplier=2.0, max_delay=5, jitter=0)
+        self.assertEqual([1.0, 2.0, 4.0, 5.0], [policy.delay(a) for a in range(1, 5)])
+        self.assertTrue(policy.should_retry(4))
+        self.assertFalse(policy.should_retry(5))
+
+    def test_jitter(self):
+        policy = RetryPolicy(base_delay=10.0, jitter=0.5)
+        delays = [policy.delay(1) for _ in range(100)]
+        self.assertTrue(all(5.0 <= d <= 10.0 for d in delays))
+        self.assertGreater(len(set(delays)), 1)
+
+    def test_delayed_send_uses_dead_letter_queue(self):
+        publish_channel = mock.Mock()
+        connection = mock.Mock()
+        connection.channel.return_value = publish_channel
+
+        pool = RabbitMqProcessPool(broker_url="amqp://localhost")
+        pool.log_to_stdout = False
+        pool.rabbit_mq = SimpleNamespace(
+            connect=lambda: iter([]),
+            connection=connection,
+            reply_queue="reply_a",
+            task_queue_name="fossa_task_queue",
+        )
+        pool.send_tasks([("subtask_0", EMPTY_PAYLOAD)], delay=1.5)
+        pool.send_tasks([("subtask_1", EMPTY_PAYLOAD)], delay=2)
+
+        publish_channel.queue_declare.assert_called_once_with(
+            queue="fossa_task_queue.delay.2s",
+            durable=True,
+            arguments={
+                "x-message-ttl": 2000,
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": "fossa_task_queue",
+            },
+        )
+        routing_keys = [
+            c.kwargs["routing_key"] for c in publish_channel.basic_publish.call_args_list
+        ]
+        self.assertEqual(["fossa_task_queue.delay.2s"] * 2, routing_keys)
@@ -0,0 +1,114 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from fossa.control.resource_monitor import read_meminfo, read_vmstat, ResourceMonitor
+
+
+def write_meminfo(proc_path, mem_total_kb, mem_available_kb, swap_total_kb=0, swap_free_kb=0):
+    with open(os.path.join(proc_path, "meminfo"), "w") as f:
+        f.write(f"MemTotal:       {mem_total_kb} kB\n")
+        f.write(f"MemFree:        {mem_available_kb // 2} kB\n")
+        f.write(f"MemAvailable:   {mem_available_kb} kB\n")
+        f.write(f"SwapTotal:      {swap_total_kb} kB\n")
+        f.write(f"SwapFree:       {swap_free_kb} kB\n")
+        f.write("HugePages_Total:       0\n")
+
+
+def write_vmstat(proc_path, pswpin, pswpout):
+    with open(os.path.join(proc_path, "vmstat"), "w") as f:
+        f.write(f"nr_free_pages 1000\npswpin {pswpin}\npswpout {pswpout}\n")
+
+
+def write_status(proc_path, pid, rss_kb):
+    os.makedirs(os.path.join(proc_path, str(pid)), exist_ok=True)
+    with open(os.path.join(proc_path, str(pid), "status"), "w") as f:
+        f.write(f"Name:\tpython\nPid:\t{pid}\nVmRSS:\t  {rss_kb} kB\nThreads:\t1\n")
+
+
+class TestResourceMonitor(unittest.TestCase):
+    def setUp(self):
+        self.proc_dir = tempfile.TemporaryDirectory()
+        self.proc_path = self.proc_dir.name
+        self.monitor = ResourceMonitor(
+            max_processes=4,
+            memory_high_water_percent=90.0,
+            memory_low_water_percent=80.0,
+            swap_rate_high_water=100.0,
+            proc_path=self.proc_path,
+        )
+
+    def tearDown(self):
+        self.proc_dir.cleanup()
+
+    def test_read_meminfo(self):
+        write_meminfo(self.proc_path, 1000, 400)
+        meminfo = read_meminfo(os.path.join(self.proc_path, "meminfo"))
+        self.assertEqual(1000, meminfo["MemTotal"])
+        self.assertEqual(0, meminfo["HugePages_Total"])
+
+    def test_high_and_low_water_marks(self):
+        # (memory available, expected throttled) as memory use goes up and back down
+        samples = [(500, False), (50, True), (150, True), (250, False), (150, False)]
+        for mem_available, expected in samples:
+            write_meminfo(self.proc_path, 1000, mem_available)
+            self.monitor.sample([])
+            used = 100 - mem_available / 10
+            self.assertEqual(expected, self.monitor.throttled, f"{used}% used")
+
+    def test_read_vmstat(self):
+        write_vmstat(self.proc_path, pswpin=10, pswpout=20)
+        vmstat = read_vmstat(os.path.join(self.proc_path, "vmstat"))
+        self.assertEqual({"nr_free_pages": 1000, "pswpin": 10, "pswpout": 20}, vmstat)
+
+    @mock.patch("fossa.control.resource_monitor.time.monotonic", side_effect=[0.0, 1.0, 2.0])
+    def test_swapping_throttles(self, _monotonic):
+        write_meminfo(self.proc_path, 1000, 500, swap_total_kb=1000, swap_free_kb=900)
+        write_vmstat(self.proc_path, pswpin=1000, pswpout=1000)
+        self.monitor.sample([])
+        self.assertFalse(self.monitor.throttled, "Nothing to compare the first sample with")
+
+        # 500 pages a second
+        write_vmstat(self.proc_path, pswpin=1200, pswpout=1300)
+        self.assertTrue(self.monitor.sample([]), "Throttling changed")
+        self.assertTrue(self.monitor.throttled)
+        self.assertEqual(500.0, self.monitor.summary()["swap_pages_per_second"])
+
+        # swapping has stopped and memory use is low
+        self.assertTrue(self.monitor.sample([]), "Throttling changed")
+        self.assertFalse(self.monitor.throttled)
+
+    def test_swap_in_use_without_swapping(self):
+        "Pages left in swap after memory pressure has passed don't throttle"
+        write_meminfo(self.proc_path, 1000, 500, swap_total_kb=1000, swap_free_kb=50)
+        write_vmstat(self.proc_path, pswpin=5000, pswpout=9000)
+        for _ in range(3):
+            self.monitor.sample([])
+            self.assertFalse(self.monitor.throttled)
+        self.assertEqual(95.0, self.monitor.summary()["swap_used_percent"])
+
+    def test_process_rss(self):
+        write_meminfo(self.proc_path, 1024 * 1024, 512 * 1024)
+        write_status(self.proc_path, 101, 2048)
+        write_status(self.proc_path, 102, 1024)
+
+        # 103 has ended
+        self.monitor.sample([101, 102, 103])
+        self.assertEqual({101: 2.0, 102: 1.0}, self.monitor.rss_mb())
+
+        summary = self.monitor.summary()
+        self.assertEqual(1024.0, summary["memory_total_mb"])
+        self.assertEqual(50.0, summary["memory_used_percent"])
+        self.assertEqual(3.0, summary["etl_process_rss_mb"])
+        self.assertFalse(summary["throttled"])
+
+        # processes not in the latest sample are dropped
+        self.monitor.sample([102])
+        self.assertEqual({102: 1.0}, self.monitor.rss_mb())
+
+    def test_no_proc(self):
+        monitor = ResourceMonitor(proc_path=os.path.join(self.proc_path, "missing"))
+        self.assertFalse(monitor.available)
+        self.assertFalse(monitor.throttled)
+        self.assertIsNone(monitor.summary()["sampled_at"])
@@ -0,0 +1,81 @@
+import math
+import unittest
+
+import ayeaye
+
+from fossa.control.broker import AbstractMycorrhiza
+from fossa.control.capacity import ProcessingSlots
+from fossa.control.resources import (
+    NodeResources,
+    requirements_for,
+    ResourceRequirements,
+    resources,
+)
+
+
+class LookupEtl(ayeaye.Model):
+    fossa_resources = {"cpu": 1, "memory_mb": 50}
+
+    def build(self):
+        pass
+
+    @resources(cpu=2, memory_mb=8192, io_weight=1)
+    def aggregate(self):
+        pass
+
+
+class TestResourceRequirements(unittest.TestCase):
+    def test_requirements_for(self):
+        self.assertEqual(
+            ResourceRequirements(cpu=1, memory_mb=50), requirements_for(LookupEtl, "build")
+        )
+        self.assertEqual(
+            ResourceRequirements(cpu=2, memory_mb=8192, io_weight=1),
+            requirements_for(LookupEtl, "aggregate"),
+            "Method's declaration comes first",
+        )
+        self.assertEqual(ResourceRequirements(), requirements_for(ayeaye.Model, "build"))
+
+
+class TestNodeResources(unittest.TestCase):
+    def setUp(self):
+        self.node_resources = NodeResources()
+        self.node_resources.set_totals(cpu=4, memory_mb=10000, io_weight=10)
+
+    def test_multi_dimensional_fit(self):
+        big = ResourceRequirements(cpu=1, memory_mb=8000)
+        small = ResourceRequirements(cpu=1, memory_mb=50)
+
+        self.assertTrue(self.node_resources.reserve(big))
+        self.assertFalse(self.node_resources.reserve(big), "Not enough memory left")
+        self.assertTrue(self.node_resources.reserve(small))
+        self.assertEqual(0, self.node_resources.headroom(big))
+        self.assertEqual(2, self.node_resources.headroom(small), "Limited by CPUs")
+
+        self.node_resources.release(big)
+        self.assertEqual(
+            {"cpu": 1.0, "memory_mb": 50.0, "io_weight": 0.0}, self.node_resources.in_use()
+        )
+
+    def test_could_fit(self):
+        self.assertTrue(self.node_resources.could_fit(ResourceRequirements(cpu=4)))
+        self.assertFalse(self.node_resources.could_fit(ResourceRequirements(memory_mb=20000)))
+
+    def test_nothing_declared(self):
+        nothing = ResourceRequirements()
+        self.assertEqual(math.inf, self.node_resources.headroom(nothing))
+        self.node_resources.set_totals(cpu=0)
+        self.assertTrue(self.node_resources.reserve(nothing))
+
+    def test_sidecar_task_window(self):
+        slots = ProcessingSlots()
+        slots.set_capacity(8)
+
+        sidecar = AbstractMycorrhiza()
+        self.assertEqual(8, sidecar.task_window(slots))
+
+        sidecar.node_resources = self.node_resources
+        self.assertEqual(8, sidecar.task_window(slots), "Typical task doesn't need anything")
+
+        sidecar.typical_task_resources = ResourceRequirements(memory_mb=4000)
+        self.assertEqual(2, sidecar.task_window(slots))
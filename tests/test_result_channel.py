@@ -0,0 +1,54 @@
+from multiprocessing import shared_memory
+import unittest
+
+from fossa.control.message import ResultsMessage
+from fossa.control.result_channel import (
+    ResultLost,
+    SharedMemoryResult,
+    SharedMemoryResultChannel,
+)
+
+
+class TestSharedMemoryResultChannel(unittest.TestCase):
+    def test_round_trip(self):
+        channel = SharedMemoryResultChannel(min_bytes=100)
+        task_message = '{"type": "TaskComplete", "payload": "' + "é" * 100 + '"}'
+
+        sent = channel.send(ResultsMessage(task_id="task_0", task_message=task_message))
+        self.assertIsInstance(sent.task_message, SharedMemoryResult)
+        self.assertTrue(sent.task_message.segment_name.startswith(channel.segment_prefix))
+
+        received = channel.receive(sent)
+        self.assertEqual(ResultsMessage(task_id="task_0", task_message=task_message), received)
+
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(name=sent.task_message.segment_name)
+
+    def test_small_results_unchanged(self):
+        channel = SharedMemoryResultChannel(min_bytes=100)
+        result_spec = ResultsMessage(task_id="task_0", task_message="{}")
+        self.assertIs(result_spec, channel.send(result_spec))
+        self.assertIs(result_spec, channel.receive(result_spec))
+
+        channel.min_bytes = None
+        result_spec = ResultsMessage(task_id="task_0", task_message="{}" * 100)
+        self.assertIs(result_spec, channel.send(result_spec))
+
+    def test_discard(self):
+        channel = SharedMemoryResultChannel(min_bytes=1)
+        sent = channel.send(ResultsMessage(task_id="task_0", task_message="{}"))
+
+        channel.discard("task_0")
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(name=sent.task_message.segment_name)
+
+        # nothing to discard
+        channel.discard("task_0")
+
+    def test_segment_gone(self):
+        channel = SharedMemoryResultChannel(min_bytes=1)
+        sent = channel.send(ResultsMessage(task_id="task_0", task_message="{}"))
+        channel.discard("task_0")
+
+        with self.assertRaises(ResultLost):
+            channel.receive(sent)
@@ -0,0 +1,66 @@
+from datetime import datetime
+import json
+import os
+import tempfile
+import unittest
+
+from fossa.control.message import ResultsMessage, TaskMessage
+from fossa.control.task_history import TaskHistory
+
+
+def finished_task(task_id, message_type="TaskComplete"):
+    "@return: (dict) like the governor's `process_details` for a finished task"
+    task_spec = TaskMessage(
+        task_id=task_id,
+        model_class="NothingEtl",
+        method="go",
+        method_kwargs={},
+        resolver_context={},
+        on_completion_callback=None,
+    )
+    task_message = json.dumps({"type": message_type, "payload": {}})
+    return {
+        "task_spec": task_spec,
+        "started": datetime.utcnow(),
+        "finished": datetime.utcnow(),
+        "proc_id": 123,
+        "result_spec": ResultsMessage(task_id=task_id, task_message=task_message),
+    }
+
+
+class TestTaskHistory(unittest.TestCase):
+    def test_bounded_and_indexed(self):
+        history = TaskHistory(max_entries=3)
+        for task_number in range(5):
+            history.append(finished_task(f"task_{task_number}"))
+
+        self.assertEqual(3, len(history))
+        self.assertIsNone(history.get("task_1"), "Oldest tasks should be discarded")
+
+        summary = history.get("task_4")
+        self.assertEqual("complete", summary["status"])
+        self.assertEqual("TaskComplete", summary["results"]["type"])
+
+        task_ids = [t["task_id"] for t in history.summaries()]
+        self.assertEqual(["task_4", "task_3", "task_2"], task_ids, "Most recent first")
+
+    def test_failed_status(self):
+        history = TaskHistory()
+        history.append(finished_task("task_0", message_type="TaskFailed"))
+        self.assertEqual("failed", history.get("task_0")["status"])
+
+    def test_spill_to_sqlite(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            spill_path = os.path.join(temp_dir, "task_history.sqlite")
+            history = TaskHistory(max_entries=2, spill_path=spill_path)
+            for task_number in range(4):
+                history.append(finished_task(f"task_{task_number}"))
+
+            self.assertEqual(2, len(history.summaries()), "Only in memory tasks are listed")
+
+            summary = history.get("task_0")
+            self.assertEqual("task_0", summary["task_id"])
+            self.assertEqual("complete", summary["status"])
+
+            self.assertIsNone(history.get("unknown_task"))
+            history.set_retention(max_entries=2)
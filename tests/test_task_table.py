@@ -0,0 +1,202 @@
+from datetime import datetime
+import multiprocessing
+import queue
+import threading
+import time
+import unittest
+
+from fossa.control.admission import AdmissionQueue, AdmissionQueueFull
+from fossa.control.capacity import ProcessingSlots
+from fossa.control.message import TaskMessage
+from fossa.control.priority import check_priority, priority_key
+from fossa.control.task_table import SharedTaskTable
+
+
+def make_task_spec(task_id, method_kwargs=None, priority=0):
+    return TaskMessage(
+        task_id=task_id,
+        model_class="NothingEtl",
+        method="go",
+        method_kwargs=method_kwargs or {},
+        resolver_context={},
+        on_completion_callback=None,
+        priority=priority,
+    )
+
+
+def read_task(task_table, task_id, results_queue):
+    "Runs in a separate process"
+    results_queue.put(task_table.get(task_id))
+
+
+class TestSharedTaskTable(unittest.TestCase):
+    def setUp(self):
+        self.task_table = SharedTaskTable(slots=2)
+
+    def tearDown(self):
+        self.task_table.close()
+
+    def test_add_get_remove(self):
+        started = datetime.utcnow()
+        self.assertTrue(self.task_table.add(make_task_spec("task_0"), pid=123, started=started))
+        self.assertTrue(self.task_table.add(make_task_spec("task_1"), pid=124, started=started))
+        self.assertFalse(self.task_table.add(make_task_spec("task_2"), pid=125, started=started))
+
+        record = self.task_table.get("task_1")
+        self.assertEqual(124, record["proc_id"])
+        self.assertEqual("running", record["state"])
+        self.assertEqual("NothingEtl", record["task_spec"]["model_class"])
+        self.assertEqual(started.replace(microsecond=0), record["started"].replace(microsecond=0))
+
+        self.task_table.remove("task_0")
+        self.assertIsNone(self.task_table.get("task_0"))
+        self.assertEqual(1, len(self.task_table))
+        self.assertTrue(self.task_table.add(make_task_spec("task_2"), pid=125, started=started))
+
+    def test_large_task_details_truncated(self):
+        task_spec = make_task_spec("task_0", method_kwargs={"data": "x" * 5000})
+        self.task_table.add(task_spec, pid=123, started=datetime.utcnow())
+
+        task_details = self.task_table.get("task_0")["task_spec"]
+        self.assertTrue(task_details["details_truncated"])
+        self.assertEqual("NothingEtl", task_details["model_class"])
+
+    def test_read_from_spawned_process(self):
+        self.task_table.add(make_task_spec("task_0"), pid=123, started=datetime.utcnow())
+
+        mp_context = multiprocessing.get_context("spawn")
+        results_queue = mp_context.Queue()
+        proc = mp_context.Process(target=read_task, args=(self.task_table, "task_0", results_queue))
+        proc.start()
+        record = results_queue.get(timeout=10)
+        proc.join()
+
+        self.assertEqual(123, record["proc_id"])
+
+    def test_queued_task_becomes_running(self):
+        started = datetime.utcnow()
+        task_spec = make_task_spec("task_0")
+        self.task_table.add(task_spec, pid=0, started=started, state=SharedTaskTable.QUEUED)
+        self.assertEqual("queued", self.task_table.get("task_0")["state"])
+
+        # same slot is updated
+        self.task_table.add(task_spec, pid=123, started=started)
+        self.assertEqual("running", self.task_table.get("task_0")["state"])
+        self.assertEqual(1, len(self.task_table))
+
+
+class TestAdmissionQueue(unittest.TestCase):
+    def test_full(self):
+        admission_queue = AdmissionQueue(depth=1)
+        admission_queue.put(make_task_spec("task_0"))
+        self.assertEqual(1, len(admission_queue))
+
+        with self.assertRaises(AdmissionQueueFull):
+            admission_queue.put(make_task_spec("task_1"))
+
+    def test_put_many_all_or_nothing(self):
+        admission_queue = AdmissionQueue(depth=3)
+        admission_queue.put(make_task_spec("task_0"))
+
+        with self.assertRaises(AdmissionQueueFull):
+            admission_queue.put_many([make_task_spec(f"task_{i}") for i in range(1, 4)])
+        self.assertEqual(1, len(admission_queue))
+
+        admission_queue.put_many([make_task_spec(f"task_{i}") for i in range(1, 3)])
+        self.assertEqual(3, len(admission_queue))
+
+    def test_tasks_wait_for_slots(self):
+        admission_queue = AdmissionQueue(depth=5)
+        task_table = SharedTaskTable(slots=5)
+        slots = ProcessingSlots()
+        slots.set_capacity(1)
+        work_queue = multiprocessing.Queue()
+        state_changed = threading.Event()
+
+        thread = threading.Thread(
+            target=admission_queue.run_forever,
+            args=(work_queue, slots, task_table, state_changed.set),
+        )
+        thread.start()
+        try:
+            for task_id in ["task_0", "task_1"]:
+                admission_queue.put(make_task_spec(task_id))
+
+            self.assertEqual("task_0", work_queue.get(timeout=5).task_id)
+            self.assertTrue(state_changed.wait(timeout=5))
+
+            # no free slot for the second task
+            with self.assertRaises(queue.Empty):
+                work_queue.get(timeout=0.3)
+            self.assertEqual("queued", task_table.get("task_1")["state"])
+            self.assertEqual(1, len(admission_queue))
+
+            slots.release()
+            self.assertEqual("task_1", work_queue.get(timeout=5).task_id)
+            self.assertEqual(0, len(admission_queue))
+        finally:
+            admission_queue.stop()
+            thread.join(timeout=5)
+            task_table.close()
+
+        self.assertFalse(thread.is_alive())
+
+    def test_highest_priority_first(self):
+        admission_queue = AdmissionQueue(depth=5)
+        task_table = SharedTaskTable(slots=5)
+        slots = ProcessingSlots()
+        slots.set_capacity(1)
+        slots.acquire()
+        work_queue = multiprocessing.Queue()
+        state_changed = threading.Event()
+
+        thread = threading.Thread(
+            target=admission_queue.run_forever,
+            args=(work_queue, slots, task_table, state_changed.set),
+        )
+        thread.start()
+        try:
+            admission_queue.put_many(
+                [
+                    make_task_spec("low", priority=0),
+                    make_task_spec("high", priority=5),
+                    make_task_spec("low_again", priority=0),
+                ]
+            )
+            self.assertTrue(state_changed.wait(timeout=5))
+            for _ in range(50):
+                if all(task_table.get(t) for t in ["low", "high", "low_again"]):
+                    break
+                time.sleep(0.1)
+
+            started = []
+            for _ in range(3):
+                slots.release()
+                started.append(work_queue.get(timeout=5).task_id)
+            self.assertEqual(["high", "low", "low_again"], started)
+        finally:
+            admission_queue.stop()
+            thread.join(timeout=5)
+            task_table.close()
+
+
+class TestPriority(unittest.TestCase):
+    def test_check_priority(self):
+        self.assertEqual(3, check_priority(3))
+        for invalid in [-1, 10, 2.5, "1", True]:
+            with self.assertRaises(ValueError):
+                check_priority(invalid)
+
+    def test_waiting_tasks_age(self):
+        old_low = make_task_spec("old_low", priority=1)
+        new_high = make_task_spec("new_high", priority=3)
+        old_low.created_at = new_high.created_at - 150
+        now = new_high.created_at
+
+        def ordered(aging_seconds):
+            tasks = sorted([new_high, old_low], key=lambda t: priority_key(t, now, aging_seconds))
+            return [t.task_id for t in tasks]
+
+        self.assertEqual(["new_high", "old_low"], ordered(None))
+        self.assertEqual(["new_high", "old_low"], ordered(100.0), "1.5 levels of aging")
+        self.assertEqual(["old_low", "new_high"], ordered(60.0), "2.5 levels of aging")
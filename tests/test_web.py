@@ -6,3 +6,11 @@ class TestWeb(BaseTest):
         resp = self.test_client.get("/")
         self.assertEqual(200, resp.status_code)
         self.assertIn("Fossa", str(resp.data))
+
+    def test_metrics(self):
+        self.governor.metrics.inc("fossa_tasks_started_total")
+
+        resp = self.test_client.get("/metrics")
+        self.assertEqual(200, resp.status_code)
+        self.assertTrue(resp.content_type.startswith("text/plain; version=0.0.4"))
+        self.assertIn("fossa_tasks_started_total 1.0\n", resp.get_data(as_text=True))